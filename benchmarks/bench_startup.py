@@ -0,0 +1,122 @@
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_suite import DATASETS_DIR, SERVER_DIR, build_index, server_environment  # noqa: E402
+from fakes import FakeServices, create_faults  # noqa: E402
+
+
+def import_times(env, top=10):
+    # python -X importtime writes "import time: self | cumulative | name" per module to stderr,
+    # with nesting shown by indentation; the server's own imports are the ones one level below app
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=SERVER_DIR, env=env,
+                             capture_output=True, text=True, check=True)
+    total, direct = None, []
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if name.strip() == 'app' and not name.startswith('  '):
+            total = int(cumulative) / 1000
+        elif name.startswith('   ') and not name.startswith('    '):
+            direct.append((int(cumulative) / 1000, name.strip()))
+    return total, sorted(direct, reverse=True)[:top]
+
+
+def import_seconds(env, repeats):
+    # Wall time of "import app" in a fresh interpreter, without importtime's own overhead
+    code = 'import time; started = time.perf_counter(); import app; print(time.perf_counter() - started)'
+    return [float(subprocess.run([sys.executable, '-c', code], cwd=SERVER_DIR, env=env, capture_output=True,
+                                 text=True, check=True).stdout.strip().splitlines()[-1]) for _ in range(repeats)]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(url, deadline, status=200):
+    while time.perf_counter() < deadline:
+        try:
+            if requests.get(url, timeout=1).status_code == status:
+                return time.perf_counter()
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.01)
+    raise TimeoutError(f'{url} did not answer {status}')
+
+
+def start_once(env, args):
+    # Seconds from spawning the server to: accepting connections (/healthz), finishing warm-up
+    # (/readyz) and answering the first question, plus the first and second answer latencies
+    port = free_port()
+    url = f'http://127.0.0.1:{port}'
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, '-m', 'hypercorn', 'app:create_app()', '--bind', f'127.0.0.1:{port}',
+                                '--workers', str(args.workers)], cwd=SERVER_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = started + args.timeout
+        live = wait_for(f'{url}/healthz', deadline) - started
+        # Without warm-up /readyz is ready at once, and the first request builds the clients
+        ready = wait_for(f'{url}/readyz', deadline) - started
+        answers = []
+        for i in range(2):
+            began = time.perf_counter()
+            response = requests.post(f'{url}/get_answer', data={'question': f'How do I get food stamps? ({i})',
+                                                                 'language': args.language}, timeout=args.timeout)
+            response.raise_for_status()
+            answers.append(time.perf_counter() - began)
+        return {'live': live, 'ready': ready, 'first_answer': answers[0], 'second_answer': answers[1],
+                'first_response': ready + answers[0]}
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Server import time and time to first response')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--language', default='es')
+    parser.add_argument('--pages', type=int, default=20000, help='documents in the local vector index')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every fake service call')
+    parser.add_argument('--timeout', type=float, default=60)
+    args = parser.parse_args()
+
+    faults = create_faults({service: args.latency for service in ('translation', 'embedding', 'completion')})
+    services = FakeServices(faults, DATASETS_DIR).start()
+    try:
+        with tempfile.TemporaryDirectory() as index_path:
+            build_index(index_path, args.pages)
+            env = dict(os.environ, **server_environment(services, index_path), GENERATE_AUDIO='0')
+
+            total, direct = import_times(env)
+            seconds = import_seconds(env, args.repeats)
+            print(f"import app: {np.median(seconds) * 1000:.0f}ms wall (median of {args.repeats}), "
+                  f"{total:.0f}ms under -X importtime")
+            for cumulative, name in direct:
+                print(f"  {name:<24}{cumulative:>8.1f}ms")
+
+            print(f"\n{'startup':<12}{'live ms':>10}{'ready ms':>10}{'1st ans ms':>12}{'2nd ans ms':>12}"
+                  f"{'1st response ms':>17}")
+            for name, warmup in (('warm-up', 'tokenizer,retriever,embeddings,llm'), ('lazy', '')):
+                runs = [start_once(dict(env, WARMUP=warmup), args) for _ in range(args.repeats)]
+                median = {key: np.median([run[key] for run in runs]) * 1000 for key in runs[0]}
+                print(f"{name:<12}{median['live']:>10.0f}{median['ready']:>10.0f}{median['first_answer']:>12.0f}"
+                      f"{median['second_answer']:>12.0f}{median['first_response']:>17.0f}")
+    finally:
+        services.stop()
+
+
+if __name__ == '__main__':
+    main()
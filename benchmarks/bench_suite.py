@@ -0,0 +1,416 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_DIR = os.path.join(ROOT, 'server')
+PIPELINE_DIR = os.path.join(ROOT, 'nyc_data_pipeline')
+DATASETS_DIR = os.path.join(ROOT, 'datasets')
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+
+DEFAULT_LATENCY = {'translation': 0.05, 'embedding': 0.05, 'completion': 0.3, 'retrieval': 0.02, 'tts': 0.1,
+                   'stt': 0.4, 'soda': 0.05}
+QUESTIONS = ['How do I get help with food stamps?', 'Where can I find a homeless shelter?',
+             'How do I report a noise complaint?', 'How do I apply for public housing?',
+             'Where can I get a flu shot?', 'How do I find a food pantry near me?']
+
+
+def peak_rss_mb():
+    # VmHWM is per address space and starts fresh in each scenario process; ru_maxrss would
+    # carry over the parent's peak across exec
+    try:
+        with open('/proc/self/status') as file:
+            for line in file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / 1024
+
+
+def summarize(latencies, errors, seconds, **extra):
+    latencies = np.asarray(latencies) * 1000
+    result = {'count': len(latencies), 'errors': errors, 'seconds': round(seconds, 4),
+              'throughput': round(len(latencies) / seconds, 3) if seconds else None}
+    for q in (50, 95, 99):
+        result[f'p{q}_ms'] = round(float(np.percentile(latencies, q)), 3) if len(latencies) else None
+    result['peak_rss_mb'] = round(peak_rss_mb(), 1)
+    result.update(extra)
+    return result
+
+
+def question(i, distinct):
+    base = QUESTIONS[i % len(QUESTIONS)]
+    return f'{base} ({i % distinct})' if distinct > len(QUESTIONS) else base
+
+
+def build_index(index_path, pages=200):
+    if SERVER_DIR not in sys.path:
+        sys.path.insert(0, SERVER_DIR)
+    from fakes import fake_vector
+    from retriever import LocalRetriever
+
+    pages = [f'NYC service page {i} about food, housing, shelters, health and benefits.' for i in range(pages)]
+    LocalRetriever.build(index_path, [f'https://www.nyc.gov/page-{i}' for i in range(len(pages))],
+                         [fake_vector(page) for page in pages], [{'page_text': page} for page in pages])
+
+
+def server_environment(services, index_path):
+    # Points every client the server creates at the fakes and the local index
+    return {
+        'RETRIEVER_BACKEND': 'local',
+        'LOCAL_INDEX_PATH': index_path,
+        'EMBEDDING_CACHE_PATH': '',
+        'TRANSLATION_CACHE_PATH': '',
+        'OPENAI_API_KEY': 'fake',
+        'OPENAI_API_BASE': f'{services.url}/v1',
+        'TRANSLATION_URL': f'{services.url}/translate',
+    }
+
+
+def configure_server(services, index_path, faults):
+    # Module-level settings are read at import, so the environment is set before the import
+    build_index(index_path)
+    os.environ.update(server_environment(services, index_path))
+    from fakes import FakeSpeech
+
+    import rag_generation
+    import text_to_voice
+    from fakes import FaultyRetriever
+
+    rag_generation.retriever.set(FaultyRetriever(rag_generation.retriever.get(), faults['retrieval']))
+    FakeSpeech.faults = faults
+    text_to_voice.tts.set(text_to_voice.TextToSpeech(speech=FakeSpeech))
+    return rag_generation
+
+
+async def wait_ready(client, timeout=60):
+    # Requests are timed once the worker has warmed up, as a load balancer would route them
+    deadline = time.perf_counter() + timeout
+    while (await client.get('/readyz')).status_code != 200:
+        if time.perf_counter() > deadline:
+            raise TimeoutError('server did not become ready')
+        await asyncio.sleep(0.05)
+
+
+def scenario_answer_nyc_question(args, services, faults):
+    with tempfile.TemporaryDirectory() as index_path:
+        rag_generation = configure_server(services, index_path, faults)
+        latencies, errors = [], 0
+        start = time.perf_counter()
+        for i in range(args.requests):
+            began = time.perf_counter()
+            try:
+                answer, _ = rag_generation.answer_nyc_question(question(i, args.distinct))
+                errors += answer.startswith('Sorry')
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - began)
+        return summarize(latencies, errors, time.perf_counter() - start,
+                         answer_cache=rag_generation.answer_cache.stats())
+
+
+async def scenario_get_answer(args, services, faults):
+    with tempfile.TemporaryDirectory() as index_path:
+        configure_server(services, index_path, faults)
+        from app import app
+
+        latencies, errors = [], 0
+        async with app.test_app() as test_app:
+            client = test_app.test_client()
+            await wait_ready(client)
+            semaphore = asyncio.Semaphore(args.concurrency)
+
+            async def one_request(i):
+                nonlocal errors
+                async with semaphore:
+                    began = time.perf_counter()
+                    response = await client.post('/get_answer', form={'question': question(i, args.distinct),
+                                                                      'language': args.language})
+                    await response.get_data()
+                    latencies.append(time.perf_counter() - began)
+                    errors += response.status_code != 200
+
+            start = time.perf_counter()
+            await asyncio.gather(*(one_request(i) for i in range(args.requests)))
+            seconds = time.perf_counter() - start
+            stats = await (await client.get('/cache_stats')).get_json()
+        return summarize(latencies, errors, seconds, concurrency=args.concurrency, caches=stats)
+
+
+async def scenario_get_answer_audio(args, services, faults):
+    # WAV uploads at 44.1 kHz, mono and stereo; decoding, VAD and resampling are measured for real
+    with tempfile.TemporaryDirectory() as index_path:
+        configure_server(services, index_path, faults)
+        from app import app
+        from fakes import FakeSpeechToText, synthetic_wav
+
+        recordings = [synthetic_wav(seconds=4.0 + i % 3, channels=1 + i % 2, seed=i) for i in range(6)]
+        latencies, errors = [], 0
+        async with app.test_app() as test_app:
+            # create_clients has run by now; swap the local model for the fake
+            app.speech_to_text = FakeSpeechToText(faults['stt'], QUESTIONS)
+            client = test_app.test_client()
+            await wait_ready(client)
+            semaphore = asyncio.Semaphore(args.concurrency)
+
+            async def one_request(i):
+                nonlocal errors
+                async with semaphore:
+                    began = time.perf_counter()
+                    recording = recordings[i % len(recordings)]
+                    response = await client.post(f'/get_answer_audio?language={args.language}',
+                                                 data=recording, headers={'Content-Type': 'audio/wav'})
+                    await response.get_data()
+                    latencies.append(time.perf_counter() - began)
+                    errors += response.status_code != 200
+
+            start = time.perf_counter()
+            await asyncio.gather(*(one_request(i) for i in range(args.requests)))
+            seconds = time.perf_counter() - start
+        return summarize(latencies, errors, seconds, concurrency=args.concurrency,
+                         audio_mb=round(sum(map(len, recordings)) / len(recordings) / 1e6, 2))
+
+
+async def scenario_get_answer_burst(args, services, faults):
+    # Every request arrives at once, spread over --distinct questions written with varying case
+    # and punctuation, as during a public event. Set COMPLETION_CONCURRENCY, COMPLETION_QUEUE or
+    # COMPLETION_RATE in the environment to see requests shed with 429/503.
+    with tempfile.TemporaryDirectory() as index_path:
+        configure_server(services, index_path, faults)
+        import admission
+        from app import app, flights
+
+        latencies, statuses, retry_after = [], {}, 0
+        async with app.test_app() as test_app:
+            client = test_app.test_client()
+            await wait_ready(client)
+
+            async def one_request(i):
+                nonlocal retry_after
+                text = question(i, args.distinct)
+                text = [text, text.lower(), text.upper().rstrip('?'), f'  {text}  '][i % 4]
+                began = time.perf_counter()
+                response = await client.post('/get_answer', form={'question': text, 'language': args.language})
+                await response.get_data()
+                latencies.append(time.perf_counter() - began)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                retry_after += 'Retry-After' in response.headers
+
+            start = time.perf_counter()
+            await asyncio.gather(*(one_request(i) for i in range(args.requests)))
+            seconds = time.perf_counter() - start
+        return summarize(latencies, args.requests - statuses.get(200, 0), seconds,
+                         statuses={str(status): count for status, count in sorted(statuses.items())},
+                         retry_after=retry_after, coalescing={stage: flight.stats() for stage, flight in flights.items()},
+                         upstreams=admission.stats())
+
+
+def browse_url(services, args):
+    return f'{services.url}/browse?q={args.query}'
+
+
+async def scenario_public_data_fetcher(args, services, faults):
+    from source_extract_async import NYCPublicDataFetcher
+
+    latencies, errors = [], 0
+    start = time.perf_counter()
+    for _ in range(args.repeats):
+        began = time.perf_counter()
+        data = await NYCPublicDataFetcher(browse_url(services, args)).run()
+        latencies.append(time.perf_counter() - began)
+        errors += not data
+    return summarize(latencies, errors, time.perf_counter() - start, datasets=len(data))
+
+
+async def scenario_endpoint_fetcher(args, services, faults):
+    from source_extract_async import NYCEndpointFetcher, NYCPublicDataFetcher
+
+    # Same shape as simple_app.fetch_endpoints_from_url hands to the endpoint fetcher
+    data = await NYCPublicDataFetcher(browse_url(services, args)).run()
+    data_dict = {url.split('/')[-2]: url.lower() for _, url in data.items()}
+    latencies, missing = [], 0
+    start = time.perf_counter()
+    for _ in range(args.repeats):
+        began = time.perf_counter()
+        endpoints = await NYCEndpointFetcher(backoff=0.05).run(data_dict)
+        latencies.append(time.perf_counter() - began)
+        missing += len(data_dict) - len(endpoints)
+    return summarize(latencies, missing, time.perf_counter() - start, pages_per_run=len(data_dict))
+
+
+async def scenario_save_endpoints(args, services, faults):
+    # simple_app imports streamlit; without it this scenario is reported as skipped
+    sys.path.insert(0, ROOT)
+    from simple_app import fetch_endpoints_from_url, save_endpoints_to_files
+
+    endpoints = await fetch_endpoints_from_url(browse_url(services, args))
+    latencies, errors, rows = [], 0, 0
+    start = time.perf_counter()
+    for _ in range(args.repeats):
+        with tempfile.TemporaryDirectory() as folder:
+            began = time.perf_counter()
+            results = await save_endpoints_to_files(endpoints, folder)
+            latencies.append(time.perf_counter() - began)
+            errors += sum(1 for stats in results.values() if stats.error)
+            rows += sum(stats.rows for stats in results.values())
+    seconds = time.perf_counter() - start
+    return summarize(latencies, errors, seconds, datasets=len(endpoints),
+                     rows_per_second=round(rows / seconds, 1) if seconds else None)
+
+
+def scenario_analyze_data(args, services, faults):
+    from chatbot import Chatbot
+
+    chatbot = Chatbot()
+    folders = sorted(os.path.join(args.datasets, name) for name in os.listdir(args.datasets) if name.endswith('_data'))
+
+    def one_pass():
+        latencies = []
+        for folder in folders:
+            chatbot.load_profiles(folder)
+            for dataset_name in sorted(chatbot.profiles):
+                began = time.perf_counter()
+                chatbot.analyze_data(dataset_name)
+                latencies.append(time.perf_counter() - began)
+        return latencies
+
+    # The first pass may build Parquet caches and profiles; the second is a Streamlit rerun
+    start = time.perf_counter()
+    one_pass()
+    first_pass = time.perf_counter() - start
+    start = time.perf_counter()
+    latencies = one_pass()
+    return summarize(latencies, 0, time.perf_counter() - start, folders=len(folders),
+                     first_pass_seconds=round(first_pass, 3))
+
+
+SCENARIOS = {
+    'answer_nyc_question': scenario_answer_nyc_question,
+    'get_answer': scenario_get_answer,
+    'get_answer_audio': scenario_get_answer_audio,
+    'get_answer_burst': scenario_get_answer_burst,
+    'public_data_fetcher': scenario_public_data_fetcher,
+    'endpoint_fetcher': scenario_endpoint_fetcher,
+    'save_endpoints': scenario_save_endpoints,
+    'analyze_data': scenario_analyze_data,
+}
+
+
+def run_scenario(args):
+    # Runs inside a fresh interpreter, so module-level clients and peak RSS belong to this scenario alone
+    sys.path[:0] = [os.path.dirname(os.path.abspath(__file__)), PIPELINE_DIR]
+    from fakes import FakeServices, create_faults
+
+    faults = create_faults(args.latency, args.error_rate, args.jitter, args.seed)
+    services = FakeServices(faults, args.datasets).start()
+    try:
+        function = SCENARIOS[args.scenario]
+        result = function(args, services, faults)
+        if asyncio.iscoroutine(result):
+            result = asyncio.run(result)
+    finally:
+        services.stop()
+    result['faults'] = {service: fault.stats() for service, fault in faults.items() if fault.calls}
+    return result
+
+
+def parse_settings(values, defaults=None):
+    # "service=value" pairs, e.g. --latency completion=0.5 --latency soda=0
+    settings = dict(defaults or {})
+    for value in values or []:
+        service, _, number = value.partition('=')
+        settings[service] = float(number)
+    return settings
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as file:
+        baseline = json.load(file)['scenarios']
+    print(f"\nchange against {baseline_path}")
+    for name, result in results.items():
+        before = baseline.get(name)
+        if not before or 'skipped' in result or 'skipped' in before:
+            continue
+        changes = []
+        for key in ('throughput', 'p50_ms', 'p95_ms', 'p99_ms', 'peak_rss_mb'):
+            if result.get(key) and before.get(key):
+                changes.append(f"{key} {100 * (result[key] - before[key]) / before[key]:+.1f}%")
+        print(f"{name:<22}{', '.join(changes)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end benchmarks against local fakes of every external service')
+    parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=60)
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--distinct', type=int, default=20, help='number of distinct questions')
+    parser.add_argument('--language', default='es')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--query', default='311', help='browse search; matches a datasets/{query}_data folder')
+    parser.add_argument('--datasets', default=DATASETS_DIR)
+    parser.add_argument('--latency', action='append', help='service=seconds; services: translation, embedding, '
+                                                           'completion, retrieval, tts, stt, soda')
+    parser.add_argument('--error-rate', action='append', help='service=fraction of calls that fail')
+    parser.add_argument('--jitter', type=float, default=0.2, help='latency varies by +/- this fraction')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='results file (default: benchmarks/results/<timestamp>.json)')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    parser.add_argument('--scenario', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.latency = parse_settings(args.latency, DEFAULT_LATENCY)
+    args.error_rate = parse_settings(args.error_rate)
+
+    if args.scenario:
+        print(json.dumps(run_scenario(args)))
+        return
+
+    results = {}
+    print(f"{'scenario':<22}{'count':>7}{'errors':>8}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+          f"{'peak MB':>9}")
+    for name in args.scenarios:
+        with tempfile.TemporaryDirectory() as workdir:
+            # Scenario processes write their catalogs and caches under a scratch directory
+            process = subprocess.run([sys.executable, os.path.abspath(__file__), '--scenario', name] + sys.argv[1:]
+                                     + ['--datasets', os.path.abspath(args.datasets)],
+                                     cwd=workdir, capture_output=True, text=True)
+        if process.returncode != 0:
+            error = process.stderr.strip().splitlines()[-1] if process.stderr.strip() else 'failed'
+            results[name] = {'skipped': error}
+            print(f"{name:<22}skipped: {error}")
+            continue
+        result = results[name] = json.loads(process.stdout.strip().splitlines()[-1])
+        print(f"{name:<22}{result['count']:>7}{result['errors']:>8}{result['throughput']:>9.2f}"
+              f"{result['p50_ms']:>10.1f}{result['p95_ms']:>10.1f}{result['p99_ms']:>10.1f}{result['peak_rss_mb']:>9.1f}")
+
+    commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True)
+    report = {
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': commit.stdout.strip() or None,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'settings': {key: value for key, value in vars(args).items() if key not in ('output', 'compare', 'scenario')},
+        'scenarios': results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, time.strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f"\nresults saved to {output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
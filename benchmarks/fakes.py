@@ -0,0 +1,331 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import struct
+import threading
+import time
+
+import numpy as np
+from aiohttp import web
+
+EMBEDDING_DIM = 1536
+SERVICES = ('translation', 'embedding', 'completion', 'retrieval', 'tts', 'stt', 'soda')
+
+# Socrata's keyset and watermark clauses, as written by SODADownloader.page_params/refresh
+WHERE_CLAUSE = re.compile(r"(:id|:updated_at)\s*(>=|>)\s*'([^']*)'")
+
+
+class Fault:
+    # Latency and error injection for one fake service. Draws come from a seeded generator, so
+    # two runs with the same settings see the same delays and the same failed calls.
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.failures = 0
+
+    def draw(self):
+        with self.lock:
+            delay = self.latency * (1 + self.jitter * (2 * self.random.random() - 1))
+            failed = self.random.random() < self.error_rate
+            self.calls += 1
+            self.failures += failed
+        return max(delay, 0.0), failed
+
+    async def apply(self):
+        delay, failed = self.draw()
+        await asyncio.sleep(delay)
+        return failed
+
+    def apply_sync(self):
+        delay, failed = self.draw()
+        time.sleep(delay)
+        return failed
+
+    def stats(self):
+        return {'calls': self.calls, 'failures': self.failures}
+
+
+def create_faults(latency=None, error_rate=None, jitter=0.0, seed=0):
+    latency = latency or {}
+    error_rate = error_rate or {}
+    return {service: Fault(latency.get(service, 0.0), jitter, error_rate.get(service, 0.0), seed + i)
+            for i, service in enumerate(SERVICES)}
+
+
+def fake_vector(text, dim=EMBEDDING_DIM):
+    # Same text, same unit vector, like embeddings.HashEmbedder
+    seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+    vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def injected_error():
+    return web.json_response({'error': {'message': 'injected failure', 'type': 'server_error'}}, status=503)
+
+
+class FakeDatasets:
+    # The real files under datasets/*_data, served the way data.cityofnewyork.us serves them:
+    # a browse page per search, a landing page per dataset and a SODA resource endpoint
+
+    def __init__(self, root):
+        self.root = root
+        self.folders = {}
+        self.paths = {}
+        for folder in sorted(os.listdir(root)):
+            if not folder.endswith('_data'):
+                continue
+            for filename in sorted(os.listdir(os.path.join(root, folder))):
+                if filename.endswith('.json'):
+                    view_id = f'view-{len(self.paths):04d}'
+                    self.paths[view_id] = os.path.join(root, folder, filename)
+                    self.folders.setdefault(folder[:-len('_data')], []).append(view_id)
+        self.rows = {}
+
+    def search(self, query):
+        return self.folders.get(query) or [view_id for view_ids in self.folders.values() for view_id in view_ids]
+
+    def name(self, view_id):
+        return os.path.splitext(os.path.basename(self.paths[view_id]))[0]
+
+    def records(self, view_id):
+        if view_id not in self.rows:
+            with open(self.paths[view_id], 'r') as file:
+                records = json.load(file)
+            # System fields sort in file order, so keyset pages come back in a stable order
+            self.rows[view_id] = [dict(record, **{':id': f'row-{i:08d}', ':updated_at': '2024-01-01T00:00:00.000Z'})
+                                  for i, record in enumerate(records)]
+        return self.rows[view_id]
+
+    def query(self, view_id, params):
+        rows = self.records(view_id)
+        for field, op, value in WHERE_CLAUSE.findall(params.get('$where', '')):
+            rows = [row for row in rows if row.get(field, '') >= value and (op == '>=' or row.get(field, '') > value)]
+        if params.get('$select', '').startswith('count('):
+            return [{'count': str(len(rows))}]
+        if params.get('$select', '').startswith('max(:updated_at)'):
+            return [{'watermark': max((row[':updated_at'] for row in rows), default=None)}]
+        offset = int(params.get('$offset', 0))
+        limit = int(params.get('$limit', 1000))
+        return rows[offset:offset + limit]
+
+
+def create_fake_app(faults, datasets_root, browse_results=10):
+    # Stand-ins for the translation service, the OpenAI embeddings and chat endpoints and the
+    # NYC Open Data portal, on one local port
+    datasets = FakeDatasets(datasets_root)
+
+    async def translate(request):
+        body = await request.json() if request.content_type == 'application/json' else await request.post()
+        if await faults['translation'].apply():
+            return injected_error()
+        if isinstance(body['q'], list):
+            return web.json_response({'translatedText': [f'[{body["target"]}] {q}' for q in body['q']]})
+        return web.json_response({'translatedText': f'[{body["target"]}] {body["q"]}'})
+
+    async def embeddings(request):
+        body = await request.json()
+        if await faults['embedding'].apply():
+            return injected_error()
+        inputs = body['input'] if isinstance(body['input'], list) else [body['input']]
+        return web.json_response({'data': [
+            {'index': i, 'embedding': fake_vector(text).tolist()} for i, text in enumerate(inputs)
+        ]})
+
+    async def chat(request):
+        body = await request.json()
+        if await faults['completion'].apply():
+            return injected_error()
+        question = body['messages'][-1]['content'].rsplit('Question:', 1)[-1].strip()
+        answer = f'Fake answer to {question} You can apply online or call 311. Offices are open on weekdays.'
+        if not body.get('stream'):
+            return web.json_response({
+                'id': 'fake', 'object': 'chat.completion', 'model': body['model'],
+                'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': answer}}],
+                'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0},
+            })
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        await response.prepare(request)
+        for token in re.findall(r'\S+\s*', answer):
+            chunk = {'id': 'fake', 'object': 'chat.completion.chunk', 'model': body['model'],
+                     'choices': [{'index': 0, 'delta': {'content': token}, 'finish_reason': None}]}
+            await response.write(f'data: {json.dumps(chunk)}\n\n'.encode())
+        await response.write(b'data: [DONE]\n\n')
+        return response
+
+    def base_url(request):
+        return f'{request.scheme}://{request.host}'
+
+    async def browse(request):
+        if await faults['soda'].apply():
+            return web.Response(status=503)
+        results = ''.join(
+            f'<div class="browse2-result" data-view-id="{view_id}"><a class="browse2-result-name-link" '
+            f'href="{base_url(request)}/benchmarks/{datasets.name(view_id)}/{view_id}">{datasets.name(view_id)}</a></div>'
+            for view_id in datasets.search(request.query.get('q', ''))[:browse_results])
+        return web.Response(text=f'<html><body><div class="browse2-content">{results}</div></body></html>',
+                            content_type='text/html')
+
+    async def landing(request):
+        if await faults['soda'].apply():
+            return web.Response(status=503)
+        view_id = request.match_info['view_id']
+        if view_id not in datasets.paths:
+            return web.Response(status=404)
+        return web.Response(text=f'<html><body><a href="{base_url(request)}/resource/{view_id}.json">API</a> '
+                                 f'<a href="{base_url(request)}/api/views/{view_id}/rows.csv">CSV</a></body></html>',
+                            content_type='text/html')
+
+    async def resource(request):
+        if await faults['soda'].apply():
+            return web.Response(status=503)
+        view_id = request.match_info['view_id']
+        if view_id not in datasets.paths:
+            return web.Response(status=404)
+        return web.json_response(datasets.query(view_id, request.query))
+
+    fake = web.Application()
+    fake.router.add_post('/translate', translate)
+    fake.router.add_post('/v1/embeddings', embeddings)
+    fake.router.add_post('/v1/chat/completions', chat)
+    fake.router.add_get('/browse', browse)
+    fake.router.add_get('/benchmarks/{name}/{view_id}', landing)
+    fake.router.add_get('/resource/{view_id}.json', resource)
+    return fake
+
+
+class FakeServices:
+    # Runs the fake app on its own thread and event loop, so blocking clients (requests, the
+    # synchronous openai calls) and asyncio clients in the benchmark thread can both reach it
+
+    def __init__(self, faults, datasets_root, browse_results=10):
+        self.app = create_fake_app(faults, datasets_root, browse_results)
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.runner = None
+        self.port = None
+
+    async def serve(self):
+        self.runner = web.AppRunner(self.app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        return site._server.sockets[0].getsockname()[1]
+
+    def start(self):
+        self.thread.start()
+        self.port = asyncio.run_coroutine_threadsafe(self.serve(), self.loop).result()
+        return self
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.port}'
+
+
+class FakeSpeech:
+    # Same interface as msspeech.MSSpeech; "audio" is deterministic bytes sized like a short MP3
+    faults = None
+    voices = [{'Locale': locale, 'Name': f'Fake {locale} voice'} for locale in
+              ('en-US', 'en-GB', 'es-ES', 'es-MX', 'zh-CN', 'ru-RU', 'fr-FR', 'ar-SA', 'bn-IN', 'ko-KR')]
+    voiceName = ''
+
+    async def get_voices_list(self):
+        return self.voices
+
+    async def set_rate(self, rate):
+        pass
+
+    async def set_pitch(self, pitch):
+        pass
+
+    async def set_volume(self, volume):
+        pass
+
+    async def synthesize(self, text, buffer):
+        if not self.voiceName:
+            # msspeech looks the empty voice up and fails the same way
+            raise TypeError("'NoneType' object is not subscriptable")
+        if self.faults and await self.faults['tts'].apply():
+            raise ConnectionError('injected TTS failure')
+        digest = hashlib.sha256(text.encode('utf-8')).digest()
+        await buffer.write(b'ID3' + digest * (len(text) // 4 + 1))
+
+
+class FakeSpeechToText:
+    # Same interface as speech_to_text.SpeechToText; the latency of a local model is injected
+    # as a blocking sleep, since the real one holds a worker thread while it runs
+    def __init__(self, fault, transcripts):
+        self.fault = fault
+        self.transcripts = transcripts
+        self.calls = 0
+
+    def load(self):
+        pass
+
+    def transcribe(self, audio, rate, language=None):
+        if self.fault.apply_sync():
+            raise RuntimeError('injected speech-to-text failure')
+        transcript = self.transcripts[self.calls % len(self.transcripts)]
+        self.calls += 1
+        return transcript
+
+
+def synthetic_wav(seconds=4.0, rate=44100, channels=1, speech=(1.0, 3.0), seed=0):
+    # A 16-bit PCM recording: low background noise with a voiced-like tone burst between the
+    # speech bounds (seconds), like a short spoken question with pauses around it
+    generator = np.random.default_rng(seed)
+    times = np.arange(int(seconds * rate)) / rate
+    signal = 0.003 * generator.standard_normal(len(times))
+    voiced = (times >= speech[0]) & (times < speech[1])
+    signal[voiced] += 0.3 * np.sin(2 * np.pi * 180 * times[voiced]) + 0.1 * np.sin(2 * np.pi * 720 * times[voiced])
+    samples = (np.clip(signal, -1, 1) * 32767).astype('<i2')
+    samples = np.repeat(samples[:, None], channels, axis=1).tobytes()
+    header = struct.pack('<4sI4s4sIHHIIHH4sI', b'RIFF', 36 + len(samples), b'WAVE', b'fmt ', 16, 1, channels,
+                         rate, rate * channels * 2, channels * 2, 16, b'data', len(samples))
+    return header + samples
+
+
+class FaultyRetriever:
+    # Stands in for the hosted vector index (Pinecone): a local index behind injected latency and errors
+
+    def __init__(self, retriever, fault):
+        self.retriever = retriever
+        self.fault = fault
+
+    def failed(self):
+        if self.fault.apply_sync():
+            raise ConnectionError('injected retrieval failure')
+
+    def query(self, vector, top_k=3):
+        self.failed()
+        return self.retriever.query(vector, top_k)
+
+    def search_text(self, question, embed, top_k=3):
+        self.failed()
+        return self.retriever.search_text(question, embed, top_k)
+
+    @property
+    def version(self):
+        return self.retriever.version
+
+    def latest_version(self):
+        return self.retriever.latest_version()
+
+    def reload(self):
+        retriever = self.retriever.reload()
+        return self if retriever is self.retriever else FaultyRetriever(retriever, self.fault)
+
+    def warm_up(self):
+        self.retriever.warm_up()
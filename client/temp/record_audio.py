@@ -5,7 +5,9 @@ from google.colab import output
 from base64 import b64decode
 from google.colab.output import eval_js
 import io
+import struct
 import ffmpeg
+from scipy.io.wavfile import read as wav_read
 
 RECORD = """
 const sleep  = time => new Promise(resolve => setTimeout(resolve, time))
@@ -37,21 +39,16 @@ def record(sec=3):
   
   process = (ffmpeg
     .input('pipe:0')
-    .output('pipe:1', format='wav')
+    # 16 kHz mono is what /get_answer_audio transcribes at, so the server has nothing to resample
+    .output('pipe:1', format='wav', ac=1, ar=16000)
     .run_async(pipe_stdin=True, pipe_stdout=True, pipe_stderr=True, quiet=True, overwrite_output=True)
   )
   out, err = process.communicate(input=binary)
   
-  riff_chunk_size = len(out) - 8
-  # Break up the chunk size into four bytes, held in b.
-  q = riff_chunk_size
-  b = []
-  for i in range(4):
-      q, r = divmod(q, 256)
-      b.append(r)
-
-  # Replace bytes 4:8 in proc.stdout with the actual size of the RIFF chunk.
-  riff = out[:4] + bytes(b) + out[8:]
+  # ffmpeg writing to a pipe cannot seek back to fill in the RIFF size; patch bytes 4:8.
+  riff = bytearray(out)
+  struct.pack_into('<I', riff, 4, len(riff) - 8)
+  riff = bytes(riff)
 
   sr, audio = wav_read(io.BytesIO(riff))
   return sr, audio  # or webm ?
@@ -0,0 +1,126 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+BOROUGHS = ['BROOKLYN', 'QUEENS', 'MANHATTAN', 'BRONX', 'STATEN ISLAND', 'Unspecified']
+AGENCIES = ['NYPD', 'HPD', 'DSNY', 'DOT', 'DEP', 'DOB', 'DPR', 'DOHMH']
+COMPLAINTS = ['Noise - Residential', 'HEAT/HOT WATER', 'Illegal Parking', 'Blocked Driveway', 'Street Condition',
+              'Water System', 'Noise - Street/Sidewalk', 'UNSANITARY CONDITION', 'Rodent', 'Dirty Conditions']
+QUERY = {
+    'filters': [['agency', '==', 'NYPD']],
+    'group_by': ['borough', 'complaint_type'],
+    'time_bucket': ['created_date', 'month'],
+}
+
+
+def peak_rss_mb():
+    # ru_maxrss is kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def write_synthetic_311(path, rows, seed=0, chunk=100000):
+    # Socrata-style NDJSON: every value is a string, as the downloader writes it
+    rng = np.random.default_rng(seed)
+    start = np.datetime64('2010-01-01T00:00:00')
+    with open(path, 'w') as file:
+        for offset in range(0, rows, chunk):
+            n = min(chunk, rows - offset)
+            created = start + rng.integers(0, 14 * 365 * 86400, n).astype('timedelta64[s]')
+            boroughs = rng.choice(BOROUGHS, n, p=[0.3, 0.25, 0.2, 0.17, 0.05, 0.03])
+            agencies = rng.choice(AGENCIES, n)
+            complaints = rng.choice(COMPLAINTS, n)
+            zips = rng.integers(10001, 11698, n)
+            lines = [
+                json.dumps({'unique_key': str(offset + i), 'created_date': f'{created[i]}.000',
+                            'agency': agencies[i], 'complaint_type': complaints[i], 'borough': boroughs[i],
+                            'incident_zip': str(zips[i]), 'status': 'Closed'}, separators=(',', ':'))
+                for i in range(n)
+            ]
+            file.write('\n'.join(lines))
+            file.write('\n')
+
+
+def run_mode(mode, path, workers):
+    from chunked_analytics import ChunkedEngine, Query
+    from columnar_cache import ColumnarCache
+
+    query = Query(**QUERY)
+    start = time.perf_counter()
+    if mode == 'pandas':
+        # Baseline: the whole (projected) dataset as one DataFrame
+        import pandas as pd
+        df = pd.read_parquet(ColumnarCache().cache_path(path), columns=query.columns())
+        df = df[df['agency'].astype(str).str.upper() == 'NYPD']
+        df['created_date_month'] = df['created_date'].dt.to_period('M').dt.to_timestamp()
+        result = df.groupby(query.keys(), observed=True).size()
+        total = int(result.sum())
+        groups = len(result)
+    else:
+        engine = ChunkedEngine(ColumnarCache(), workers=workers if mode == 'pool' else 1)
+        result = engine.run(path, query)
+        total = int(result['count'].sum())
+        groups = len(result)
+    return {'seconds': time.perf_counter() - start, 'rows_matched': total, 'groups': groups,
+            'peak_rss_mb': peak_rss_mb()}
+
+
+def run_worker(*args):
+    # Each step runs in a fresh interpreter so peak RSS is per step (ru_maxrss survives fork/exec,
+    # so the parent itself must stay small)
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--worker', *map(str, args)],
+        capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def convert(path):
+    from columnar_cache import ColumnarCache
+    start = time.perf_counter()
+    ColumnarCache().convert(path)
+    return {'seconds': time.perf_counter() - start, 'peak_rss_mb': peak_rss_mb()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Chunked group-by over a synthetic 311 file against a full pandas load')
+    parser.add_argument('--rows', type=int, default=3000000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--worker', nargs=3, metavar=('MODE', 'PATH', 'VALUE'))
+    args = parser.parse_args()
+
+    if args.worker:
+        mode, path, value = args.worker
+        if mode == 'generate':
+            start = time.perf_counter()
+            write_synthetic_311(path, int(value))
+            result = {'seconds': time.perf_counter() - start}
+        elif mode == 'convert':
+            result = convert(path)
+        else:
+            result = run_mode(mode, path, int(value))
+        print(json.dumps(result))
+        return
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'synthetic-311.ndjson')
+        result = run_worker('generate', path, args.rows)
+        print(f"generated {args.rows:,} rows ({os.path.getsize(path) / 1e6:.0f} MB) in {result['seconds']:.1f}s")
+        result = run_worker('convert', path, 1)
+        print(f"streaming parquet conversion: {result['seconds']:.1f}s, peak {result['peak_rss_mb']:.0f} MB")
+
+        print(f"{'mode':<10}{'seconds':>9}{'matched':>12}{'groups':>8}{'peak MB':>9}")
+        for mode in ('pandas', 'chunked', 'pool'):
+            result = run_worker(mode, path, args.workers)
+            print(f"{mode:<10}{result['seconds']:>9.2f}{result['rows_matched']:>12,}{result['groups']:>8}"
+                  f"{result['peak_rss_mb']:>9.0f}")
+
+
+if __name__ == '__main__':
+    main()
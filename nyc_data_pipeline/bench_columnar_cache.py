@@ -0,0 +1,81 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+DATASETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'datasets')
+
+
+def peak_rss_mb():
+    # ru_maxrss is kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def load_folder(mode, folder):
+    import pandas as pd
+    from columnar_cache import ColumnarCache, read_records
+
+    cache = ColumnarCache()
+    start = time.perf_counter()
+    rows = 0
+    numeric_columns = 0
+    for filename in sorted(os.listdir(folder)):
+        if not filename.endswith('.json'):
+            continue
+        path = os.path.join(folder, filename)
+        if mode == 'json':
+            df = pd.DataFrame(read_records(path))
+        else:
+            df = cache.load(path)
+        rows += len(df)
+        numeric_columns += len(df.select_dtypes(include=['number']).columns)
+    return {
+        'seconds': time.perf_counter() - start,
+        'rows': rows,
+        'numeric_columns': numeric_columns,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def run_worker(mode, folder):
+    # Each measurement runs in a fresh interpreter so neither path sees a warm heap
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--worker', mode, folder],
+        capture_output=True, text=True, check=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare JSON and columnar cache load paths')
+    parser.add_argument('--datasets', default=DATASETS_DIR)
+    parser.add_argument('--worker', nargs=2, metavar=('MODE', 'FOLDER'))
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(load_folder(*args.worker)))
+        return
+
+    from columnar_cache import ColumnarCache
+    cache = ColumnarCache()
+    folders = sorted(name for name in os.listdir(args.datasets) if name.endswith('_data'))
+
+    print(f"{'folder':<22}{'mode':<10}{'seconds':>9}{'rows':>9}{'numeric':>9}{'peak MB':>9}")
+    for name in folders:
+        folder = os.path.join(args.datasets, name)
+        start = time.perf_counter()
+        cache.convert_folder(folder)
+        convert_seconds = time.perf_counter() - start
+        for mode in ('json', 'columnar'):
+            result = run_worker(mode, folder)
+            print(f"{name:<22}{mode:<10}{result['seconds']:>9.3f}{result['rows']:>9}"
+                  f"{result['numeric_columns']:>9}{result['peak_rss_mb']:>9.1f}")
+        print(f"{name:<22}{'convert':<10}{convert_seconds:>9.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+import argparse
+import os
+import time
+
+import matplotlib
+matplotlib.use('Agg')
+matplotlib.rcParams['figure.max_open_warning'] = 0
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+from chatbot import Chatbot
+from columnar_cache import ColumnarCache
+from dataset_profile import DatasetProfile
+
+DATASETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'datasets')
+
+
+def describe_and_plot(cache, folder):
+    # The previous per-rerun path: full DataFrame, describe() and one pyplot figure per numeric column
+    figures = 0
+    for filename in sorted(os.listdir(folder)):
+        if filename.endswith(('.json', '.ndjson')):
+            df = cache.load(os.path.join(folder, filename))
+            df.describe()
+            for column in df.select_dtypes(include=['number']).columns:
+                fig, ax = plt.subplots()
+                df[column].plot(kind='hist', ax=ax)
+                figures += 1
+    return figures
+
+
+def merge_check(rows, batches, seed=0):
+    # A profile built from merged batch profiles must match one built in a single pass
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({'amount': rng.lognormal(3, 1, rows),
+                       'borough': rng.choice(['BK', 'BX', 'MN', 'QN', 'SI'], rows)})
+    whole = DatasetProfile()
+    whole.add_frame(df)
+    merged = DatasetProfile()
+    for start in range(0, rows, rows // batches):
+        part = df.iloc[start:start + rows // batches]
+        profile = DatasetProfile()
+        profile.add_frame(part)
+        merged.merge(profile)
+    quantiles = merged.columns['amount'].quantiles.quantiles([0.25, 0.5, 0.75])
+    exact = np.quantile(df['amount'], [0.25, 0.5, 0.75])
+    print(f"merge check ({rows} rows, {batches} batches): histograms equal="
+          f"{merged.columns['amount'].histogram.counts == whole.columns['amount'].histogram.counts}, "
+          f"distinct~{merged.columns['borough'].distinct.count()}, "
+          f"max quantile error={np.max(np.abs(np.asarray(quantiles) - exact) / exact):.3%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-rerun cost of describe()/histograms against stored profiles')
+    parser.add_argument('--datasets', default=DATASETS_DIR)
+    parser.add_argument('--rows', type=int, default=1000000)
+    args = parser.parse_args()
+
+    cache = ColumnarCache()
+    folders = sorted(name for name in os.listdir(args.datasets) if name.endswith('_data'))
+    # cold = profiles and charts built; warm = a Streamlit rerun with both already stored
+    print(f"{'folder':<22}{'describe s':>11}{'profile cold s':>15}{'profile warm s':>15}{'figures':>9}")
+    for name in folders:
+        folder = os.path.join(args.datasets, name)
+        cache.convert_folder(folder)
+        start = time.perf_counter()
+        figures = describe_and_plot(cache, folder)
+        describe_seconds = time.perf_counter() - start
+        plt.close('all')
+
+        chatbot = Chatbot(cache)
+        for filename in os.listdir(folder):
+            if filename.endswith('.profile'):
+                os.remove(os.path.join(folder, filename))
+        start = time.perf_counter()
+        chatbot.provide_insights_and_dashboards(folder)
+        cold_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        chatbot.provide_insights_and_dashboards(folder)
+        warm_seconds = time.perf_counter() - start
+        print(f"{name:<22}{describe_seconds:>11.3f}{cold_seconds:>15.3f}{warm_seconds:>15.3f}{figures:>9}")
+
+    merge_check(args.rows, 16)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from bench_chunked_analytics import AGENCIES, BOROUGHS, COMPLAINTS
+from chunked_analytics import ChunkedEngine, Query
+from columnar_cache import ColumnarCache
+from record_index import RecordIndexStore
+
+# Rough borough centres; points are scattered around them
+CENTRES = {'BROOKLYN': (40.65, -73.95), 'QUEENS': (40.72, -73.80), 'MANHATTAN': (40.78, -73.97),
+           'BRONX': (40.84, -73.88), 'STATEN ISLAND': (40.58, -74.15), 'Unspecified': (40.70, -73.90)}
+# A few blocks of downtown Brooklyn
+AREA = (40.685, -73.995, 40.700, -73.975)
+
+
+def write_synthetic_311(path, rows, seed=0, chunk=100000):
+    # Socrata-style NDJSON with coordinates and closing times, every value a string
+    rng = np.random.default_rng(seed)
+    start = np.datetime64('2010-01-01T00:00:00')
+    with open(path, 'w') as file:
+        for offset in range(0, rows, chunk):
+            n = min(chunk, rows - offset)
+            created = start + rng.integers(0, 14 * 365 * 86400, n).astype('timedelta64[s]')
+            closed = created + rng.exponential(3 * 86400, n).astype('timedelta64[s]')
+            boroughs = rng.choice(BOROUGHS, n, p=[0.3, 0.25, 0.2, 0.17, 0.05, 0.03])
+            agencies = rng.choice(AGENCIES, n)
+            complaints = rng.choice(COMPLAINTS, n)
+            centres = np.array([CENTRES[borough] for borough in boroughs])
+            points = centres + rng.normal(0, 0.03, (n, 2))
+            lines = []
+            for i in range(n):
+                record = {'unique_key': str(offset + i), 'created_date': f'{created[i]}.000',
+                          'agency': agencies[i], 'complaint_type': complaints[i], 'borough': boroughs[i],
+                          'status': 'Closed', 'latitude': f'{points[i, 0]:.6f}', 'longitude': f'{points[i, 1]:.6f}'}
+                # Some requests are still open
+                if i % 20:
+                    record['closed_date'] = f'{closed[i]}.000'
+                lines.append(json.dumps(record, separators=(',', ':')))
+            file.write('\n'.join(lines))
+            file.write('\n')
+
+
+def scan_queries(df):
+    # Baseline: boolean masks over the whole typed DataFrame, as an in-memory analysis would do it
+    created = df['created_date']
+
+    def between(start, end):
+        return (created >= start) & (created < end)
+
+    def inside():
+        return ((df['latitude'] >= AREA[0]) & (df['latitude'] <= AREA[2]) &
+                (df['longitude'] >= AREA[1]) & (df['longitude'] <= AREA[3]))
+
+    return {
+        'month count, borough + complaint':
+            lambda: int((between('2019-03-01', '2019-04-01') & (df['borough'] == 'BROOKLYN') &
+                         (df['complaint_type'] == 'HEAT/HOT WATER')).sum()),
+        'daily counts, one agency, one year':
+            lambda: created[between('2021-01-01', '2022-01-01') & (df['agency'] == 'NYPD')]
+            .dt.floor('D').value_counts().sort_index().tolist(),
+        'area + week, by complaint type':
+            lambda: df.loc[between('2020-06-01', '2020-06-08') & inside(), 'complaint_type']
+            .value_counts()[lambda counts: counts > 0].sort_index().tolist(),
+        'resolution p50/p90/p99, one agency, one year':
+            lambda: np.nanpercentile((df['closed_date'] - created)[between('2021-01-01', '2022-01-01') &
+                                                                   (df['agency'] == 'HPD')]
+                                     .dt.total_seconds().to_numpy() * 1000, [50, 90, 99]).round().tolist(),
+    }
+
+
+def index_queries(index):
+    return {
+        'month count, borough + complaint':
+            lambda: index.count('2019-03-01', '2019-04-01', where={'borough': 'BROOKLYN',
+                                                                   'complaint_type': 'HEAT/HOT WATER'}),
+        'daily counts, one agency, one year':
+            lambda: index.time_counts('day', '2021-01-01', '2022-01-01', where={'agency': 'NYPD'}).tolist(),
+        'area + week, by complaint type':
+            lambda: index.value_counts('complaint_type', '2020-06-01', '2020-06-08', area=AREA).sort_index().tolist(),
+        'resolution p50/p90/p99, one agency, one year':
+            lambda: index.resolution_percentiles((50, 90, 99), '2021-01-01', '2022-01-01',
+                                                 where={'agency': 'HPD'}).round().tolist(),
+    }
+
+
+def timed(function, repeats):
+    seconds = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        seconds.append(time.perf_counter() - start)
+    return result, np.median(seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Record index lookups against full scans of a synthetic 311 file')
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'synthetic-311.ndjson')
+        start = time.perf_counter()
+        write_synthetic_311(path, args.rows)
+        print(f"generated {args.rows:,} rows ({os.path.getsize(path) / 1e6:.0f} MB) in {time.perf_counter() - start:.1f}s")
+        cache = ColumnarCache()
+        start = time.perf_counter()
+        cache.convert(path)
+        print(f"parquet conversion: {time.perf_counter() - start:.1f}s")
+
+        store = RecordIndexStore(cache, min_rows=0)
+        start = time.perf_counter()
+        index = store.get(path)
+        size = sum(os.path.getsize(os.path.join(store.index_path(path), name))
+                   for name in os.listdir(store.index_path(path)))
+        print(f"index build: {time.perf_counter() - start:.1f}s, {size / 1e6:.0f} MB on disk")
+        start = time.perf_counter()
+        df = cache.load(path, columns=['created_date', 'closed_date', 'borough', 'agency', 'complaint_type',
+                                       'latitude', 'longitude'])
+        print(f"DataFrame load (scan baseline setup): {time.perf_counter() - start:.1f}s")
+
+        print(f"\n{'query':<46}{'scan ms':>10}{'index ms':>10}{'speed-up':>10}{'same':>6}")
+        scans, lookups = scan_queries(df), index_queries(index)
+        for name, scan in scans.items():
+            expected, scan_seconds = timed(scan, args.repeats)
+            result, index_seconds = timed(lookups[name], args.repeats)
+            print(f"{name:<46}{scan_seconds * 1000:>10.2f}{index_seconds * 1000:>10.3f}"
+                  f"{scan_seconds / index_seconds:>9.0f}x{str(result == expected):>6}")
+
+        # The same question through both of the question engine's executors
+        query = Query(filters=[('created_date', '>=', '2019-03-01'), ('created_date', '<', '2019-04-01'),
+                               ('borough', '==', 'BROOKLYN')], group_by=['complaint_type'])
+        engine = ChunkedEngine(cache, workers=1)
+        expected, engine_seconds = timed(lambda: engine.run(path, query), args.repeats)
+        result, index_seconds = timed(lambda: index.answer(query), args.repeats)
+        same = (dict(zip(expected['complaint_type'].astype(str), expected['count'])) ==
+                dict(zip(result['complaint_type'].astype(str), result['count'])))
+        print(f"{'Query via ChunkedEngine vs RecordIndex.answer':<46}{engine_seconds * 1000:>10.2f}"
+              f"{index_seconds * 1000:>10.3f}{engine_seconds / index_seconds:>9.0f}x{str(same):>6}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,44 +1,103 @@
 # Set up OpenAI API key
 import openai
-import pandas as pd
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import os
-import json
+from collections import OrderedDict
+from columnar_cache import ColumnarCache
+from chunked_analytics import ChunkedEngine
+from dataset_catalog import DatasetCatalog
+from dataset_profile import DatasetProfiler
+from question_engine import QuestionEngine, SchemaCatalog
+from record_index import RecordIndexStore
 
 
 # Access the API key from environment variable
 openai.api_key = os.environ.get('OPENAI_API_KEY')
 
+# Streamlit reruns the script but keeps imported modules, so charts drawn for one rerun are
+# reused by the next as long as the stored bins are unchanged
+FIGURE_CACHE = OrderedDict()
+FIGURE_CACHE_SIZE = 512
+
 
 class Chatbot:
-    def __init__(self):
+    def __init__(self, cache=None, profiler=None, question_engine=None, catalog=None):
         self.data = None  # Placeholder for your data
+        self.cache = cache or ColumnarCache()
+        self.profiler = profiler or DatasetProfiler(self.cache)
+        self.catalog = catalog or DatasetCatalog(profiler=self.profiler)
+        # A given question engine brings its own engine and indexes; sharing them keeps one copy
+        # of each in memory
+        if question_engine is None:
+            question_engine = QuestionEngine(engine=ChunkedEngine(self.cache), catalog=SchemaCatalog(self.profiler),
+                                             indexes=RecordIndexStore(self.cache))
+        self.question_engine = question_engine
+        self.engine = question_engine.engine
+        self.indexes = question_engine.indexes
+        self.folder = None
+        self.profiles = {}
 
-    def load_data(self, folder):
+    def load_data(self, folder, columns=None):
+        # Typed columnar copies are rebuilt only when the source JSON changes
         data = {}
         for filename in os.listdir(folder):
-            if filename.endswith(".json"):
+            if filename.endswith((".json", ".ndjson")):
                 filepath = os.path.join(folder, filename)
-                with open(filepath, 'r') as file:
-                    data[filename] = json.load(file)
+                data[filename] = self.cache.load(filepath, columns=columns)
         self.data = data
+        self.folder = folder
+
+    def aggregate(self, dataset_name, query, folder=None):
+        # Streams the dataset in record batches instead of loading it; works for datasets larger than RAM
+        return self.engine.run(os.path.join(folder or self.folder, dataset_name), query)
+
+    def record_index(self, dataset_name, folder=None):
+        # Time-window, area and borough/agency lookups over one dataset without scanning it,
+        # e.g. record_index(name).time_counts('day', start='2023-01-01', where={'borough': 'BRONX'})
+        return self.indexes.get(os.path.join(folder or self.folder, dataset_name))
+
+    def answer_question(self, question, folder=None):
+        # Plans the question against the stored profiles and runs it with the chunked engine
+        return self.question_engine.ask(question, folder or self.folder)
+
+    def load_profiles(self, folder):
+        # Stored per-column profiles are all the summaries and charts need; no rows are loaded
+        self.profiles = self.profiler.profile_folder(folder)
+        self.folder = folder
+
+    def dataset_profile(self, dataset_name):
+        if dataset_name not in self.profiles:
+            self.profiles[dataset_name] = self.profiler.profile(os.path.join(self.folder, dataset_name))
+        return self.profiles[dataset_name]
+
+    def histogram_figure(self, histogram, title):
+        # Drawn from the stored bins as one stairs artist; plain Figure objects are not
+        # registered with pyplot, so evicted charts are freed
+        edges, counts = histogram.bins()
+        key = (title, tuple(edges), tuple(counts))
+        fig = FIGURE_CACHE.get(key)
+        if fig is None:
+            fig = Figure()
+            ax = fig.subplots()
+            ax.stairs(counts, edges, fill=True)
+            ax.set_title(title)
+            FIGURE_CACHE[key] = fig
+            while len(FIGURE_CACHE) > FIGURE_CACHE_SIZE:
+                FIGURE_CACHE.popitem(last=False)
+        FIGURE_CACHE.move_to_end(key)
+        return fig
 
     def analyze_data(self, dataset_name):
-        # Assuming the data is tabular
-        dataset = self.data.get(dataset_name, {})
-        df = pd.DataFrame(dataset)
-        
-        # Rudimentary analysis: Summary statistics
-        summary_stats = df.describe().T
-        
+        profile = self.dataset_profile(dataset_name)
+
+        # Summary statistics, in the layout of df.describe().T
+        summary_stats = profile.summary()
+
         # Create a dashboard with a simple histogram for each numeric column
         figs = []
-        for col in df.select_dtypes(include=['number']).columns:
-            fig, ax = plt.subplots()
-            df[col].hist(ax=ax)
-            ax.set_title(f'Histogram of {col}')
-            figs.append(fig)
-        
+        for col in profile.numeric_columns():
+            figs.append(self.histogram_figure(profile.columns[col].histogram, f'Histogram of {col}'))
+
         return summary_stats, figs
 
     def generate_response(self, dataset_name):
@@ -46,39 +105,37 @@ class Chatbot:
         return analysis_result, dashboards
 
     def provide_insights(self):
+        # Schemas and row counts come from the catalog; files are only re-read when they changed
         insights = []
-        for dataset_name, dataset in self.data.items():
-            df = pd.DataFrame(dataset)
-            insights.append(f'{dataset_name}:')
-            insights.append(f'- Number of records: {len(df)}')
-            insights.append(f'- Number of columns: {len(df.columns)}')
-            insights.append(f'- Columns: {", ".join(df.columns)}')
+        for entry in self.catalog.files(self.folder):
+            insights.append(f'{entry["dataset_name"]}:')
+            insights.append(f'- Number of records: {entry["number_of_records"]}')
+            insights.append(f'- Number of columns: {len(entry["columns"])}')
+            insights.append(f'- Columns: {", ".join(entry["columns"])}')
         return "\n".join(insights)
     
     def provide_insights_and_dashboards(self, folder):
         insights = []
         dashboards = []
-        for filename in os.listdir(folder):
-            if filename.endswith(".json"):
-                filepath = os.path.join(folder, filename)
-                with open(filepath, 'r') as file:
-                    data = json.load(file)
-                df = pd.DataFrame(data)
-                
-                # Generating Insights
-                insight = {
-                    'dataset_name': filename,
-                    'number_of_records': len(df),
-                    'number_of_columns': len(df.columns),
-                    'columns': list(df.columns)
-                }
-                insights.append(insight)
-                
-                # Creating Dashboards
-                for column in df.select_dtypes(include=['number']).columns:
-                    fig, ax = plt.subplots()
-                    df[column].plot(kind='hist', ax=ax)
-                    ax.set_title(f'{filename} - {column}')
-                    dashboards.append(fig)
+        charted = set()
+        for entry in self.catalog.files(folder):
+            # Generating Insights
+            insight = {
+                'dataset_name': entry['dataset_name'],
+                'number_of_records': entry['number_of_records'],
+                'number_of_columns': len(entry['columns']),
+                'columns': list(entry['columns']),
+                'duplicate_of': entry['duplicate_of']
+            }
+            insights.append(insight)
+
+            # Creating Dashboards; identical copies within the folder are charted once
+            if entry['sha1'] in charted:
+                continue
+            charted.add(entry['sha1'])
+            profile = self.profiler.profile(os.path.join(folder, entry['dataset_name']))
+            for column in profile.numeric_columns():
+                dashboards.append(self.histogram_figure(profile.columns[column].histogram,
+                                                        f'{entry["dataset_name"]} - {column}'))
         
         return insights, dashboards
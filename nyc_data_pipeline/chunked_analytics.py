@@ -0,0 +1,217 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from columnar_cache import ColumnarCache
+
+TIME_UNITS = ('year', 'month', 'week', 'day', 'hour')
+AGGREGATES = ('count', 'sum', 'min', 'max', 'mean')
+
+# How each partial column is folded into another partial with the same group key
+COMBINE = {'count': 'sum', 'sum': 'sum', 'min': 'min', 'max': 'max'}
+
+
+class Query:
+    # filters: [(column, op, value)], op one of == != < <= > >= in contains
+    # group_by: column names; time_bucket: (timestamp column, unit) adds a "{column}_{unit}" key
+    # aggregates: [(function, column)], function one of count sum min max mean; count's column may be None
+
+    def __init__(self, filters=None, group_by=None, time_bucket=None, aggregates=None):
+        self.filters = list(filters or [])
+        self.group_by = list(group_by or [])
+        self.time_bucket = time_bucket
+        self.aggregates = list(aggregates or [('count', None)])
+        if time_bucket and time_bucket[1] not in TIME_UNITS:
+            raise ValueError(f"Unknown time unit {time_bucket[1]!r}; expected one of {TIME_UNITS}")
+        for function, _ in self.aggregates:
+            if function not in AGGREGATES:
+                raise ValueError(f"Unknown aggregate {function!r}; expected one of {AGGREGATES}")
+
+    def keys(self):
+        keys = list(self.group_by)
+        if self.time_bucket:
+            keys.append(f'{self.time_bucket[0]}_{self.time_bucket[1]}')
+        return keys
+
+    def columns(self):
+        # Only these columns are read from disk
+        columns = list(self.group_by)
+        columns += [column for column, _, _ in self.filters]
+        columns += [column for _, column in self.aggregates if column]
+        if self.time_bucket:
+            columns.append(self.time_bucket[0])
+        return list(dict.fromkeys(columns))
+
+    def partial_columns(self):
+        # mean is carried as sum and count so partials stay combinable
+        partial = [('count', None)]
+        for function, column in self.aggregates:
+            if not column:
+                continue
+            if function in ('count', 'mean'):
+                partial.append(('count', column))
+            if function in ('sum', 'mean'):
+                partial.append(('sum', column))
+            if function in ('min', 'max'):
+                partial.append((function, column))
+        return list(dict.fromkeys(partial))
+
+
+def partial_name(function, column):
+    return 'rows' if column is None else f'{column}_{function}'
+
+
+def scalar_for(value, arrow_type):
+    if pa.types.is_timestamp(arrow_type):
+        return pa.scalar(pd.Timestamp(value).to_datetime64(), type=arrow_type)
+    return value
+
+
+def normalize(value):
+    # Socrata values are inconsistently cased and padded ("BROOKLYN", "Brooklyn "); the record
+    # index keys categories the same way, so both executors match the same rows
+    return str(value).strip().upper()
+
+
+def normalize_array(array):
+    return pc.utf8_upper(pc.utf8_trim_whitespace(array))
+
+
+def filter_mask(table, column, op, value):
+    array = table.column(column)
+    text = pa.types.is_string(array.type) or pa.types.is_large_string(array.type)
+    if op == 'contains':
+        return pc.match_substring(normalize_array(array.cast(pa.string())), normalize(value))
+    if op == 'in':
+        if text:
+            array = normalize_array(array)
+            return pc.is_in(array, value_set=pa.array([normalize(item) for item in value], type=array.type))
+        return pc.is_in(array, value_set=pa.array([scalar_for(item, array.type) for item in value], type=array.type))
+    if text:
+        array, value = normalize_array(array), normalize(value)
+    value = scalar_for(value, array.type)
+    operations = {'==': pc.equal, '!=': pc.not_equal, '<': pc.less, '<=': pc.less_equal,
+                  '>': pc.greater, '>=': pc.greater_equal}
+    if op not in operations:
+        raise ValueError(f"Unknown filter operator {op!r}")
+    return operations[op](array, value)
+
+
+def decode_dictionaries(table):
+    # Categorical columns are decoded so filters compare values and partials from different
+    # batches (each with its own dictionary) line up
+    for index, field in enumerate(table.schema):
+        if pa.types.is_dictionary(field.type):
+            table = table.set_column(index, field.name, table.column(index).cast(field.type.value_type))
+    return table
+
+
+def add_time_bucket(table, query):
+    if query.time_bucket:
+        column, unit = query.time_bucket
+        array = table.column(column)
+        if not pa.types.is_timestamp(array.type):
+            array = pc.strptime(array.cast(pa.string()), format='%Y-%m-%dT%H:%M:%S', unit='ms', error_is_null=True)
+        table = table.append_column(f'{column}_{unit}', pc.floor_temporal(array, unit=unit))
+    return table
+
+
+def grouped(table, keys, aggregations, names):
+    # pyarrow names outputs "<column>_<function>" (or "count_all"); their position relative to
+    # the keys differs between versions, so columns are picked by name
+    result = table.group_by(keys).aggregate(aggregations)
+    outputs = ['count_all' if column == [] else f'{column}_{function}' for column, function in aggregations]
+    return result.select(outputs + keys).rename_columns(names + keys)
+
+
+def partial_aggregate(table, query):
+    # One batch -> one small table of per-group partial states
+    table = decode_dictionaries(table)
+    for column, op, value in query.filters:
+        table = table.filter(filter_mask(table, column, op, value))
+    table = add_time_bucket(table, query)
+    aggregations = [([], 'count_all') if column is None else (column, function)
+                    for function, column in query.partial_columns()]
+    names = [partial_name(function, column) for function, column in query.partial_columns()]
+    return grouped(table, query.keys(), aggregations, names)
+
+
+def combine_partials(partials, query):
+    partials = [partial for partial in partials if partial is not None]
+    if not partials:
+        return None
+    table = pa.concat_tables(partials, promote_options='permissive')
+    names = [partial_name(function, column) for function, column in query.partial_columns()]
+    aggregations = [(name, COMBINE[function]) for name, (function, _) in zip(names, query.partial_columns())]
+    return grouped(table, query.keys(), aggregations, names)
+
+
+def finalize(partial, query):
+    keys = query.keys()
+    if partial is None:
+        return pd.DataFrame(columns=keys + [partial_name(function, column) for function, column in query.aggregates])
+    df = partial.to_pandas()
+    result = df[keys].copy()
+    for function, column in query.aggregates:
+        if column is None:
+            result['count'] = df['rows']
+        elif function == 'mean':
+            result[f'{column}_mean'] = df[f'{column}_sum'] / df[f'{column}_count'].where(df[f'{column}_count'] > 0)
+        else:
+            result[f'{column}_{function}'] = df[f'{column}_{function}']
+    order = 'count' if 'count' in result else result.columns[-1]
+    return result.sort_values(order, ascending=False, ignore_index=True)
+
+
+def aggregate_row_groups(path, row_groups, query, batch_rows, combine_every=16):
+    # Runs in worker processes: streams its share of row groups and returns one partial
+    parquet = pq.ParquetFile(path, memory_map=True)
+    available = set(parquet.schema_arrow.names)
+    missing = [column for column in query.columns() if column not in available]
+    if missing:
+        raise KeyError(f"Columns not in dataset: {', '.join(missing)}")
+    partials = []
+    for batch in parquet.iter_batches(batch_size=batch_rows, row_groups=row_groups, columns=query.columns()):
+        partials.append(partial_aggregate(pa.Table.from_batches([batch]), query))
+        if len(partials) >= combine_every:
+            partials = [combine_partials(partials, query)]
+    return combine_partials(partials, query)
+
+
+class ChunkedEngine:
+    # Filter/group-by/aggregate over the Parquet cache one record batch at a time. Memory is
+    # bounded by one batch plus the per-group partial states, whatever the dataset size.
+
+    def __init__(self, cache=None, batch_rows=262144, workers=1):
+        self.cache = cache or ColumnarCache()
+        self.batch_rows = batch_rows
+        self.workers = workers or os.cpu_count() or 1
+
+    def parquet_path(self, source_path):
+        if not self.cache.is_fresh(source_path):
+            self.cache.convert(source_path)
+        return self.cache.cache_path(source_path)
+
+    def partial(self, source_path, query):
+        path = self.parquet_path(source_path)
+        row_groups = list(range(pq.ParquetFile(path).num_row_groups))
+        workers = min(self.workers, len(row_groups))
+        if workers <= 1:
+            return aggregate_row_groups(path, row_groups, query, self.batch_rows)
+        # Row groups are dealt round-robin so every worker gets a similar share
+        shares = [row_groups[i::workers] for i in range(workers)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            partials = list(pool.map(aggregate_row_groups, [path] * workers, shares, [query] * workers,
+                                     [self.batch_rows] * workers))
+        return combine_partials(partials, query)
+
+    def run(self, source_path, query):
+        return finalize(self.partial(source_path, query), query)
+
+    def run_many(self, source_paths, query):
+        # Several files of the same dataset (e.g. yearly exports) combine like batches do
+        return finalize(combine_partials([self.partial(path, query) for path in source_paths], query), query)
@@ -0,0 +1,268 @@
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.json as pa_json
+import pyarrow.parquet as pq
+
+
+CACHE_SUFFIX = '.parquet'
+FINGERPRINT_KEY = b'nyc_source_fingerprint'
+
+# Socrata floating timestamps, e.g. "2012-10-24T12:28:58.000"
+ISO_DATETIME = re.compile(r'^\d{4}-\d{2}-\d{2}(T\d{2}:\d{2}(:\d{2}(\.\d+)?)?)?$')
+
+
+def file_sha1(path, block_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_records(path):
+    # Plain JSON arrays (the Socrata dumps) and NDJSON written by the downloader
+    if path.endswith('.ndjson'):
+        with open(path, 'r') as file:
+            return [json.loads(line) for line in file if line.strip()]
+    with open(path, 'r') as file:
+        return json.load(file)
+
+
+def iter_ndjson_chunks(path, chunk_rows):
+    # Raw line chunks, so a chunk can be parsed by pyarrow's JSON reader in one call
+    chunk = []
+    with open(path, 'rb') as file:
+        for line in file:
+            if line.strip():
+                chunk.append(line if line.endswith(b'\n') else line + b'\n')
+                if len(chunk) == chunk_rows:
+                    yield chunk
+                    chunk = []
+    if chunk:
+        yield chunk
+
+
+def parse_ndjson_chunk(lines):
+    try:
+        table = pa_json.read_json(io.BytesIO(b''.join(lines)))
+    except pa.ArrowInvalid:
+        # Mixed value types within one field; fall back to the slow path for this chunk
+        return pd.DataFrame([json.loads(line) for line in lines])
+    columns = {}
+    for field in table.schema:
+        column = table.column(field.name)
+        if pa.types.is_struct(field.type) or pa.types.is_list(field.type):
+            columns[field.name] = pd.Series(column.to_pylist(), dtype=object)
+        else:
+            columns[field.name] = column.to_pandas()
+    return pd.DataFrame(columns)
+
+
+class ColumnarCache:
+    def __init__(self, categorical_ratio=0.5, max_categories=256, verify_hash=True,
+                 stream_threshold=64 << 20, chunk_rows=100000, sample_rows=10000):
+        self.categorical_ratio = categorical_ratio
+        self.max_categories = max_categories
+        # NDJSON files above stream_threshold bytes are converted chunk_rows rows at a time
+        self.stream_threshold = stream_threshold
+        self.chunk_rows = chunk_rows
+        self.sample_rows = sample_rows
+        # When mtime/size changed but the content did not (copies, touch), fall back to the hash
+        self.verify_hash = verify_hash
+
+    def cache_path(self, source_path):
+        return os.path.splitext(source_path)[0] + CACHE_SUFFIX
+
+    def fingerprint(self, source_path, with_hash=True):
+        stat = os.stat(source_path)
+        fingerprint = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+        if with_hash:
+            fingerprint['sha1'] = file_sha1(source_path)
+        return fingerprint
+
+    def stored_fingerprint(self, source_path):
+        cache_path = self.cache_path(source_path)
+        if not os.path.exists(cache_path):
+            return None
+        try:
+            metadata = pq.read_schema(cache_path).metadata or {}
+        except (pa.ArrowInvalid, OSError) as e:
+            logging.warning(f"Unreadable cache file {cache_path}: {e}")
+            return None
+        if FINGERPRINT_KEY not in metadata:
+            return None
+        return json.loads(metadata[FINGERPRINT_KEY])
+
+    def is_fresh(self, source_path):
+        stored = self.stored_fingerprint(source_path)
+        if stored is None:
+            return False
+        current = self.fingerprint(source_path, with_hash=False)
+        if stored['mtime_ns'] == current['mtime_ns'] and stored['size'] == current['size']:
+            return True
+        if self.verify_hash and stored['size'] == current['size']:
+            return stored.get('sha1') == file_sha1(source_path)
+        return False
+
+    def infer_column(self, series):
+        non_null = series.dropna()
+        if non_null.empty:
+            return series.astype('string')
+
+        # Nested values (location points, etc.) are kept as JSON text
+        if non_null.map(lambda value: isinstance(value, (dict, list))).any():
+            return series.map(lambda value: None if value is None else json.dumps(value)).astype('string')
+
+        if non_null.map(lambda value: isinstance(value, bool)).all():
+            return series.astype('boolean')
+
+        text = non_null.astype(str)
+
+        # Identifiers such as zip codes with leading zeros must stay text
+        has_leading_zero = text.str.match(r'^-?0\d').any()
+        if not has_leading_zero:
+            numeric = pd.to_numeric(text, errors='coerce')
+            if numeric.notna().all():
+                numeric = pd.to_numeric(series, errors='coerce')
+                if not text.str.contains(r'[.eE]').any():
+                    return numeric.astype('Int64')
+                return numeric.astype('float64')
+
+        if text.str.match(ISO_DATETIME).all():
+            parsed = pd.to_datetime(series, errors='coerce', format='ISO8601')
+            if parsed.notna().sum() == len(non_null):
+                return parsed
+
+        distinct = text.nunique()
+        if distinct <= self.max_categories and distinct <= self.categorical_ratio * len(non_null):
+            return series.astype('category')
+        return series.astype('string')
+
+    def infer_types(self, df):
+        return pd.DataFrame({column: self.infer_column(df[column]) for column in df.columns}, index=df.index)
+
+    def convert(self, source_path):
+        if source_path.endswith('.ndjson') and os.path.getsize(source_path) > self.stream_threshold:
+            return self.convert_streaming(source_path)
+        df = self.infer_types(pd.DataFrame(read_records(source_path)))
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        fingerprint = json.dumps(self.fingerprint(source_path)).encode()
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), FINGERPRINT_KEY: fingerprint})
+
+        # Write to a temporary name first so a crashed conversion never looks fresh
+        cache_path = self.cache_path(source_path)
+        temp_path = cache_path + '.tmp'
+        pq.write_table(table, temp_path)
+        os.replace(temp_path, cache_path)
+        return cache_path
+
+    def column_kind(self, series):
+        # Decided once per column, from a sample of the chunk where the column first appears
+        sample = series.dropna().head(self.sample_rows)
+        if sample.map(lambda value: isinstance(value, (dict, list))).any():
+            return 'json'
+        dtype = self.infer_column(sample).dtype
+        if pd.api.types.is_bool_dtype(dtype):
+            return 'bool'
+        if pd.api.types.is_integer_dtype(dtype):
+            return 'int'
+        if pd.api.types.is_float_dtype(dtype):
+            return 'float'
+        if pd.api.types.is_datetime64_any_dtype(dtype):
+            return 'datetime'
+        # Categoricals become plain strings: each chunk would otherwise carry its own dictionary
+        return 'string'
+
+    def coerce(self, series, kind):
+        if kind == 'int':
+            numeric = pd.to_numeric(series, errors='coerce')
+            return numeric.where(numeric == numeric.round()).astype('Int64')
+        if kind == 'float':
+            return pd.to_numeric(series, errors='coerce').astype('float64')
+        if kind == 'datetime':
+            return pd.to_datetime(series, errors='coerce', format='ISO8601')
+        if kind == 'bool':
+            return series.map(lambda value: value if isinstance(value, bool) else None).astype('boolean')
+        if kind == 'json':
+            return series.map(lambda value: None if value is None else json.dumps(value)).astype('string')
+        return series.astype('string')
+
+    def convert_streaming(self, source_path):
+        # One parse of the source with memory bounded by a chunk: each chunk is coerced to the
+        # column types fixed when a column first appeared and written as a part file. Socrata
+        # omits null fields, so later chunks may add columns; the parts are then unified into
+        # one file with a row group per chunk, which also lets readers split the work.
+        fingerprint = json.dumps(self.fingerprint(source_path)).encode()
+        cache_path = self.cache_path(source_path)
+        parts_dir = cache_path + '.parts'
+        os.makedirs(parts_dir, exist_ok=True)
+        kinds = {}
+        fields = {}
+        parts = []
+        try:
+            for number, lines in enumerate(iter_ndjson_chunks(source_path, self.chunk_rows)):
+                df = parse_ndjson_chunk(lines)
+                for column in df.columns:
+                    if column not in kinds:
+                        kinds[column] = self.column_kind(df[column])
+                chunk = pd.DataFrame({column: self.coerce(df[column], kinds[column]) for column in df.columns})
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                for field in table.schema:
+                    fields.setdefault(field.name, field)
+                parts.append(os.path.join(parts_dir, f'{number:06d}.parquet'))
+                pq.write_table(table, parts[-1])
+
+            schema = pa.schema(list(fields.values())).with_metadata({FINGERPRINT_KEY: fingerprint})
+            temp_path = cache_path + '.tmp'
+            with pq.ParquetWriter(temp_path, schema) as writer:
+                for part in parts:
+                    table = pq.read_table(part)
+                    columns = [table.column(field.name).cast(field.type, safe=False) if field.name in table.column_names
+                               else pa.nulls(len(table), field.type) for field in schema]
+                    writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+            os.replace(temp_path, cache_path)
+        finally:
+            for part in parts:
+                if os.path.exists(part):
+                    os.remove(part)
+            os.rmdir(parts_dir)
+        return cache_path
+
+    def convert_folder(self, folder):
+        converted = []
+        for filename in sorted(os.listdir(folder)):
+            if filename.endswith(('.json', '.ndjson')):
+                source_path = os.path.join(folder, filename)
+                if not self.is_fresh(source_path):
+                    converted.append(self.convert(source_path))
+        return converted
+
+    def read_table(self, source_path, columns=None):
+        if not self.is_fresh(source_path):
+            logging.info(f"Building columnar cache for {source_path}")
+            self.convert(source_path)
+        cache_path = self.cache_path(source_path)
+        if columns is not None:
+            available = set(pq.read_schema(cache_path).names)
+            columns = [column for column in columns if column in available]
+        return pq.read_table(cache_path, columns=columns, memory_map=True)
+
+    def load(self, source_path, columns=None):
+        return self.read_table(source_path, columns=columns).to_pandas()
+
+    def schema(self, source_path):
+        if not self.is_fresh(source_path):
+            self.convert(source_path)
+        return pq.read_schema(self.cache_path(source_path))
+
+    def num_rows(self, source_path):
+        if not self.is_fresh(source_path):
+            self.convert(source_path)
+        return pq.ParquetFile(self.cache_path(source_path)).metadata.num_rows
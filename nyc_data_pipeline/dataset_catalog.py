@@ -0,0 +1,184 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from columnar_cache import file_sha1
+from dataset_profile import DatasetProfiler
+
+# No .json suffix so dataset listings never pick the catalog up as a dataset
+CATALOG_NAME = '.dataset_catalog.sqlite'
+DATASET_SUFFIXES = ('.json', '.ndjson')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scans (id INTEGER PRIMARY KEY, finished_at TEXT, added INTEGER,
+                                  changed INTEGER, removed INTEGER, unchanged INTEGER);
+CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, folder TEXT, name TEXT, size INTEGER,
+                                  mtime_ns INTEGER, sha1 TEXT, changed_scan INTEGER);
+CREATE TABLE IF NOT EXISTS datasets (sha1 TEXT PRIMARY KEY, rows INTEGER);
+CREATE TABLE IF NOT EXISTS columns (sha1 TEXT, name TEXT, kind TEXT, nulls INTEGER, distinct_count INTEGER,
+                                    PRIMARY KEY (sha1, name));
+CREATE TABLE IF NOT EXISTS removed (path TEXT, folder TEXT, name TEXT, scan INTEGER);
+CREATE INDEX IF NOT EXISTS files_folder ON files (folder);
+CREATE INDEX IF NOT EXISTS files_sha1 ON files (sha1);
+CREATE INDEX IF NOT EXISTS columns_name ON columns (name COLLATE NOCASE);
+"""
+
+
+class DatasetCatalog:
+    # Schemas, row counts and column types of every dataset under root, kept in SQLite. Files are
+    # keyed by content hash, so the same export saved in several folders is profiled once, and
+    # re-scans only stat files: a file is re-hashed only when its size or mtime changed.
+
+    def __init__(self, root='.', path=None, profiler=None):
+        self.root = root
+        self.path = path or os.environ.get('NYC_CATALOG_PATH') or os.path.join(root, CATALOG_NAME)
+        self.profiler = profiler or DatasetProfiler()
+        # Streamlit shares one catalog between session threads, so scans are serialized
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.db.executescript(SCHEMA)
+        self.db.commit()
+
+    def folder_name(self, folder):
+        return os.path.relpath(os.path.abspath(folder), os.path.abspath(self.root))
+
+    def folder_paths(self):
+        return sorted(os.path.join(self.root, name) for name in os.listdir(self.root)
+                      if name.endswith('_data') and os.path.isdir(os.path.join(self.root, name)))
+
+    def describe(self, source_path, sha1):
+        # Stored profiles are reused, so a catalog built after the app has run costs no extra reads
+        try:
+            profile = self.profiler.profile(source_path)
+        except Exception as e:
+            logging.warning(f"Could not profile {source_path}: {e}")
+            return False
+        self.db.execute("INSERT OR REPLACE INTO datasets VALUES (?, ?)", (sha1, profile.rows))
+        self.db.execute("DELETE FROM columns WHERE sha1 = ?", (sha1,))
+        self.db.executemany("INSERT INTO columns VALUES (?, ?, ?, ?, ?)", [
+            (sha1, column, column_profile.kind, column_profile.nulls, column_profile.distinct.count())
+            for column, column_profile in profile.columns.items()
+        ])
+        return True
+
+    def scan(self, folders=None):
+        # Incremental: unchanged (size, mtime) files cost one stat each. A scan is only recorded
+        # when something was added, changed or removed, so reruns with nothing new leave no trace.
+        with self.lock:
+            folders = self.folder_paths() if folders is None else folders
+            counts = {'added': 0, 'changed': 0, 'removed': 0, 'unchanged': 0}
+            updated, removed = [], []
+            for folder in folders:
+                name = self.folder_name(folder)
+                known = {row[0]: row[1:] for row in self.db.execute(
+                    "SELECT files.path, size, mtime_ns, files.sha1, datasets.sha1 IS NOT NULL FROM files "
+                    "LEFT JOIN datasets ON datasets.sha1 = files.sha1 WHERE folder = ?", (name,))}
+                seen = set()
+                for filename in sorted(os.listdir(folder)):
+                    if not filename.endswith(DATASET_SUFFIXES):
+                        continue
+                    path = os.path.join(name, filename)
+                    source_path = os.path.join(folder, filename)
+                    stat = os.stat(source_path)
+                    seen.add(path)
+                    previous = known.get(path)
+                    # A file whose profiling failed is looked at again even when it did not change
+                    if previous and previous[0] == stat.st_size and previous[1] == stat.st_mtime_ns and previous[3]:
+                        counts['unchanged'] += 1
+                        continue
+                    sha1 = file_sha1(source_path)
+                    if self.db.execute("SELECT 1 FROM datasets WHERE sha1 = ?", (sha1,)).fetchone() is None:
+                        self.describe(source_path, sha1)
+                    if previous and previous[2] == sha1:
+                        # Touched, copied over with identical content, or profiled on a retry
+                        self.db.execute("UPDATE files SET size = ?, mtime_ns = ? WHERE path = ?",
+                                        (stat.st_size, stat.st_mtime_ns, path))
+                        counts['unchanged'] += 1
+                        continue
+                    updated.append((path, name, filename, stat.st_size, stat.st_mtime_ns, sha1))
+                    counts['changed' if previous else 'added'] += 1
+                for path in set(known) - seen:
+                    removed.append((path, name, os.path.basename(path)))
+                    counts['removed'] += 1
+            if updated or removed:
+                # SQLite assigns the id, so concurrent catalogs on one file never reuse one
+                scan_id = self.db.execute("INSERT INTO scans VALUES (NULL, ?, ?, ?, ?, ?)", (
+                    time.strftime('%Y-%m-%dT%H:%M:%S'), counts['added'], counts['changed'], counts['removed'],
+                    counts['unchanged'])).lastrowid
+                self.db.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                    [row + (scan_id,) for row in updated])
+                self.db.executemany("DELETE FROM removed WHERE path = ?", [(row[0],) for row in updated])
+                self.db.executemany("DELETE FROM files WHERE path = ?", [(row[0],) for row in removed])
+                self.db.executemany("INSERT INTO removed VALUES (?, ?, ?, ?)", [row + (scan_id,) for row in removed])
+            # Datasets no longer referenced by any file
+            self.db.execute("DELETE FROM datasets WHERE sha1 NOT IN (SELECT sha1 FROM files)")
+            self.db.execute("DELETE FROM columns WHERE sha1 NOT IN (SELECT sha1 FROM files)")
+            self.db.commit()
+            return counts
+
+    def last_scan(self):
+        return self.db.execute("SELECT COALESCE(MAX(id), 0) FROM scans").fetchone()[0]
+
+    def folders(self):
+        return [row[0] for row in self.db.execute("SELECT DISTINCT folder FROM files ORDER BY folder")]
+
+    def files(self, folder):
+        # One entry per file of the folder as of the last scan(); duplicate_of names the first
+        # other copy of the same content
+        name = self.folder_name(folder)
+        entries = []
+        for path, filename, sha1, rows in self.db.execute(
+                "SELECT files.path, files.name, files.sha1, datasets.rows FROM files "
+                "LEFT JOIN datasets ON datasets.sha1 = files.sha1 WHERE folder = ? ORDER BY files.name", (name,)):
+            copy = self.db.execute("SELECT path FROM files WHERE sha1 = ? AND path != ? ORDER BY path LIMIT 1",
+                                   (sha1, path)).fetchone()
+            entries.append({'dataset_name': filename, 'path': path, 'sha1': sha1, 'number_of_records': rows,
+                            'columns': self.columns(sha1), 'duplicate_of': copy[0] if copy else None})
+        return entries
+
+    def columns(self, sha1):
+        return {name: kind for name, kind in self.db.execute(
+            "SELECT name, kind FROM columns WHERE sha1 = ? ORDER BY rowid", (sha1,))}
+
+    def datasets(self):
+        # Distinct contents, each with every path it is stored under
+        datasets = {}
+        for sha1, path, rows in self.db.execute(
+                "SELECT files.sha1, files.path, datasets.rows FROM files "
+                "LEFT JOIN datasets ON datasets.sha1 = files.sha1 ORDER BY files.path"):
+            datasets.setdefault(sha1, {'sha1': sha1, 'rows': rows, 'paths': []})['paths'].append(path)
+        return list(datasets.values())
+
+    def with_column(self, column):
+        # e.g. with_column('borough'); names match case-insensitively
+        matches = {row[0] for row in self.db.execute("SELECT sha1 FROM columns WHERE name = ? COLLATE NOCASE",
+                                                     (column,))}
+        return [dataset for dataset in self.datasets() if dataset['sha1'] in matches]
+
+    def join_keys(self, path, min_distinct=2):
+        # Other datasets sharing a column of the same kind with this one; near-constant columns
+        # (flags, single-valued fields) and Socrata's ":@computed_region" columns are not useful keys
+        rows = self.db.execute(
+            "SELECT other.path, mine.name FROM files AS this "
+            "JOIN columns AS mine ON mine.sha1 = this.sha1 "
+            "JOIN columns AS theirs ON theirs.name = mine.name COLLATE NOCASE AND theirs.kind = mine.kind "
+            "AND theirs.sha1 != mine.sha1 "
+            "JOIN files AS other ON other.sha1 = theirs.sha1 "
+            "WHERE this.path = ? AND mine.distinct_count >= ? AND theirs.distinct_count >= ? AND mine.name NOT LIKE ':%' "
+            "ORDER BY other.path, mine.name", (path, min_distinct, min_distinct))
+        keys = {}
+        for other, column in rows:
+            keys.setdefault(other, []).append(column)
+        return keys
+
+    def changed_since(self, scan_id=None):
+        # Files added, changed or removed after scan_id; by default, in the most recent scan that
+        # found any
+        scan_id = self.last_scan() - 1 if scan_id is None else scan_id
+        changed = [{'path': path, 'status': 'changed'} for path, in self.db.execute(
+            "SELECT path FROM files WHERE changed_scan > ? ORDER BY path", (scan_id,))]
+        removed = [{'path': path, 'status': 'removed'} for path, in self.db.execute(
+            "SELECT DISTINCT path FROM removed WHERE scan > ? ORDER BY path", (scan_id,))]
+        return changed + removed
@@ -0,0 +1,41 @@
+import hashlib
+import json
+import os
+import time
+
+# No .json suffix so dataset listings never pick the manifest up as a dataset
+MANIFEST_NAME = '.soda_manifest'
+
+
+def schema_hash(columns):
+    return hashlib.sha1(json.dumps(sorted(columns)).encode()).hexdigest()
+
+
+class DatasetManifest:
+    def __init__(self, folder):
+        self.path = os.path.join(folder, MANIFEST_NAME)
+        self.entries = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as file:
+                self.entries = json.load(file)
+
+    def get(self, name):
+        return self.entries.get(name)
+
+    def update(self, name, url, key, watermark, rows, columns):
+        self.entries[name] = {
+            'url': url,
+            'key': key,
+            'watermark': watermark,
+            'rows': rows,
+            'columns': sorted(columns),
+            'schema_hash': schema_hash(columns),
+            'refreshed_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        }
+        self.save()
+
+    def save(self):
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump(self.entries, file, indent=4, sort_keys=True)
+        os.replace(temp_path, self.path)
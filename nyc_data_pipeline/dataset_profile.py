@@ -0,0 +1,437 @@
+import base64
+import json
+import logging
+import math
+import os
+
+import numpy as np
+import pandas as pd
+
+from columnar_cache import ColumnarCache
+
+# No .json suffix so dataset listings never pick a profile up as a dataset
+PROFILE_SUFFIX = '.profile'
+
+
+def hash_values(values):
+    # Stable 64-bit hashes; values are coerced by column kind first, so batches hash alike
+    return pd.util.hash_array(np.asarray(values))
+
+
+class HyperLogLog:
+    def __init__(self, precision=12, registers=None):
+        self.precision = precision
+        self.registers = registers if registers is not None else np.zeros(1 << precision, dtype=np.uint8)
+
+    def add_many(self, hashes):
+        if not len(hashes):
+            return
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        width = 64 - self.precision
+        buckets = (hashes >> np.uint64(width)).astype(np.int64)
+        rest = hashes & np.uint64((1 << width) - 1)
+        # Rank = position of the leftmost 1-bit in the remaining bits
+        ranks = np.full(len(rest), width + 1, dtype=np.uint8)
+        nonzero = rest > 0
+        ranks[nonzero] = width - np.floor(np.log2(rest[nonzero].astype(np.float64))).astype(np.uint8)
+        np.maximum.at(self.registers, buckets, ranks)
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def count(self):
+        m = len(self.registers)
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / np.sum(np.power(2.0, -self.registers.astype(np.float64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def to_dict(self):
+        return {'precision': self.precision, 'registers': base64.b64encode(self.registers.tobytes()).decode()}
+
+    @classmethod
+    def from_dict(cls, data):
+        registers = np.frombuffer(base64.b64decode(data['registers']), dtype=np.uint8).copy()
+        return cls(data['precision'], registers)
+
+
+class QuantileSketch:
+    # KLL-style compactors: level h holds items of weight 2**h; a full level is sorted and every
+    # other item is promoted, so memory stays O(k log n) and two sketches merge level by level
+
+    def __init__(self, k=256, levels=None):
+        self.k = k
+        self.levels = levels or [np.empty(0)]
+        self.compactions = 0
+
+    def add_many(self, values):
+        self.levels[0] = np.concatenate([self.levels[0], np.asarray(values, dtype=np.float64)])
+        self.compress()
+
+    def compress(self):
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self.k:
+                items = np.sort(items)
+                keep = items[len(items) - len(items) % 2:]
+                # Alternate the offset so promotions do not bias towards small or large values
+                promoted = items[self.compactions % 2:len(items) - len(items) % 2:2]
+                self.compactions += 1
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+                self.levels[level] = keep
+            level += 1
+
+    def merge(self, other):
+        for level, items in enumerate(other.levels):
+            if level == len(self.levels):
+                self.levels.append(np.empty(0))
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self.compress()
+
+    def quantiles(self, qs):
+        values = np.concatenate(self.levels)
+        if not len(values):
+            return [None] * len(qs)
+        weights = np.concatenate([np.full(len(items), 2.0 ** level) for level, items in enumerate(self.levels)])
+        order = np.argsort(values)
+        cumulative = np.cumsum(weights[order])
+        positions = np.searchsorted(cumulative, np.asarray(qs) * cumulative[-1], side='left')
+        return [float(values[order][min(position, len(values) - 1)]) for position in positions]
+
+    def to_dict(self):
+        return {'k': self.k, 'levels': [items.tolist() for items in self.levels]}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['k'], [np.asarray(items, dtype=np.float64) for items in data['levels']])
+
+
+class FrequentItems:
+    # Misra-Gries summary: counts are lower bounds, off by at most n / capacity
+
+    def __init__(self, capacity=64, counts=None):
+        self.capacity = capacity
+        self.counts = counts or {}
+
+    def add_counts(self, counts):
+        for value, count in counts.items():
+            self.counts[value] = self.counts.get(value, 0) + int(count)
+        if len(self.counts) > self.capacity:
+            cutoff = sorted(self.counts.values(), reverse=True)[self.capacity]
+            self.counts = {value: count - cutoff for value, count in self.counts.items() if count > cutoff}
+
+    def add_many(self, values):
+        self.add_counts(pd.Series(values).value_counts().to_dict())
+
+    def merge(self, other):
+        self.add_counts(other.counts)
+
+    def top(self, n=10):
+        return sorted(self.counts.items(), key=lambda item: -item[1])[:n]
+
+    def to_dict(self):
+        return {'capacity': self.capacity, 'counts': self.counts}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['capacity'], data['counts'])
+
+
+class Histogram:
+    # Bins of width 2**exponent aligned at zero; widening merges neighbouring bins exactly,
+    # so histograms built from different batches add up to the histogram of all rows
+
+    def __init__(self, max_bins=40, exponent=None, counts=None):
+        self.max_bins = max_bins
+        self.exponent = exponent
+        self.counts = counts or {}
+
+    def rebin(self, exponent):
+        factor = 2 ** (exponent - self.exponent)
+        counts = {}
+        for index, count in self.counts.items():
+            counts[index // factor] = counts.get(index // factor, 0) + count
+        self.counts = counts
+        self.exponent = exponent
+
+    def fit(self):
+        while self.counts and max(self.counts) - min(self.counts) + 1 > self.max_bins:
+            self.rebin(self.exponent + 1)
+
+    def add_many(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[np.isfinite(values)]
+        if not len(values):
+            return
+        spread = float(values.max() - values.min())
+        exponent = math.ceil(math.log2(spread / self.max_bins)) if spread > 0 else 0
+        if self.exponent is None:
+            self.exponent = exponent
+        elif exponent > self.exponent:
+            self.rebin(exponent)
+        indexes, counts = np.unique(np.floor(values / 2.0 ** self.exponent).astype(np.int64), return_counts=True)
+        for index, count in zip(indexes.tolist(), counts.tolist()):
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.fit()
+
+    def merge(self, other):
+        if other.exponent is None:
+            return
+        other = Histogram(other.max_bins, other.exponent, dict(other.counts))
+        if self.exponent is None:
+            self.exponent = other.exponent
+        exponent = max(self.exponent, other.exponent)
+        self.rebin(exponent)
+        other.rebin(exponent)
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.fit()
+
+    def bins(self):
+        # (edges, counts) with empty bins filled in, ready for Axes.stairs
+        if not self.counts:
+            return [0.0, 1.0], [0]
+        width = 2.0 ** self.exponent
+        low, high = min(self.counts), max(self.counts)
+        edges = [index * width for index in range(low, high + 2)]
+        return edges, [self.counts.get(index, 0) for index in range(low, high + 1)]
+
+    def to_dict(self):
+        return {'max_bins': self.max_bins, 'exponent': self.exponent,
+                'counts': {str(index): count for index, count in self.counts.items()}}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['max_bins'], data['exponent'], {int(index): count for index, count in data['counts'].items()})
+
+
+def column_kind(series):
+    if pd.api.types.is_bool_dtype(series):
+        return 'text'
+    if pd.api.types.is_numeric_dtype(series):
+        return 'numeric'
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return 'datetime'
+    return 'text'
+
+
+class ColumnProfile:
+    def __init__(self, kind):
+        self.kind = kind
+        self.count = 0
+        self.nulls = 0
+        self.minimum = None
+        self.maximum = None
+        self.total = 0.0
+        self.total_squares = 0.0
+        self.distinct = HyperLogLog()
+        self.quantiles = QuantileSketch() if kind == 'numeric' else None
+        self.histogram = Histogram() if kind == 'numeric' else None
+        self.frequent = FrequentItems() if kind == 'text' else None
+
+    def coerce(self, series):
+        # Coerce by the profile's kind, not the batch's inferred dtype, so small batches
+        # (e.g. rows appended by a refresh) are counted exactly like the original file
+        if self.kind == 'numeric':
+            return pd.to_numeric(series, errors='coerce').astype('float64')
+        if self.kind == 'datetime':
+            return pd.to_datetime(series, errors='coerce', format='ISO8601')
+        return series.astype('string')
+
+    def add(self, series):
+        series = self.coerce(series)
+        values = series.dropna()
+        self.nulls += len(series) - len(values)
+        self.count += len(values)
+        if not len(values):
+            return
+        if self.kind == 'numeric':
+            array = values.to_numpy()
+            self.total += float(array.sum())
+            self.total_squares += float(np.square(array).sum())
+            self.quantiles.add_many(array)
+            self.histogram.add_many(array)
+            low, high = float(array.min()), float(array.max())
+            self.distinct.add_many(hash_values(array))
+        elif self.kind == 'datetime':
+            # Profiles store microseconds: any Parquet resolution converts, and typo years like 1012 fit
+            micros = values.dt.tz_localize(None).astype('datetime64[us]').astype('int64').to_numpy()
+            low, high = int(micros.min()), int(micros.max())
+            self.distinct.add_many(hash_values(micros))
+        else:
+            strings = values.to_numpy(dtype=object)
+            self.frequent.add_many(strings)
+            low, high = None, None
+            self.distinct.add_many(hash_values(strings))
+        if low is not None:
+            self.minimum = low if self.minimum is None else min(self.minimum, low)
+            self.maximum = high if self.maximum is None else max(self.maximum, high)
+
+    def merge(self, other):
+        self.count += other.count
+        self.nulls += other.nulls
+        self.total += other.total
+        self.total_squares += other.total_squares
+        for bound, pick in (('minimum', min), ('maximum', max)):
+            values = [value for value in (getattr(self, bound), getattr(other, bound)) if value is not None]
+            setattr(self, bound, pick(values) if values else None)
+        self.distinct.merge(other.distinct)
+        for sketch in ('quantiles', 'histogram', 'frequent'):
+            if getattr(self, sketch) is not None and getattr(other, sketch) is not None:
+                getattr(self, sketch).merge(getattr(other, sketch))
+
+    def summary(self):
+        row = {'kind': self.kind, 'count': self.count, 'nulls': self.nulls, 'distinct': self.distinct.count()}
+        if self.kind == 'numeric' and self.count:
+            mean = self.total / self.count
+            variance = (self.total_squares - self.count * mean * mean) / max(self.count - 1, 1)
+            q25, q50, q75 = self.quantiles.quantiles([0.25, 0.5, 0.75])
+            row.update({'mean': mean, 'std': math.sqrt(max(variance, 0.0)), 'min': self.minimum,
+                        '25%': q25, '50%': q50, '75%': q75, 'max': self.maximum})
+        elif self.kind == 'datetime' and self.count:
+            row.update({'min': pd.Timestamp(self.minimum, unit='us'), 'max': pd.Timestamp(self.maximum, unit='us')})
+        elif self.kind == 'text' and self.frequent.counts:
+            row['top'] = self.frequent.top(1)[0][0]
+        return row
+
+    def to_dict(self):
+        data = {'kind': self.kind, 'count': self.count, 'nulls': self.nulls, 'minimum': self.minimum,
+                'maximum': self.maximum, 'total': self.total, 'total_squares': self.total_squares,
+                'distinct': self.distinct.to_dict()}
+        for sketch in ('quantiles', 'histogram', 'frequent'):
+            if getattr(self, sketch) is not None:
+                data[sketch] = getattr(self, sketch).to_dict()
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        profile = cls(data['kind'])
+        for field in ('count', 'nulls', 'minimum', 'maximum', 'total', 'total_squares'):
+            setattr(profile, field, data[field])
+        profile.distinct = HyperLogLog.from_dict(data['distinct'])
+        for sketch, sketch_class in (('quantiles', QuantileSketch), ('histogram', Histogram),
+                                     ('frequent', FrequentItems)):
+            if sketch in data:
+                setattr(profile, sketch, sketch_class.from_dict(data[sketch]))
+        return profile
+
+
+class DatasetProfile:
+    def __init__(self, rows=0, columns=None, fingerprint=None):
+        self.rows = rows
+        self.columns = columns or {}
+        self.fingerprint = fingerprint
+
+    def add_frame(self, df):
+        for column in df.columns:
+            if column not in self.columns:
+                # Columns that appear later were null in every earlier row
+                self.columns[column] = ColumnProfile(column_kind(df[column]))
+                self.columns[column].nulls = self.rows
+            self.columns[column].add(df[column])
+        for column, profile in self.columns.items():
+            if column not in df.columns:
+                profile.nulls += len(df)
+        self.rows += len(df)
+
+    def merge(self, other):
+        for column, profile in other.columns.items():
+            if column not in self.columns:
+                self.columns[column] = ColumnProfile(profile.kind)
+                self.columns[column].nulls = self.rows
+            self.columns[column].merge(profile)
+        for column, profile in self.columns.items():
+            if column not in other.columns:
+                profile.nulls += other.rows
+        self.rows += other.rows
+
+    def numeric_columns(self):
+        return [column for column, profile in self.columns.items() if profile.kind == 'numeric' and profile.count]
+
+    def summary(self):
+        # Same orientation as df.describe().T, plus null, distinct and top-value columns
+        return pd.DataFrame({column: profile.summary() for column, profile in self.columns.items()}).T
+
+    def to_dict(self):
+        return {'rows': self.rows, 'fingerprint': self.fingerprint,
+                'columns': {column: profile.to_dict() for column, profile in self.columns.items()}}
+
+    @classmethod
+    def from_dict(cls, data):
+        columns = {column: ColumnProfile.from_dict(profile) for column, profile in data['columns'].items()}
+        return cls(data['rows'], columns, data.get('fingerprint'))
+
+
+class DatasetProfiler:
+    # Profiles are computed once per source version and stored next to the dataset as {name}.profile
+
+    def __init__(self, cache=None, batch_rows=65536):
+        self.cache = cache or ColumnarCache()
+        self.batch_rows = batch_rows
+
+    def profile_path(self, source_path):
+        return os.path.splitext(source_path)[0] + PROFILE_SUFFIX
+
+    def stored(self, source_path):
+        path = self.profile_path(source_path)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r') as file:
+                return DatasetProfile.from_dict(json.load(file))
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning(f"Unreadable profile {path}: {e}")
+            return None
+
+    def is_fresh(self, source_path, profile=None):
+        profile = profile or self.stored(source_path)
+        return profile is not None and profile.fingerprint == self.cache.fingerprint(source_path, with_hash=False)
+
+    def save(self, source_path, profile):
+        profile.fingerprint = self.cache.fingerprint(source_path, with_hash=False)
+        path = self.profile_path(source_path)
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump(profile.to_dict(), file, default=str)
+        os.replace(temp_path, path)
+
+    def build(self, source_path):
+        # Record batches from the memory-mapped Parquet cache keep peak memory at one batch
+        profile = DatasetProfile()
+        for batch in self.cache.read_table(source_path).to_batches(self.batch_rows):
+            profile.add_frame(batch.to_pandas())
+        self.save(source_path, profile)
+        return profile
+
+    def profile(self, source_path):
+        profile = self.stored(source_path)
+        if profile is not None and self.is_fresh(source_path, profile):
+            return profile
+        logging.info(f"Profiling {source_path}")
+        return self.build(source_path)
+
+    def profile_folder(self, folder):
+        return {
+            filename: self.profile(os.path.join(folder, filename))
+            for filename in sorted(os.listdir(folder)) if filename.endswith(('.json', '.ndjson'))
+        }
+
+    def extend(self, source_path, rows):
+        # Folds appended rows into the stored profile; the caller must have checked the profile
+        # was fresh before the rows were appended to the source file
+        profile = self.stored(source_path)
+        if profile is None:
+            return self.build(source_path)
+        if rows:
+            profile.add_frame(pd.DataFrame(rows))
+        self.save(source_path, profile)
+        return profile
+
+    def invalidate(self, source_path):
+        path = self.profile_path(source_path)
+        if os.path.exists(path):
+            os.remove(path)
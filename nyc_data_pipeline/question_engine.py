@@ -0,0 +1,379 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+
+import openai
+import pandas as pd
+
+from chunked_analytics import ChunkedEngine, Query, TIME_UNITS
+from columnar_cache import ColumnarCache
+from dataset_profile import DatasetProfiler
+from record_index import RecordIndexStore
+
+WORD = re.compile(r"[a-z0-9]+")
+YEAR = re.compile(r"\b(19\d{2}|20\d{2})\b")
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does did for from how i in is it many me my much number of on or per "
+    "show the there to total was were what when where which who with count each give list tell"
+    .split()
+)
+# Words that describe the rows themselves rather than a value to filter on
+ROW_WORDS = frozenset("complaint complaints request requests call calls record records row rows incident incidents "
+                      "case cases report reports dataset data".split())
+# Below this a dataset matched only incidental words, and the question is not planned at all
+MIN_DATASET_SCORE = 2
+UNIT_WORDS = {'year': 'year', 'yearly': 'year', 'annual': 'year', 'annually': 'year', 'month': 'month',
+              'monthly': 'month', 'week': 'week', 'weekly': 'week', 'day': 'day', 'daily': 'day',
+              'hour': 'hour', 'hourly': 'hour'}
+
+
+def words(text):
+    return WORD.findall(str(text).lower())
+
+
+def singular(word):
+    return word[:-1] if len(word) > 3 and word.endswith('s') and not word.endswith('ss') else word
+
+
+class DatasetSchema:
+    # What planners need to know about one dataset: columns, their kinds and frequent values
+    def __init__(self, name, path, rows, columns, fingerprint):
+        self.name = name
+        self.path = path
+        self.rows = rows
+        self.columns = columns  # column -> {'kind': ..., 'values': [(value, count), ...]}
+        self.fingerprint = fingerprint
+
+    def kind(self, column):
+        return self.columns[column]['kind']
+
+    def columns_of(self, kind):
+        return [column for column, info in self.columns.items() if info['kind'] == kind]
+
+    def time_column(self):
+        # Creation dates describe "when" best; otherwise the first datetime column
+        datetimes = self.columns_of('datetime')
+        for column in datetimes:
+            if 'created' in column or column in ('date', 'date_time'):
+                return column
+        return datetimes[0] if datetimes else None
+
+
+class SchemaCatalog:
+    # Schemas come from the stored dataset profiles and are cached per file version
+    def __init__(self, profiler=None, top_values=64):
+        self.profiler = profiler or DatasetProfiler()
+        self.top_values = top_values
+        self.schemas = {}
+
+    def schema(self, source_path):
+        fingerprint = self.profiler.cache.fingerprint(source_path, with_hash=False)
+        cached = self.schemas.get(source_path)
+        if cached is not None and cached.fingerprint == fingerprint:
+            return cached
+        profile = self.profiler.profile(source_path)
+        columns = {
+            column: {'kind': column_profile.kind,
+                     'values': column_profile.frequent.top(self.top_values) if column_profile.frequent else []}
+            for column, column_profile in profile.columns.items()
+        }
+        schema = DatasetSchema(os.path.basename(source_path), source_path, profile.rows, columns, fingerprint)
+        self.schemas[source_path] = schema
+        return schema
+
+    def folder(self, folder):
+        return [self.schema(os.path.join(folder, filename)) for filename in sorted(os.listdir(folder))
+                if filename.endswith(('.json', '.ndjson'))]
+
+
+class QueryPlan:
+    def __init__(self, schema, query, explanation=''):
+        self.schema = schema
+        self.query = query
+        self.explanation = explanation
+
+    def key(self):
+        # Includes the dataset version, so refreshed data never returns a stale memoized result
+        plan = {'path': os.path.abspath(self.schema.path), 'fingerprint': self.schema.fingerprint,
+                'filters': self.query.filters, 'group_by': self.query.group_by,
+                'time_bucket': self.query.time_bucket, 'aggregates': self.query.aggregates}
+        return hashlib.sha1(json.dumps(plan, sort_keys=True, default=str).encode()).hexdigest()
+
+    def describe(self):
+        parts = []
+        for column, op, value in self.query.filters:
+            parts.append(f"{column} {op} {value!r}")
+        if self.query.group_by or self.query.time_bucket:
+            parts.append("grouped by " + ", ".join(self.query.keys()))
+        return f"{self.schema.name}: " + ("; ".join(parts) if parts else "all rows")
+
+
+class Planner:
+    # Turns a question and the catalog's schemas into a QueryPlan, or None when it cannot
+    def plan(self, question, schemas):
+        raise NotImplementedError
+
+
+class RuleBasedPlanner(Planner):
+    # Keyword matching against dataset names, column names and frequent values; no network
+
+    def dataset_score(self, question_words, schema):
+        name_words = {singular(word) for word in words(os.path.splitext(schema.name)[0])}
+        column_words = {word for column in schema.columns for word in words(column)}
+        value_words = {singular(word) for info in schema.columns.values() for value, _ in info['values']
+                       for word in words(value)}
+        score = 0.0
+        for word in question_words:
+            # Fragments such as the "s" of "what's" match something in nearly every dataset
+            if len(word) < 3:
+                continue
+            # Generic row words ("complaints", "calls") say little about which dataset is meant,
+            # unless it is named for them or has a column for them (complaint_type)
+            if word in ROW_WORDS:
+                score += singular(word) in name_words or singular(word) in column_words
+                continue
+            # A word counts once, by its strongest match, so a column name that also occurs in
+            # that column's values ("Borough Park") does not outweigh a second matching word
+            score += max(3 * (singular(word) in name_words), 2 * (word in column_words), singular(word) in value_words)
+        return score
+
+    def choose_dataset(self, question_words, schemas):
+        # None when no dataset matches well enough to plan against
+        schema = max(schemas, key=lambda schema: (self.dataset_score(question_words, schema), schema.rows))
+        return schema if self.dataset_score(question_words, schema) >= MIN_DATASET_SCORE else None
+
+    def column_for(self, phrase_words, schema, kinds=None):
+        # A column whose name is made of the given words, e.g. "complaint type" -> complaint_type
+        best, best_overlap = None, 0
+        for column in schema.columns:
+            if kinds and schema.kind(column) not in kinds:
+                continue
+            column_words = set(words(column))
+            overlap = len(column_words & set(phrase_words))
+            if overlap > best_overlap or (overlap == best_overlap and overlap and len(column) < len(best)):
+                best, best_overlap = column, overlap
+        return best
+
+    def groupings(self, question, schema):
+        group_by, time_unit, used = [], None, set()
+        for match in re.finditer(r"\b(?:by|per|each|across)\s+((?:[a-z_]+\s*){1,3})", question.lower()):
+            phrase = words(match.group(1))
+            if phrase and phrase[0] in UNIT_WORDS:
+                time_unit = UNIT_WORDS[phrase[0]]
+                used.add(phrase[0])
+                continue
+            column = self.column_for([word for word in phrase if word not in STOPWORDS], schema, ('text',))
+            if column and column not in group_by:
+                group_by.append(column)
+                used.update(phrase)
+        for word in words(question):
+            if word in ('monthly', 'yearly', 'weekly', 'daily', 'hourly', 'annually'):
+                time_unit = UNIT_WORDS[word]
+                used.add(word)
+        return group_by, time_unit, used
+
+    def aggregates(self, question, schema):
+        lowered = question.lower()
+        for pattern, function in ((r"\b(?:average|mean|avg)\s+((?:[a-z_]+\s*){1,3})", 'mean'),
+                                  (r"\b(?:total|sum of)\s+((?:[a-z_]+\s*){1,3})", 'sum'),
+                                  (r"\b(?:maximum|max|highest|largest)\s+((?:[a-z_]+\s*){1,3})", 'max'),
+                                  (r"\b(?:minimum|min|lowest|smallest)\s+((?:[a-z_]+\s*){1,3})", 'min')):
+            match = re.search(pattern, lowered)
+            if match:
+                phrase = [word for word in words(match.group(1)) if word not in STOPWORDS]
+                column = self.column_for(phrase, schema, ('numeric',))
+                if column:
+                    return [('count', None), (function, column)], set(words(match.group(1)))
+        return [('count', None)], set()
+
+    def value_filters(self, question, schema, skip):
+        filters = []
+        lowered = ' ' + ' '.join(words(question)) + ' '
+        remaining = [word for word in words(question)
+                     if word not in STOPWORDS and word not in ROW_WORDS and word not in skip and not YEAR.match(word)]
+        # Whole values named in the question ("Brooklyn", "HEAT/HOT WATER") become equality filters;
+        # among columns holding the same value, the one where it is most frequent wins
+        matches = {}
+        for column, info in schema.columns.items():
+            for value, count in info['values']:
+                value_words = words(value)
+                if value_words and f" {' '.join(value_words)} " in lowered and \
+                        any(word in remaining for word in value_words):
+                    key = ' '.join(value_words)
+                    if key not in matches or count > matches[key][2]:
+                        matches[key] = (column, value, count)
+        used_columns = set()
+        for key, (column, value, _) in sorted(matches.items(), key=lambda item: -len(item[0])):
+            if column in used_columns or not any(word in remaining for word in key.split()):
+                continue
+            filters.append((column, '==', value))
+            used_columns.add(column)
+            remaining = [word for word in remaining if word not in key.split()]
+        # Single words that occur inside frequent values ("noise" in "Noise - Residential")
+        for word in remaining:
+            if len(word) < 4:
+                continue
+            best, best_count = None, 0
+            for column, info in schema.columns.items():
+                if column in used_columns:
+                    continue
+                count = sum(value_count for value, value_count in info['values']
+                            if singular(word) in {singular(value_word) for value_word in words(value)})
+                if count > best_count:
+                    best, best_count = column, count
+            if best:
+                filters.append((best, 'contains', singular(word)))
+                used_columns.add(best)
+        return filters
+
+    def time_filters(self, question, schema):
+        column = schema.time_column()
+        years = sorted({int(year) for year in YEAR.findall(question)})
+        if not column or not years:
+            return []
+        if len(years) >= 2 and re.search(r"\b(?:between|from)\b", question.lower()):
+            return [(column, '>=', f'{years[0]}-01-01'), (column, '<', f'{years[-1] + 1}-01-01')]
+        if re.search(r"\b(?:since|after)\s+" + str(years[0]), question.lower()):
+            return [(column, '>=', f'{years[0]}-01-01')]
+        if re.search(r"\bbefore\s+" + str(years[0]), question.lower()):
+            return [(column, '<', f'{years[0]}-01-01')]
+        return [(column, '>=', f'{years[0]}-01-01'), (column, '<', f'{years[0] + 1}-01-01')]
+
+    def plan(self, question, schemas):
+        if not schemas:
+            raise ValueError("No datasets to answer from")
+        question_words = [word for word in words(question) if word not in STOPWORDS]
+        schema = self.choose_dataset(question_words, schemas)
+        if schema is None:
+            return None
+        dataset_words = set(words(os.path.splitext(schema.name)[0]))
+        group_by, time_unit, grouping_words = self.groupings(question, schema)
+        aggregates, aggregate_words = self.aggregates(question, schema)
+        skip = dataset_words | grouping_words | aggregate_words | set(UNIT_WORDS)
+        filters = self.time_filters(question, schema) + self.value_filters(question, schema, skip)
+        time_column = schema.time_column()
+        time_bucket = (time_column, time_unit) if time_unit and time_column else None
+        query = Query(filters=filters, group_by=group_by, time_bucket=time_bucket, aggregates=aggregates)
+        return QueryPlan(schema, query, 'rules')
+
+
+class OpenAIPlanner(Planner):
+    # Asks the chat model for a JSON plan; anything it returns is validated against the schema,
+    # and questions it cannot plan fall back to the rule-based planner
+
+    PROMPT = (
+        "You translate questions about NYC Open Data into JSON query plans. Datasets:\n{schemas}\n\n"
+        "Reply with JSON only: {{\"dataset\": name, \"filters\": [[column, op, value]], \"group_by\": [column], "
+        "\"time_bucket\": [datetime column, unit] or null, \"aggregates\": [[function, column or null]]}}. "
+        "ops: == != < <= > >= in contains. units: {units}. functions: count sum min max mean.\n\n"
+        "Question: {question}"
+    )
+
+    def __init__(self, model='gpt-3.5-turbo', fallback=None):
+        self.model = model
+        self.fallback = fallback or RuleBasedPlanner()
+
+    def describe_schemas(self, schemas):
+        lines = []
+        for schema in schemas:
+            columns = []
+            for column, info in schema.columns.items():
+                values = ', '.join(str(value) for value, _ in info['values'][:5])
+                columns.append(f"{column} ({info['kind']}{': ' + values if values else ''})")
+            lines.append(f"- {schema.name} ({schema.rows} rows): " + '; '.join(columns))
+        return '\n'.join(lines)
+
+    def plan(self, question, schemas):
+        try:
+            response = openai.ChatCompletion.create(
+                model=self.model,
+                messages=[{'role': 'user', 'content': self.PROMPT.format(
+                    schemas=self.describe_schemas(schemas), units=', '.join(TIME_UNITS), question=question)}],
+                temperature=0,
+            )
+            plan = json.loads(response['choices'][0]['message']['content'])
+            schema = next(schema for schema in schemas if schema.name == plan['dataset'])
+            known = set(schema.columns)
+            filters = [tuple(item) for item in plan.get('filters') or []]
+            group_by = plan.get('group_by') or []
+            time_bucket = tuple(plan['time_bucket']) if plan.get('time_bucket') else None
+            aggregates = [tuple(item) for item in plan.get('aggregates') or [('count', None)]]
+            referenced = [column for column, _, _ in filters] + group_by + [column for _, column in aggregates if column]
+            if time_bucket:
+                referenced.append(time_bucket[0])
+            unknown = [column for column in referenced if column not in known]
+            if unknown:
+                raise ValueError(f"unknown columns {unknown}")
+            query = Query(filters=filters, group_by=group_by, time_bucket=time_bucket, aggregates=aggregates)
+            return QueryPlan(schema, query, 'openai')
+        except Exception as e:
+            logging.warning(f"OpenAI planner failed, using rules: {e}")
+            return self.fallback.plan(question, schemas)
+
+
+class Answer:
+    def __init__(self, plan, result, seconds, cached):
+        self.plan = plan
+        self.result = result
+        self.seconds = seconds
+        self.cached = cached
+
+    def text(self):
+        if self.plan is None:
+            return ("Couldn't plan this question: no dataset in this folder matches it. "
+                    "Try naming a dataset, a column or a value.")
+        if not len(self.result):
+            return f"No matching rows ({self.plan.describe()})."
+        if not self.plan.query.keys():
+            row = self.result.iloc[0]
+            parts = [f"{int(row['count']):,} matching rows"]
+            for column in self.result.columns:
+                if column != 'count' and pd.notna(row[column]):
+                    parts.append(f"{column.replace('_', ' ')}: {row[column]:,.2f}"
+                                 if isinstance(row[column], float) else f"{column}: {row[column]}")
+            return ", ".join(parts) + f" ({self.plan.describe()})."
+        return f"{len(self.result):,} groups, largest first ({self.plan.describe()})."
+
+
+class QuestionEngine:
+    # Question -> plan -> chunked execution over the Parquet cache; results are memoized by plan
+    # hash, so a repeated or rephrased question with the same plan returns immediately. Plans the
+    # record index can answer (time windows, categorical filters, counts) skip the scan.
+
+    def __init__(self, planner=None, engine=None, catalog=None, indexes=None, max_results=256):
+        self.planner = planner or create_planner()
+        self.engine = engine or ChunkedEngine(ColumnarCache())
+        self.catalog = catalog or SchemaCatalog(DatasetProfiler(self.engine.cache))
+        self.indexes = indexes or RecordIndexStore(self.engine.cache)
+        self.max_results = max_results
+        self.results = OrderedDict()
+
+    def ask(self, question, folder):
+        start = time.perf_counter()
+        plan = self.planner.plan(question, self.catalog.folder(folder))
+        if plan is None:
+            return Answer(None, pd.DataFrame(), time.perf_counter() - start, False)
+        key = plan.key()
+        result = self.results.get(key)
+        cached = result is not None
+        if not cached:
+            result = self.indexes.answer(plan.schema.path, plan.query)
+            if result is None:
+                result = self.engine.run(plan.schema.path, plan.query)
+            self.results[key] = result
+            while len(self.results) > self.max_results:
+                self.results.popitem(last=False)
+        self.results.move_to_end(key)
+        return Answer(plan, result, time.perf_counter() - start, cached)
+
+
+def create_planner(kind=None):
+    # NYC_QUERY_PLANNER=openai uses the chat model; the default needs no network
+    kind = kind or os.environ.get('NYC_QUERY_PLANNER', 'rules')
+    if kind == 'openai':
+        return OpenAIPlanner()
+    return RuleBasedPlanner()
@@ -0,0 +1,571 @@
+import json
+import logging
+import math
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from chunked_analytics import normalize, normalize_array
+from columnar_cache import ColumnarCache
+
+INDEX_SUFFIX = '.stindex'
+INDEX_VERSION = 1
+
+# When a record was opened and closed, in order of preference across the 311, NYPD and 911 exports
+START_COLUMNS = ('created_date', 'add_ts', 'create_date', 'incident_date', 'date')
+END_COLUMNS = ('closed_date', 'closng_ts')
+CATEGORY_COLUMNS = ('borough', 'boro_nm', 'patrl_boro_nm', 'agency', 'complaint_type', 'descriptor',
+                    'community_board', 'status', 'typ_desc', 'radio_code', 'nypd_pct_cd', 'final_incident_type')
+LATITUDE_COLUMNS = ('latitude', 'lat')
+LONGITUDE_COLUMNS = ('longitude', 'lon', 'long')
+
+HOUR_MS = 3600 * 1000
+DAY_MS = 24 * HOUR_MS
+# 1970-01-01 was a Thursday; weeks start on Monday, as with pyarrow's floor_temporal
+WEEK_OFFSET_MS = 3 * DAY_MS
+METERS_PER_DEGREE = 111320.0
+
+
+def epoch_ms(value):
+    timestamp = pd.Timestamp(value)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.tz_convert(None)
+    return int(timestamp.to_datetime64().astype('datetime64[ms]').astype(np.int64))
+
+
+def column_epoch_ms(array):
+    # Timestamp column (or ISO text) -> int64 milliseconds and a mask of rows that have one
+    if pa.types.is_timestamp(array.type):
+        series = array.to_pandas()
+    else:
+        series = pd.to_datetime(array.cast(pa.string()).to_pandas(), errors='coerce', format='ISO8601')
+    if series.dt.tz is not None:
+        series = series.dt.tz_convert(None)
+    values = series.to_numpy(dtype='datetime64[ms]')
+    return values.view(np.int64), ~np.isnat(values)
+
+
+def floor_ms(values, unit):
+    if unit in ('year', 'month'):
+        months = values.astype('datetime64[ms]').astype('datetime64[Y]' if unit == 'year' else 'datetime64[M]')
+        return months.astype('datetime64[ms]').view(np.int64)
+    if unit == 'week':
+        return (values + WEEK_OFFSET_MS) // (7 * DAY_MS) * (7 * DAY_MS) - WEEK_OFFSET_MS
+    step = DAY_MS if unit == 'day' else HOUR_MS
+    return values // step * step
+
+
+def quantize(degrees, low, span, bits):
+    cells = np.floor((np.asarray(degrees, dtype=np.float64) - low) / span * (1 << bits))
+    return np.clip(np.nan_to_num(cells), 0, (1 << bits) - 1).astype(np.uint64)
+
+
+def spread_bits(values):
+    # 0b1011 -> 0b01000101: each bit moves to twice its position
+    values = values & 0xFFFFFFFF
+    values = (values | (values << 16)) & 0x0000FFFF0000FFFF
+    values = (values | (values << 8)) & 0x00FF00FF00FF00FF
+    values = (values | (values << 4)) & 0x0F0F0F0F0F0F0F0F
+    values = (values | (values << 2)) & 0x3333333333333333
+    return (values | (values << 1)) & 0x5555555555555555
+
+
+def interleave(latitude_cells, longitude_cells):
+    # Geohash bit order, longitude first: the top 5k bits of a key are the k-character geohash,
+    # and every coarser cell is one contiguous range of keys
+    return (spread_bits(longitude_cells) << 1) | spread_bits(latitude_cells)
+
+
+def geo_cells(latitudes, longitudes, bits):
+    return interleave(quantize(latitudes, -90.0, 180.0, bits), quantize(longitudes, -180.0, 360.0, bits))
+
+
+def cell_of(degrees, low, span, bits):
+    return min(max(math.floor((degrees - low) / span * (1 << bits)), 0), (1 << bits) - 1)
+
+
+def cover(south, west, north, east, bits, max_cells=64):
+    # Key ranges [low, high) of the cells at the finest level where at most max_cells cover the box
+    level = bits
+    while True:
+        lat_low, lat_high = cell_of(south, -90.0, 180.0, level), cell_of(north, -90.0, 180.0, level)
+        lon_low, lon_high = cell_of(west, -180.0, 360.0, level), cell_of(east, -180.0, 360.0, level)
+        if (lat_high - lat_low + 1) * (lon_high - lon_low + 1) <= max_cells or level == 0:
+            break
+        level -= 1
+    latitude_cells, longitude_cells = np.meshgrid(np.arange(lat_low, lat_high + 1, dtype=np.uint64),
+                                                  np.arange(lon_low, lon_high + 1, dtype=np.uint64))
+    keys = np.sort(interleave(latitude_cells.ravel(), longitude_cells.ravel()))
+    shift = 2 * (bits - level)
+    return keys << shift, (keys + 1) << shift
+
+
+def pick(names, candidates):
+    return next((column for column in candidates if column in names), None)
+
+
+class CategoryColumn:
+    # Codes per position (-1 for null) plus packed bitmaps for the most frequent values. A value
+    # without a bitmap is matched by comparing codes, but only within the queried time window.
+
+    def __init__(self, name, keys, values, codes, bitmap_codes, bitmaps):
+        self.name = name
+        self.keys = keys
+        self.values = values
+        self.lookup = {key: code for code, key in enumerate(keys)}
+        self.codes = codes
+        self.bitmap_rows = {code: row for row, code in enumerate(bitmap_codes)}
+        self.bitmaps = bitmaps
+
+    def matching(self, op, value):
+        # Codes satisfying a Query filter; nulls never match, as in the chunked engine
+        if op == '==':
+            codes = [self.lookup.get(normalize(value))]
+        elif op == 'in':
+            codes = [self.lookup.get(normalize(item)) for item in value]
+        elif op == '!=':
+            excluded = self.lookup.get(normalize(value))
+            codes = [code for code in range(len(self.keys)) if code != excluded]
+        elif op == 'contains':
+            needle = normalize(value)
+            codes = [code for code, key in enumerate(self.keys) if needle in key]
+        else:
+            return None
+        return sorted({code for code in codes if code is not None})
+
+    def bits(self, codes, first, last, rows):
+        # Packed membership over bytes [first, last) of position space
+        bits = np.zeros(last - first, dtype=np.uint8)
+        rest = []
+        for code in codes:
+            row = self.bitmap_rows.get(code)
+            if row is None:
+                rest.append(code)
+            else:
+                bits |= self.bitmaps[row, first:last]
+        if rest:
+            window = self.codes[first * 8:min(last * 8, rows)]
+            bits |= np.packbits(window == rest[0] if len(rest) == 1 else np.isin(window, rest))
+        return bits
+
+
+class RecordIndex:
+    # Rows of one dataset sorted by their start time ("positions"): a time window is a contiguous
+    # range found by binary search, categorical filters are packed bitmaps ANDed over that range
+    # only, and areas are ranges of geohash-ordered cell keys. Arrays are .npy files memory-mapped
+    # on open, so answering a query reads the pages of matching rows and little else.
+
+    def __init__(self, path, meta):
+        self.path = path
+        self.meta = meta
+        self.rows = meta['rows']
+        self.timed = meta['timed']
+        self.time_column = meta['time_column']
+        self.end_column = meta['end_column']
+        self.cell_bits = meta['cell_bits']
+        self.order = self.array('order')
+        self.times = self.array('times')
+        self.durations = self.array('durations') if self.end_column else None
+        self.categories = {}
+        for number, (column, info) in enumerate(meta['categories'].items()):
+            self.categories[column] = CategoryColumn(column, info['keys'], info['values'],
+                                                     self.array(f'codes-{number}'), info['bitmaps'],
+                                                     self.array(f'bitmaps-{number}'))
+        if meta['geo']:
+            self.latitudes = self.array('latitudes')
+            self.longitudes = self.array('longitudes')
+            self.cells = self.array('cells')
+            self.cell_positions = self.array('cell_positions')
+
+    def array(self, name):
+        return np.load(os.path.join(self.path, f'{name}.npy'), mmap_mode='r')
+
+    @classmethod
+    def open(cls, path):
+        with open(os.path.join(path, 'meta.json'), 'r') as file:
+            meta = json.load(file)
+        if meta.get('version') != INDEX_VERSION:
+            raise ValueError(f"Index {path} has version {meta.get('version')}, expected {INDEX_VERSION}")
+        return cls(path, meta)
+
+    @classmethod
+    def build(cls, table, path, source=None, time_column=None, end_column=None, category_columns=None,
+              cell_bits=20, max_bitmaps=64):
+        # table holds the columns to index, e.g. from ColumnarCache.read_table; source is stored so
+        # the index can tell whether it still describes the cached file
+        names = table.column_names
+        time_column = time_column or pick(names, START_COLUMNS) or next(
+            (field.name for field in table.schema if pa.types.is_timestamp(field.type)), None)
+        if time_column is None:
+            raise ValueError("No timestamp column to index")
+        end_column = end_column if end_column is not None else pick(names, END_COLUMNS)
+        if category_columns is None:
+            category_columns = [column for column in CATEGORY_COLUMNS if column in names]
+        latitude, longitude = pick(names, LATITUDE_COLUMNS), pick(names, LONGITUDE_COLUMNS)
+
+        rows = table.num_rows
+        position_type = np.int32 if rows < 2 ** 31 else np.int64
+        started, timed = column_epoch_ms(table.column(time_column))
+        # Untimed rows sort last, so every time window stays one contiguous range
+        order = np.argsort(np.where(timed, started, np.iinfo(np.int64).max), kind='stable').astype(position_type)
+        arrays = {'order': order, 'times': started[order[:int(timed.sum())]]}
+        if end_column:
+            ended, closed = column_epoch_ms(table.column(end_column))
+            durations = np.where(timed & closed, ended - started, -1)[order].astype(np.float64)
+            # Records closed before they were opened are data-entry errors, not instant resolutions
+            durations[durations < 0] = np.nan
+            arrays['durations'] = durations
+
+        categories = {}
+        for number, column in enumerate(category_columns):
+            original = table.column(column).combine_chunks().cast(pa.string())
+            encoded = pc.dictionary_encode(normalize_array(original))
+            codes = pc.fill_null(encoded.indices, -1).to_numpy(zero_copy_only=False)
+            keys = encoded.dictionary.to_pylist()
+            codes = codes.astype(np.int16 if len(keys) < 2 ** 15 else np.int32)
+            # Groups are labelled with the first spelling seen of each value
+            _, first = np.unique(codes, return_index=True)
+            first = first[codes[first] >= 0]
+            values = [None] * len(keys)
+            for code, value in zip(codes[first], original.take(pa.array(first)).to_pylist()):
+                values[code] = value
+            codes = codes[order]
+            counts = np.bincount(codes[codes >= 0], minlength=len(keys))
+            frequent = [int(code) for code in np.argsort(-counts, kind='stable')[:max_bitmaps] if counts[code]]
+            bitmaps = np.zeros((len(frequent), (rows + 7) // 8), dtype=np.uint8)
+            for row, code in enumerate(frequent):
+                bitmaps[row] = np.packbits(codes == code)
+            arrays[f'codes-{number}'] = codes
+            arrays[f'bitmaps-{number}'] = bitmaps
+            categories[column] = {'keys': keys, 'values': values, 'bitmaps': frequent}
+
+        geo = None
+        if latitude and longitude:
+            latitudes = pd.to_numeric(table.column(latitude).to_pandas(), errors='coerce').to_numpy(np.float64)[order]
+            longitudes = pd.to_numeric(table.column(longitude).to_pandas(), errors='coerce').to_numpy(np.float64)[order]
+            # 0, 0 is how missing coordinates often appear in city exports
+            located = np.flatnonzero(~np.isnan(latitudes) & ~np.isnan(longitudes) &
+                                     ((latitudes != 0) | (longitudes != 0))).astype(position_type)
+            cells = geo_cells(latitudes[located], longitudes[located], cell_bits)
+            by_cell = np.argsort(cells, kind='stable')
+            arrays.update(latitudes=latitudes, longitudes=longitudes, cells=cells[by_cell],
+                          cell_positions=located[by_cell])
+            geo = {'latitude': latitude, 'longitude': longitude}
+
+        meta = {'version': INDEX_VERSION, 'source': source, 'rows': rows, 'timed': int(timed.sum()),
+                'time_column': time_column, 'end_column': end_column, 'cell_bits': cell_bits,
+                'categories': categories, 'geo': geo}
+        # Written next to the final directory and swapped in, so readers never see half an index
+        temp_path = path + '.tmp'
+        shutil.rmtree(temp_path, ignore_errors=True)
+        os.makedirs(temp_path)
+        for name, array in arrays.items():
+            np.save(os.path.join(temp_path, f'{name}.npy'), array)
+        with open(os.path.join(temp_path, 'meta.json'), 'w') as file:
+            json.dump(meta, file)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(temp_path, path)
+        return cls.open(path)
+
+    def window(self, start_ms=None, end_ms=None):
+        # [lo, hi) positions with start_ms <= time < end_ms; without bounds, untimed rows too
+        if start_ms is None and end_ms is None:
+            return 0, self.rows
+        lo = 0 if start_ms is None else int(np.searchsorted(self.times, start_ms, 'left'))
+        hi = self.timed if end_ms is None else int(np.searchsorted(self.times, end_ms, 'left'))
+        return lo, max(lo, hi)
+
+    def where_bits(self, codes, lo, hi):
+        # Bitmaps of every filtered column ANDed over bytes [lo // 8, ceil(hi / 8)), with the
+        # bits outside [lo, hi) cleared
+        first, last = lo >> 3, (hi + 7) >> 3
+        bits = None
+        for column, column_codes in codes.items():
+            column_bits = self.categories[column].bits(column_codes, first, last, self.rows)
+            if bits is None:
+                bits = column_bits
+            else:
+                bits &= column_bits
+        if len(bits):
+            bits[0] &= 0xFF >> (lo & 7)
+            if hi & 7:
+                bits[-1] &= (0xFF << (8 - (hi & 7))) & 0xFF
+        return bits
+
+    def area_positions(self, south, west, north, east, lo, hi, center=None):
+        # Matches in [lo, hi) inside the box (and within center's radius). The cells covering the
+        # box give candidates across all time; when the time window holds fewer rows than that,
+        # its coordinates are checked directly instead.
+        ranges = cover(south, west, north, east, self.cell_bits)
+        starts = np.searchsorted(self.cells, ranges[0], 'left')
+        ends = np.searchsorted(self.cells, ranges[1], 'left')
+        if hi - lo <= int((ends - starts).sum()):
+            candidates = np.arange(lo, hi, dtype=self.cell_positions.dtype)
+        else:
+            candidates = np.concatenate([self.cell_positions[a:b] for a, b in zip(starts, ends)] or
+                                        [np.empty(0, dtype=self.cell_positions.dtype)])
+            candidates = candidates[(candidates >= lo) & (candidates < hi)]
+        latitudes, longitudes = self.latitudes[candidates], self.longitudes[candidates]
+        inside = (latitudes >= south) & (latitudes <= north) & (longitudes >= west) & (longitudes <= east)
+        if center is not None:
+            latitude, longitude, meters = center
+            dy = (latitudes - latitude) * METERS_PER_DEGREE
+            dx = (longitudes - longitude) * METERS_PER_DEGREE * math.cos(math.radians(latitude))
+            inside &= dx * dx + dy * dy <= meters * meters
+        return np.sort(candidates[inside])
+
+    def resolve(self, start_ms=None, end_ms=None, codes=None, area=None, near=None):
+        # -> (lo, hi, positions); positions is None when every row of [lo, hi) matches
+        lo, hi = self.window(start_ms, end_ms)
+        positions = None
+        if near is not None:
+            if not self.meta['geo']:
+                raise ValueError("Dataset has no coordinates to index")
+            latitude, longitude, meters = near
+            dlat = meters / METERS_PER_DEGREE
+            dlon = dlat / max(math.cos(math.radians(latitude)), 1e-6)
+            positions = self.area_positions(latitude - dlat, longitude - dlon, latitude + dlat, longitude + dlon,
+                                            lo, hi, center=near)
+        elif area is not None:
+            if not self.meta['geo']:
+                raise ValueError("Dataset has no coordinates to index")
+            positions = self.area_positions(*area, lo, hi)
+        if codes:
+            bits = self.where_bits(codes, lo, hi)
+            offset = (lo >> 3) * 8
+            if positions is None:
+                positions = (np.flatnonzero(np.unpackbits(bits)) + offset).astype(self.order.dtype)
+            else:
+                relative = positions - offset
+                positions = positions[(bits[relative >> 3] >> (7 - (relative & 7))) & 1 == 1]
+        return lo, hi, positions
+
+    def codes_for(self, where):
+        codes = {}
+        for column, values in (where or {}).items():
+            if column not in self.categories:
+                raise KeyError(f"Column {column!r} is not indexed; indexed: {', '.join(self.categories)}")
+            values = values if isinstance(values, (list, tuple, set)) else [values]
+            codes[column] = self.categories[column].matching('in', values)
+        return codes
+
+    def select(self, start=None, end=None, where=None, area=None, near=None):
+        # start <= time < end (anything pd.Timestamp accepts); where: {column: value or [values]},
+        # matched case-insensitively; area: (south, west, north, east) degrees; near: (lat, lon, meters)
+        start_ms = None if start is None else epoch_ms(start)
+        end_ms = None if end is None else epoch_ms(end)
+        return self.resolve(start_ms, end_ms, self.codes_for(where), area, near)
+
+    def take(self, array, lo, hi, positions):
+        return array[lo:hi] if positions is None else array[positions]
+
+    def times_at(self, lo, hi, positions):
+        # Start times of the matches, NaT (int64 min) for untimed rows
+        if positions is None:
+            untimed = max(0, hi - max(lo, self.timed))
+            return np.concatenate((self.times[lo:min(hi, self.timed)], np.full(untimed, np.iinfo(np.int64).min)))
+        values = np.full(len(positions), np.iinfo(np.int64).min)
+        inside = positions < self.timed
+        values[inside] = self.times[positions[inside]]
+        return values
+
+    def count(self, start=None, end=None, where=None, area=None, near=None):
+        start_ms = None if start is None else epoch_ms(start)
+        end_ms = None if end is None else epoch_ms(end)
+        codes = self.codes_for(where)
+        if not codes and area is None and near is None:
+            lo, hi = self.window(start_ms, end_ms)
+            return hi - lo
+        if area is None and near is None:
+            # Popcount over the window's bytes; positions are never materialized
+            lo, hi = self.window(start_ms, end_ms)
+            return int(np.bitwise_count(self.where_bits(codes, lo, hi)).sum())
+        return len(self.resolve(start_ms, end_ms, codes, area, near)[2])
+
+    def source_rows(self, start=None, end=None, where=None, area=None, near=None):
+        # Row numbers in the source file, ascending, e.g. for ColumnarCache.read_table(...).take(rows)
+        lo, hi, positions = self.select(start, end, where, area, near)
+        return np.sort(self.take(self.order, lo, hi, positions))
+
+    def time_counts(self, unit='day', start=None, end=None, where=None, area=None, near=None):
+        lo, hi, positions = self.select(start, end, where, area, near)
+        if positions is None:
+            values = self.times[lo:min(hi, self.timed)]
+        else:
+            values = self.times[positions[:np.searchsorted(positions, self.timed)]]
+        buckets = floor_ms(np.asarray(values), unit)
+        # Positions are in time order, so each bucket is one run
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(buckets)) + 1)) if len(buckets) else np.empty(0, int)
+        counts = np.diff(np.append(starts, len(buckets)))
+        index = pd.DatetimeIndex(buckets[starts].astype('datetime64[ms]'), name=f'{self.time_column}_{unit}')
+        return pd.Series(counts, index=index, name='count')
+
+    def value_counts(self, column, start=None, end=None, where=None, area=None, near=None):
+        lo, hi, positions = self.select(start, end, where, area, near)
+        category = self.categories[column]
+        codes = np.asarray(self.take(category.codes, lo, hi, positions))
+        counts = np.bincount(codes[codes >= 0], minlength=len(category.keys))
+        present = np.flatnonzero(counts)
+        result = pd.Series(counts[present], index=pd.Index([category.values[code] for code in present], name=column),
+                           name='count')
+        return result.sort_values(ascending=False, kind='stable')
+
+    def resolution_percentiles(self, percentiles=(50, 90, 99), start=None, end=None, where=None, area=None,
+                               near=None):
+        # Milliseconds from opened to closed over the matching records that were closed
+        if self.durations is None:
+            raise ValueError("Dataset has no closing time to measure resolution by")
+        lo, hi, positions = self.select(start, end, where, area, near)
+        durations = np.asarray(self.take(self.durations, lo, hi, positions))
+        durations = durations[~np.isnan(durations)]
+        values = np.percentile(durations, percentiles) if len(durations) else [np.nan] * len(percentiles)
+        return pd.Series(values, index=[f'p{percentile:g}' for percentile in percentiles], name='resolution_ms')
+
+    def cell_counts(self, bits=15, start=None, end=None, where=None, area=None, near=None):
+        # Matches per geohash-ordered cell at a coarser level, with each cell's centre, busiest first
+        lo, hi, positions = self.select(start, end, where, area, near)
+        latitudes = np.asarray(self.take(self.latitudes, lo, hi, positions))
+        longitudes = np.asarray(self.take(self.longitudes, lo, hi, positions))
+        located = ~np.isnan(latitudes) & ~np.isnan(longitudes) & ((latitudes != 0) | (longitudes != 0))
+        latitude_cells = quantize(latitudes[located], -90.0, 180.0, bits)
+        longitude_cells = quantize(longitudes[located], -180.0, 360.0, bits)
+        cells, first, counts = np.unique(interleave(latitude_cells, longitude_cells), return_index=True,
+                                         return_counts=True)
+        result = pd.DataFrame({
+            'cell': cells,
+            'latitude': (latitude_cells[first].astype(np.float64) + 0.5) * 180.0 / (1 << bits) - 90.0,
+            'longitude': (longitude_cells[first].astype(np.float64) + 0.5) * 360.0 / (1 << bits) - 180.0,
+            'count': counts,
+        })
+        return result.sort_values('count', ascending=False, ignore_index=True)
+
+    def answer(self, query):
+        # The index's answer to a chunked_analytics.Query, in ChunkedEngine.run's format, or None
+        # when the query filters, groups or aggregates on something the index does not hold
+        if any(function != 'count' or column is not None for function, column in query.aggregates):
+            return None
+        start_ms = end_ms = None
+        codes = {}
+        for column, op, value in query.filters:
+            if column == self.time_column and op in ('>=', '>', '<', '<='):
+                bound = epoch_ms(value) + (1 if op in ('>', '<=') else 0)
+                if op in ('>=', '>'):
+                    start_ms = bound if start_ms is None else max(start_ms, bound)
+                else:
+                    end_ms = bound if end_ms is None else min(end_ms, bound)
+            elif column in self.categories:
+                matching = self.categories[column].matching(op, value)
+                if matching is None:
+                    return None
+                codes[column] = sorted(set(codes[column]) & set(matching)) if column in codes else matching
+            else:
+                return None
+        if any(column not in self.categories for column in query.group_by):
+            return None
+        if query.time_bucket and query.time_bucket[0] != self.time_column:
+            return None
+
+        keys = query.keys()
+        if not keys:
+            if start_ms is not None and end_ms is not None and end_ms <= start_ms:
+                return pd.DataFrame({'count': [0]})
+            lo, hi = self.window(start_ms, end_ms)
+            count = int(np.bitwise_count(self.where_bits(codes, lo, hi)).sum()) if codes else hi - lo
+            return pd.DataFrame({'count': [count]})
+
+        lo, hi, positions = self.resolve(start_ms, end_ms, codes)
+        # Each key becomes a small integer and the keys are combined into one, so grouping is a
+        # single np.unique over the matches
+        parts = []
+        for column in query.group_by:
+            category = self.categories[column]
+            parts.append((column, np.asarray(self.take(category.codes, lo, hi, positions)).astype(np.int64) + 1,
+                          np.array([None] + category.values, dtype=object)))
+        if query.time_bucket:
+            times = self.times_at(lo, hi, positions)
+            timed = times != np.iinfo(np.int64).min
+            times[timed] = floor_ms(times[timed], query.time_bucket[1])
+            labels, inverse = np.unique(times, return_inverse=True)
+            parts.append((keys[-1], inverse.astype(np.int64), labels.astype('datetime64[ms]')))
+        combined = np.zeros(len(parts[0][1]), dtype=np.int64)
+        radix = 1
+        for _, part, labels in reversed(parts):
+            if radix * len(labels) >= 2 ** 62:
+                return None
+            combined += part * radix
+            radix *= len(labels)
+        groups, counts = np.unique(combined, return_counts=True)
+        result = {}
+        for column, _, labels in reversed(parts):
+            groups, part = np.divmod(groups, len(labels))
+            result[column] = labels[part]
+        result = pd.DataFrame({column: result[column] for column in keys})
+        result['count'] = counts
+        return result.sort_values('count', ascending=False, ignore_index=True)
+
+
+class RecordIndexStore:
+    # One index directory per dataset next to its Parquet cache ("<name>.stindex"), rebuilt when
+    # the cache is. Only datasets with a start time and something to filter on are indexed.
+
+    def __init__(self, cache=None, min_rows=None, cell_bits=20, max_bitmaps=64):
+        self.cache = cache or ColumnarCache()
+        # Below this many rows a scan is already fast, so questions do not build indexes for it
+        self.min_rows = int(os.environ.get('NYC_INDEX_MIN_ROWS', 100000)) if min_rows is None else min_rows
+        self.cell_bits = cell_bits
+        self.max_bitmaps = max_bitmaps
+        self.indexes = {}
+
+    def index_path(self, source_path):
+        return os.path.splitext(source_path)[0] + INDEX_SUFFIX
+
+    def open(self, source_path):
+        path = self.index_path(source_path)
+        if not os.path.exists(os.path.join(path, 'meta.json')) or not self.cache.is_fresh(source_path):
+            return None
+        try:
+            index = RecordIndex.open(path)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Unreadable index {path}: {e}")
+            return None
+        return index if index.meta['source'] == self.cache.stored_fingerprint(source_path) else None
+
+    def build(self, source_path):
+        schema = self.cache.schema(source_path)
+        names = schema.names
+        time_column = pick(names, START_COLUMNS) or next(
+            (field.name for field in schema if pa.types.is_timestamp(field.type)), None)
+        categories = [column for column in CATEGORY_COLUMNS if column in names]
+        latitude, longitude = pick(names, LATITUDE_COLUMNS), pick(names, LONGITUDE_COLUMNS)
+        if time_column is None or not (categories or (latitude and longitude)):
+            return None
+        columns = [time_column, pick(names, END_COLUMNS), latitude, longitude] + categories
+        table = self.cache.read_table(source_path, columns=[column for column in columns if column])
+        logging.info(f"Building record index for {source_path}")
+        return RecordIndex.build(table, self.index_path(source_path), source=self.cache.stored_fingerprint(source_path),
+                                 time_column=time_column, category_columns=categories, cell_bits=self.cell_bits,
+                                 max_bitmaps=self.max_bitmaps)
+
+    def get(self, source_path, min_rows=0):
+        # The dataset's index, built if missing or stale; None when it cannot or need not be indexed
+        fingerprint = self.cache.fingerprint(source_path, with_hash=False)
+        cached = self.indexes.get(source_path)
+        if cached is not None and cached[0] == fingerprint and (cached[1] is not None or cached[2] <= min_rows):
+            return cached[1]
+        index = self.open(source_path)
+        if index is None and self.cache.num_rows(source_path) >= min_rows:
+            index = self.build(source_path)
+        self.indexes[source_path] = (fingerprint, index, min_rows)
+        return index
+
+    def answer(self, source_path, query):
+        try:
+            index = self.get(source_path, self.min_rows)
+            return index.answer(query) if index is not None else None
+        except Exception as e:
+            logging.warning(f"Record index could not answer for {source_path}: {e}")
+            return None
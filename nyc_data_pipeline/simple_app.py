@@ -1,8 +1,11 @@
 import asyncio
-import json
 import os
-import requests
 from chatbot import Chatbot
+from dataset_catalog import DatasetCatalog
+from soda_downloader import SODADownloader
+from dataset_manifest import DatasetManifest
+from dataset_profile import DatasetProfiler
+from question_engine import QuestionEngine
 import aiohttp
 import nest_asyncio
 import pandas as pd
@@ -26,45 +29,63 @@ async def fetch_endpoints_from_url(url):
     return endpoints
 
 
-def save_endpoints_to_files(endpoints, folder):
+async def save_endpoints_to_files(endpoints, folder, concurrency=4, page_size=50000, refresh=False):
     # Ensure the folder exists
     os.makedirs(folder, exist_ok=True)
     
-    total_endpoints = len(endpoints)
     progress_bar = st.progress(0)
     progress_text = st.empty()  # Placeholder for text updates
-    
-    # Iterate through the endpoints dictionary
-    for idx, (name, url) in enumerate(endpoints.items()):
-        # Create the file path
-        file_path = os.path.join(folder, f"{name}.json")
-        
-        # Check if data already exists
-        if os.path.exists(file_path):
-            progress_text.text(f'Data already exists for {name}')
+    dataset_status = {}
+    manifest = DatasetManifest(folder)
+
+    # Skip datasets that were already downloaded, unless refreshing ones with a manifest watermark
+    pending = {}
+    for name, url in endpoints.items():
+        exists = any(os.path.exists(os.path.join(folder, f"{name}{ext}")) for ext in ('.json', '.ndjson'))
+        if exists and not (refresh and manifest.get(name)):
+            dataset_status[name] = f'Data already exists for {name}'
         else:
-            try:
-                # Make the HTTP request to fetch the data
-                response = requests.get(url)
-                response.raise_for_status()  # Check if the request was successful
-                
-                # Parse the JSON data
-                data = response.json()
-                
-                # Save the data to a file
-                with open(file_path, 'w') as file:
-                    json.dump(data, file, indent=4)
-                progress_text.text(f'Successfully saved data from {name} to {file_path}')
-            except requests.RequestException as e:
-                progress_text.text(f'Failed to fetch data from {url}: {e}')
-            except ValueError as e:
-                progress_text.text(f'Failed to parse JSON data from {url}: {e}')
-        
-        # Update the progress bar
-        progress_value = (idx + 1) / total_endpoints
-        progress_bar.progress(progress_value)
-    
-    progress_text.text('Data fetching and saving completed.')
+            pending[name] = url
+    total_endpoints = max(len(endpoints), 1)
+    skipped = len(endpoints) - len(pending)
+    fractions = {}
+
+    def report(stats):
+        if stats.error:
+            dataset_status[stats.name] = f'Failed to fetch data for {stats.name}: {stats.error}'
+        else:
+            total = f'/{stats.total_rows:,}' if stats.total_rows else ''
+            if stats.mode == 'refresh':
+                state = 'refreshed' if stats.finished else 'refreshing'
+            else:
+                state = 'saved' if stats.finished else 'downloading'
+            dataset_status[stats.name] = (
+                f'{stats.name}: {state} {stats.rows:,}{total} rows, '
+                f'{stats.rows_per_second:,.0f} rows/s, {stats.bytes_per_second / 1e6:.2f} MB/s'
+            )
+        fractions[stats.name] = stats.fraction
+        progress_bar.progress(min((skipped + sum(fractions.values())) / total_endpoints, 1.0))
+        progress_text.text('\n'.join(dataset_status.values()))
+
+    progress_text.text('\n'.join(dataset_status.values()))
+    downloader = SODADownloader(page_size=page_size, concurrency=concurrency, profiler=DatasetProfiler())
+    results = await downloader.run(pending, folder, progress=report, refresh=refresh)
+
+    progress_bar.progress(1.0)
+    dataset_status['done'] = 'Data fetching and saving completed.'
+    progress_text.text('\n'.join(dataset_status.values()))
+    return results
+
+
+@st.cache_resource
+def question_engine():
+    # Shared across reruns and sessions so answered plans stay memoized
+    return QuestionEngine()
+
+
+@st.cache_resource
+def dataset_catalog():
+    return DatasetCatalog(profiler=question_engine().catalog.profiler)
 
 
 async def main():
@@ -73,31 +94,35 @@ async def main():
     # Create two columns
     col1, col2 = st.columns([1, 1])
 
-    chatbot = Chatbot()  # Instantiate the Chatbot
+    engine = question_engine()
+    chatbot = Chatbot(engine.engine.cache, engine.catalog.profiler, engine, dataset_catalog())  # Instantiate the Chatbot
 
     with col1:
         query = st.text_input("Enter your query:", value="311")  # Default value is 311
+        refresh = st.checkbox("Refresh existing datasets", value=False)
         fetch_button = st.button("Fetch Data")
 
         if fetch_button:
             url = f'https://data.cityofnewyork.us/browse?q={query}'
             folder = f'{query}_data'
             endpoints = await fetch_endpoints_from_url(url)
-            save_endpoints_to_files(endpoints, folder)
-            chatbot.load_data(folder)  # Load data into the chatbot
+            await save_endpoints_to_files(endpoints, folder, refresh=refresh)
+            chatbot.load_profiles(folder)  # Load stored dataset profiles into the chatbot
 
-            dataset_names = [name.replace('.json', '') for name in os.listdir(folder) if name.endswith('.json')]
-            dataset_choice = st.selectbox("Select a dataset:", dataset_names)
+            dataset_names = sorted(chatbot.profiles)
+            dataset_choice = st.selectbox("Select a dataset:", dataset_names,
+                                          format_func=lambda name: os.path.splitext(name)[0])
 
             if dataset_choice:
-                analysis_result, dashboards = chatbot.generate_response(f'{dataset_choice}.json')
+                analysis_result, dashboards = chatbot.generate_response(dataset_choice)
                 st.write("Summary Statistics:", analysis_result)
                 for idx, fig in enumerate(dashboards, 1):
                     st.pyplot(fig)
     
     with col2:
         st.header("Chatbox")
-        folders = [f for f in os.listdir('.') if os.path.isdir(f) and '_data' in f]
+        chatbot.catalog.scan()  # Incremental: unchanged files cost one stat each
+        folders = chatbot.catalog.folders()
         folder_choice = st.selectbox("Select a folder:", folders)
 
         if folder_choice:
@@ -107,12 +132,19 @@ async def main():
                 st.write(f"Number of records: {insight['number_of_records']}")
                 st.write(f"Number of columns: {insight['number_of_columns']}")
                 st.write(f"Columns: {', '.join(insight['columns'])}")
+                if insight['duplicate_of']:
+                    st.write(f"Same content as {insight['duplicate_of']}")
             for dashboard in dashboards:
                 st.pyplot(dashboard)
 
         user_input = st.text_area("Type your message here...", height=200)
         send_button = st.button("Send")
 
+        if send_button and user_input and folder_choice:
+            answer = chatbot.answer_question(user_input, folder_choice)
+            st.write(answer.text())
+            st.dataframe(answer.result)
+
 # Run the main function
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,266 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+
+import aiohttp
+
+from dataset_manifest import DatasetManifest
+
+# System fields needed for keyset pagination and :updated_at watermarks
+SYSTEM_FIELDS = ':id, :updated_at, *'
+
+
+class DownloadStats:
+    def __init__(self, name, total_rows=None):
+        self.name = name
+        self.total_rows = total_rows
+        self.mode = 'full'
+        self.rows = 0
+        self.bytes = 0
+        self.started = time.perf_counter()
+        self.finished = None
+        self.error = None
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.perf_counter()) - self.started
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def bytes_per_second(self):
+        return self.bytes / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def fraction(self):
+        if self.finished:
+            return 1.0
+        if not self.total_rows:
+            return 0.0
+        return min(self.rows / self.total_rows, 1.0)
+
+
+class SODADownloader:
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(self, page_size=50000, concurrency=4, retries=3, backoff=0.5, timeout=300,
+                 keyset=False, app_token=None, session=None, profiler=None):
+        self.page_size = page_size
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        # Keyset pagination ($where=:id > last) avoids the deep-offset slowdown on very large datasets
+        self.keyset = keyset
+        self.headers = {'X-App-Token': app_token} if app_token else {}
+        self.session = session
+        # Optional DatasetProfiler; appended rows are folded into fresh profiles on refresh
+        self.profiler = profiler
+        self.semaphore = None
+        self.manifest = None
+
+    async def get_json(self, url, params):
+        for attempt in range(self.retries + 1):
+            try:
+                async with self.session.get(url, params=params, headers=self.headers) as response:
+                    if response.status == 200:
+                        body = await response.read()
+                        return json.loads(body), len(body)
+                    if response.status not in self.RETRY_STATUSES:
+                        raise aiohttp.ClientResponseError(
+                            response.request_info, response.history, status=response.status,
+                            message=await response.text())
+                    logging.warning(f"Error {response.status} fetching {url}, attempt {attempt + 1}")
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                logging.warning(f"Error fetching URL {url}, attempt {attempt + 1}: {e}")
+            if attempt < self.retries:
+                await asyncio.sleep(self.backoff * (2 ** attempt) * (1 + random.random()))
+        raise aiohttp.ClientError(f"Giving up on {url} after {self.retries + 1} attempts")
+
+    async def count_rows(self, url, where=None):
+        params = {'$select': 'count(*) as count'}
+        if where:
+            params['$where'] = where
+        try:
+            rows, _ = await self.get_json(url, params)
+            return int(rows[0]['count'])
+        except (aiohttp.ClientError, ValueError, KeyError, IndexError) as e:
+            logging.warning(f"Could not count rows for {url}: {e}")
+            return None
+
+    async def latest_update(self, url):
+        # Asked before the first page, so rows updated while paging are newer than the watermark
+        # and the next refresh picks them up, even if their page was already fetched
+        try:
+            rows, _ = await self.get_json(url, {'$select': 'max(:updated_at) as watermark'})
+            return rows[0].get('watermark') if rows else None
+        except (aiohttp.ClientError, ValueError, KeyError, IndexError) as e:
+            logging.warning(f"Could not read the latest update time for {url}: {e}")
+            return None
+
+    def page_params(self, offset, last_id, where=None):
+        params = {'$limit': self.page_size, '$order': ':id', '$select': SYSTEM_FIELDS}
+        clauses = [where] if where else []
+        if self.keyset:
+            if last_id is not None:
+                clauses.append(f":id > '{last_id}'")
+        else:
+            params['$offset'] = offset
+        if clauses:
+            params['$where'] = ' AND '.join(f'({clause})' for clause in clauses)
+        return params
+
+    async def iter_pages(self, url, stats, where=None):
+        offset = 0
+        last_id = None
+        while True:
+            rows, size = await self.get_json(url, self.page_params(offset, last_id, where))
+            if not rows:
+                return
+            stats.rows += len(rows)
+            stats.bytes += size
+            yield rows
+            if len(rows) < self.page_size:
+                return
+            offset += len(rows)
+            last_id = rows[-1].get(':id')
+
+    def upsert_key(self, row):
+        return 'unique_key' if 'unique_key' in row else ':id'
+
+    async def download(self, name, url, folder, progress=None):
+        stats = DownloadStats(name)
+        file_path = os.path.join(folder, f"{name}.ndjson")
+        temp_path = file_path + '.tmp'
+        async with self.semaphore:
+            stats.started = time.perf_counter()
+            try:
+                stats.total_rows = await self.count_rows(url)
+                # Without a watermark the next refresh downloads the dataset again
+                watermark = await self.latest_update(url)
+                key = None
+                columns = set()
+                # Only one page is held in memory at a time; rows go straight to disk
+                with open(temp_path, 'w') as file:
+                    async for rows in self.iter_pages(url, stats):
+                        for row in rows:
+                            key = key or self.upsert_key(row)
+                            columns.update(row)
+                            file.write(json.dumps(row, separators=(',', ':')))
+                            file.write('\n')
+                        if progress:
+                            progress(stats)
+                os.replace(temp_path, file_path)
+                self.manifest.update(name, url, key or ':id', watermark, stats.rows, columns)
+            except (aiohttp.ClientError, ValueError, OSError) as e:
+                stats.error = e
+                logging.error(f"Failed to download {name} from {url}: {e}")
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+            stats.finished = time.perf_counter()
+        if progress:
+            progress(stats)
+        return stats
+
+    async def refresh(self, name, url, folder, progress=None):
+        entry = self.manifest.get(name)
+        file_path = os.path.join(folder, f"{name}.ndjson")
+        if not entry or not entry.get('watermark') or not os.path.exists(file_path):
+            return await self.download(name, url, folder, progress)
+
+        stats = DownloadStats(name)
+        stats.mode = 'refresh'
+        temp_path = file_path + '.tmp'
+        async with self.semaphore:
+            stats.started = time.perf_counter()
+            try:
+                key = entry['key']
+                watermark = entry['watermark']
+                # Inclusive: rows stamped at the watermark may not have been visible last time, and
+                # fetching one again is harmless because the merge is an upsert
+                where = f":updated_at >= '{watermark}'"
+                stats.total_rows = await self.count_rows(url, where)
+                latest = await self.latest_update(url)
+
+                # The delta is small compared to the dataset, so it is kept in memory for the merge
+                changed = {}
+                async for rows in self.iter_pages(url, stats, where):
+                    for row in rows:
+                        changed[row.get(key, row.get(':id'))] = row
+                    if progress:
+                        progress(stats)
+
+                if changed:
+                    profile_fresh = self.profiler is not None and self.profiler.is_fresh(file_path)
+                    total_rows, columns, appended, replaced = self.merge(file_path, temp_path, key, changed)
+                    if self.profiler is not None:
+                        if profile_fresh and not replaced:
+                            self.profiler.extend(file_path, appended)
+                        else:
+                            # Sketches cannot retract updated rows, so the profile is rebuilt on next use
+                            self.profiler.invalidate(file_path)
+                    if sorted(columns) != entry['columns']:
+                        logging.info(f"Schema of {name} changed during refresh")
+                    self.manifest.update(name, url, key, latest or watermark, total_rows, columns)
+                elif latest:
+                    self.manifest.update(name, url, key, latest, entry['rows'], entry['columns'])
+            except (aiohttp.ClientError, ValueError, OSError) as e:
+                stats.error = e
+                logging.error(f"Failed to refresh {name} from {url}: {e}")
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+            stats.finished = time.perf_counter()
+        if progress:
+            progress(stats)
+        return stats
+
+    def merge(self, file_path, temp_path, key, changed):
+        # Stream the local copy, replacing updated rows in place and appending new ones
+        total_rows = 0
+        replaced = 0
+        columns = set()
+        with open(file_path, 'r') as source, open(temp_path, 'w') as target:
+            for line in source:
+                if not line.strip():
+                    continue
+                row = json.loads(line)
+                replacement = changed.pop(row.get(key, row.get(':id')), None)
+                # Rows at the watermark come back unchanged on every refresh; only real updates count
+                if replacement is not None and replacement != row:
+                    row = replacement
+                    replaced += 1
+                    line = json.dumps(row, separators=(',', ':')) + '\n'
+                columns.update(row)
+                target.write(line)
+                total_rows += 1
+            appended = list(changed.values())
+            for row in appended:
+                columns.update(row)
+                target.write(json.dumps(row, separators=(',', ':')))
+                target.write('\n')
+                total_rows += 1
+        os.replace(temp_path, file_path)
+        return total_rows, columns, appended, replaced
+
+    async def run(self, endpoints, folder, progress=None, refresh=False):
+        os.makedirs(folder, exist_ok=True)
+        self.manifest = DatasetManifest(folder)
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        fetch = self.refresh if refresh else self.download
+        owns_session = self.session is None
+        if owns_session:
+            connector = aiohttp.TCPConnector(limit=self.concurrency)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        try:
+            results = await asyncio.gather(
+                *(fetch(name, url, folder, progress) for name, url in endpoints.items()))
+        finally:
+            if owns_session:
+                await self.session.close()
+                self.session = None
+        return {stats.name: stats for stats in results}
@@ -1,13 +1,17 @@
 import requests
 from bs4 import BeautifulSoup
 import logging
-import subprocess
+import asyncio
+import re
 import aiohttp
 import os
 import random
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+URL_PATTERN = re.compile(r'(?:http|https)://[a-zA-Z0-9./?=_%:-]*')
+RESOURCE_LINK_PATTERN = re.compile(r'resource/.*\.json$')
+
 class NYCPublicDataFetcher:
     def __init__(self, start_url):
         self.start_url = start_url
@@ -57,52 +61,64 @@ class NYCPublicDataFetcher:
         return data
 
 class NYCEndpointFetcher:
-    def __init__(self):
-        pass
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(self, concurrency=8, retries=3, backoff=0.5, timeout=30, session=None):
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.session = session
+        self.semaphore = None
 
     async def fetch_content(self, url):
-        async with aiohttp.ClientSession() as session:
+        # Created on first use, inside the running loop, so fetch_content also works without run()
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+        for attempt in range(self.retries + 1):
             try:
-                async with session.get(url) as response:
-                    if response.status == 200:
-                        text = await response.text()
-                        with open('temp.html', 'w+') as temp_file:
-                            temp_file.write(text)
-                            api_resource_link = self.bash_resource_link('temp.html')
-                        return api_resource_link
-                    else:
-                        logging.error(f"Error {response.status}: Unable to fetch the webpage.")
-                        return ""
-            except aiohttp.ClientError as e:
-                logging.error(f"Error fetching URL {url}: {e}")
-                return ""
+                async with self.semaphore:
+                    async with self.session.get(url) as response:
+                        if response.status == 200:
+                            text = await response.text()
+                            return self.extract_resource_links(text)
+                        if response.status not in self.RETRY_STATUSES:
+                            logging.error(f"Error {response.status}: Unable to fetch the webpage.")
+                            return ""
+                        logging.warning(f"Error {response.status} fetching {url}, attempt {attempt + 1}")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logging.warning(f"Error fetching URL {url}, attempt {attempt + 1}: {e}")
+            if attempt < self.retries:
+                # Exponential backoff with jitter, outside the semaphore so other requests proceed
+                await asyncio.sleep(self.backoff * (2 ** attempt) * (1 + random.random()))
+        logging.error(f"Giving up on {url} after {self.retries + 1} attempts")
+        return ""
+
+    def extract_resource_links(self, text):
+        links = {link for link in URL_PATTERN.findall(text) if RESOURCE_LINK_PATTERN.search(link)}
+        return "\n".join(sorted(links))
 
-    def bash_resource_link(self, file_name):
-        # This function remains synchronous as it's just running a bash command
-        command_content = f"cat {file_name} | grep -Eo '(http|https)://[a-zA-Z0-9./?=_%:-]*' | grep -E 'resource/.*\\.json$' | sort -u"
+    async def run(self, data_dict):  # Note the "async" here
+        # A fresh semaphore per run: a semaphore that has made a task wait is bound to that loop
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        owns_session = self.session is None
+        if owns_session:
+            connector = aiohttp.TCPConnector(limit=self.concurrency)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
         try:
-            result = subprocess.run(command_content, shell=True, capture_output=True, text=True)
-            if result.returncode == 0:
-                return result.stdout.strip()
-            else:
-                logging.error(f"Error executing bash command: {result.stderr}")
-                return None
-        except Exception as e:
-            logging.error(f"Error running subprocess command: {e}")
-            return None
+            keys = list(data_dict)
+            endpoints = await asyncio.gather(*(self.fetch_content(data_dict[key]) for key in keys))
+        finally:
+            if owns_session:
+                await self.session.close()
+                self.session = None
 
-    async def run(self, data_dict):  # Note the "async" here
         endpoints_dict = {}
-        for key, url in data_dict.items():
-            endpoint = await self.fetch_content(url)  # Await the asynchronous fetch_content method
+        for key, endpoint in zip(keys, endpoints):
             if endpoint:
                 endpoints_dict[key] = endpoint
             else:
                 logging.warning(f"Couldn't find endpoint for {key}")
-        try:
-            subprocess.run("rm temp.html", shell=True)
-        except Exception as e:
-            logging.error(f"Error deleting temporary file: {e}")
         return endpoints_dict
 
 class NYCUrlFetcher:
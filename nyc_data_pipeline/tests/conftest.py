@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The pipeline modules import each other by file name, as when run from nyc_data_pipeline/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
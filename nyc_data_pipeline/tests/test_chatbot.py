@@ -0,0 +1,18 @@
+from chatbot import Chatbot
+from columnar_cache import ColumnarCache
+from question_engine import QuestionEngine
+
+
+def test_chatbot_shares_the_question_engine_engine_and_indexes():
+    question_engine = QuestionEngine()
+    chatbot = Chatbot(question_engine=question_engine)
+    assert chatbot.engine is question_engine.engine
+    assert chatbot.indexes is question_engine.indexes
+
+
+def test_chatbot_builds_one_engine_over_its_cache():
+    cache = ColumnarCache()
+    chatbot = Chatbot(cache)
+    assert chatbot.engine is chatbot.question_engine.engine
+    assert chatbot.engine.cache is cache
+    assert chatbot.indexes is chatbot.question_engine.indexes
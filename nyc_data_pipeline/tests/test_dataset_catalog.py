@@ -0,0 +1,82 @@
+import json
+import os
+import threading
+
+import pytest
+
+from dataset_catalog import DatasetCatalog
+from dataset_profile import DatasetProfiler
+
+
+def write_dataset(folder, name, rows):
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, name), 'w') as file:
+        json.dump([{'unique_key': str(i), 'borough': 'BROOKLYN'} for i in range(rows)], file)
+
+
+class FlakyProfiler(DatasetProfiler):
+    # Fails the first profile() of each file, as an unreadable half-written download would
+    def __init__(self):
+        super().__init__()
+        self.failed = set()
+
+    def profile(self, source_path):
+        if source_path not in self.failed:
+            self.failed.add(source_path)
+            raise ValueError('truncated file')
+        return super().profile(source_path)
+
+
+@pytest.fixture
+def root(tmp_path):
+    write_dataset(tmp_path / '311_data', 'requests.json', 5)
+    write_dataset(tmp_path / '911_data', 'calls.json', 3)
+    return str(tmp_path)
+
+
+def scan_ids(catalog):
+    return [row[0] for row in catalog.db.execute("SELECT id FROM scans ORDER BY id")]
+
+
+def test_only_scans_that_find_something_are_recorded(root):
+    catalog = DatasetCatalog(root)
+    assert catalog.scan()['added'] == 2
+    assert catalog.scan() == {'added': 0, 'changed': 0, 'removed': 0, 'unchanged': 2}
+    catalog.files(os.path.join(root, '311_data'))
+    assert scan_ids(catalog) == [1]
+
+    write_dataset(os.path.join(root, '311_data'), 'requests.json', 7)
+    os.remove(os.path.join(root, '911_data', 'calls.json'))
+    assert catalog.scan()['changed'] == 1
+    assert scan_ids(catalog) == [1, 2]
+    assert catalog.changed_since() == [{'path': os.path.join('311_data', 'requests.json'), 'status': 'changed'},
+                                       {'path': os.path.join('911_data', 'calls.json'), 'status': 'removed'}]
+    assert catalog.files(os.path.join(root, '311_data'))[0]['number_of_records'] == 7
+
+
+def test_concurrent_scans_share_one_catalog(root):
+    catalog = DatasetCatalog(root)
+    errors = []
+
+    def rescan(i):
+        try:
+            write_dataset(os.path.join(root, f'{i}_data'), 'rows.json', i + 1)
+            catalog.scan()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=rescan, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert len(catalog.folders()) == 10
+
+
+def test_files_whose_profiling_failed_are_retried(root):
+    catalog = DatasetCatalog(root, profiler=FlakyProfiler())
+    catalog.scan()
+    assert catalog.files(os.path.join(root, '311_data'))[0]['number_of_records'] is None
+    assert catalog.scan()['unchanged'] == 2
+    assert catalog.files(os.path.join(root, '311_data'))[0]['number_of_records'] == 5
@@ -0,0 +1,79 @@
+import json
+import os
+
+import pytest
+
+from question_engine import QuestionEngine, RuleBasedPlanner
+
+COMPLAINTS = ['Noise - Residential', 'HEAT/HOT WATER', 'Illegal Parking']
+BOROUGHS = ['BROOKLYN', 'QUEENS', 'MANHATTAN']
+
+
+def write_json(path, records):
+    with open(path, 'w') as file:
+        json.dump(records, file)
+
+
+@pytest.fixture
+def folder(tmp_path):
+    # Socrata-style dumps, every value a string
+    write_json(tmp_path / '311-Service-Requests.json', [
+        {'unique_key': str(i), 'created_date': f'{2018 + i % 3}-0{i % 9 + 1}-15T10:00:00.000',
+         'complaint_type': COMPLAINTS[i % 3], 'borough': BOROUGHS[i // 3 % 3]}
+        for i in range(90)])
+    # Shares the borough column, and "Borough Park" puts "borough" among its values too
+    write_json(tmp_path / 'FDNY-Firehouse-Listing.json', [
+        {'facilityname': f'Engine {i}', 'borough': BOROUGHS[i % 3].title(),
+         'nta': 'Borough Park' if i % 2 else 'Midtown', 'number_of_units': str(i % 4 + 1)}
+        for i in range(40)])
+    return str(tmp_path)
+
+
+@pytest.fixture
+def engine():
+    return QuestionEngine(planner=RuleBasedPlanner())
+
+
+def plan(engine, question, folder):
+    return engine.planner.plan(question, engine.catalog.folder(folder))
+
+
+def test_row_words_and_columns_choose_the_dataset(engine, folder):
+    result = plan(engine, 'complaints by borough', folder)
+    assert result.schema.name == '311-Service-Requests.json'
+    assert result.query.group_by == ['borough']
+
+
+def test_values_and_years_become_filters(engine, folder):
+    result = plan(engine, 'noise complaints in brooklyn in 2019', folder)
+    assert result.schema.name == '311-Service-Requests.json'
+    assert ('borough', '==', 'BROOKLYN') in result.query.filters
+    assert ('complaint_type', 'contains', 'noise') in result.query.filters
+    assert ('created_date', '>=', '2019-01-01') in result.query.filters
+
+
+def test_aggregates_ignore_stopwords(engine, folder):
+    assert plan(engine, 'average number of units of firehouses', folder).query.aggregates == \
+        [('count', None), ('mean', 'number_of_units')]
+    # "of" alone must not pick number_of_units
+    assert plan(engine, 'average of firehouses', folder).query.aggregates == [('count', None)]
+
+
+def test_unmatched_question_is_not_planned(engine, folder):
+    assert plan(engine, "what's up", folder) is None
+    answer = engine.ask("what's up", folder)
+    assert answer.plan is None and answer.text().startswith("Couldn't plan")
+
+
+def test_answers_are_memoized_by_plan_until_the_data_changes(engine, folder):
+    first = engine.ask('heat complaints in queens', folder)
+    assert not first.cached
+    assert engine.ask('Heat complaints in Queens?', folder).cached
+    assert int(first.result['count'][0]) == sum(1 for i in range(90) if i % 3 == 1 and i // 3 % 3 == 1)
+
+    path = os.path.join(folder, '311-Service-Requests.json')
+    write_json(path, [{'unique_key': '1', 'created_date': '2019-01-15T10:00:00.000',
+                       'complaint_type': 'HEAT/HOT WATER', 'borough': 'QUEENS'}] * 3)
+    refreshed = engine.ask('heat complaints in queens', folder)
+    assert not refreshed.cached
+    assert int(refreshed.result['count'][0]) == 3
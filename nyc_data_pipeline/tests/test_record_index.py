@@ -0,0 +1,42 @@
+import json
+
+import pytest
+
+from chunked_analytics import ChunkedEngine, Query
+from columnar_cache import ColumnarCache
+from record_index import RecordIndexStore
+
+# The same borough spelled the ways Socrata exports spell it
+BOROUGHS = ['BROOKLYN', 'Brooklyn', 'Brooklyn ', 'QUEENS', 'Queens', 'BRONX', None]
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    path = tmp_path / 'requests.ndjson'
+    with open(path, 'w') as file:
+        for i in range(700):
+            record = {'unique_key': str(i), 'created_date': f'2024-01-{i % 28 + 1:02d}T{i % 24:02d}:00:00.000',
+                      'complaint_type': 'HEAT/HOT WATER' if i % 3 else 'Noise - Residential'}
+            if BOROUGHS[i % len(BOROUGHS)] is not None:
+                record['borough'] = BOROUGHS[i % len(BOROUGHS)]
+            file.write(json.dumps(record) + '\n')
+    return str(path)
+
+
+@pytest.mark.parametrize('filters', [
+    [('borough', 'in', ['brooklyn', 'QUEENS'])],
+    [('borough', 'in', [' Queens '])],
+    [('borough', '==', 'brooklyn ')],
+    [('borough', '!=', 'BROOKLYN')],
+    [('complaint_type', 'contains', 'heat ')],
+    [('created_date', '>=', '2024-01-10'), ('borough', 'in', ['bronx', 'Brooklyn'])],
+])
+def test_index_and_scan_normalize_filters_alike(dataset, filters):
+    cache = ColumnarCache()
+    index = RecordIndexStore(cache, min_rows=0).get(dataset)
+    query = Query(filters=filters)
+    expected = ChunkedEngine(cache, workers=1).run(dataset, query)
+    result = index.answer(query)
+    assert result is not None
+    assert result['count'].tolist() == expected['count'].tolist()
+    assert expected['count'][0] > 0
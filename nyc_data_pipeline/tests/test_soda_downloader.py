@@ -0,0 +1,149 @@
+import asyncio
+import json
+import os
+import re
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from dataset_manifest import DatasetManifest
+from soda_downloader import SODADownloader
+
+WHERE = re.compile(r"(:id|:updated_at)\s*(>=|>)\s*'([^']*)'")
+JANUARY, FEBRUARY, MARCH = '2024-01-01T00:00:00.000', '2024-02-01T00:00:00.000', '2024-03-01T00:00:00.000'
+
+
+def record(i, updated_at=JANUARY, borough='BROOKLYN'):
+    return {':id': f'row-{i:04d}', ':updated_at': updated_at, 'unique_key': str(i), 'borough': borough}
+
+
+class FakeSODA:
+    # One dataset served the way the SODA API pages it. Tests edit rows between calls, or while
+    # a download is paging through on_page(pages_served).
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.wheres = []
+        self.pages = 0
+        self.on_page = None
+
+    def matching(self, where):
+        rows = self.rows
+        for field, op, value in WHERE.findall(where or ''):
+            rows = [row for row in rows if row[field] > value or (op == '>=' and row[field] == value)]
+        return sorted(rows, key=lambda row: row[':id'])
+
+    async def handle(self, request):
+        params = request.query
+        rows = self.matching(params.get('$where'))
+        select = params.get('$select', '')
+        if select.startswith('count('):
+            return web.json_response([{'count': str(len(rows))}])
+        if select.startswith('max(:updated_at)'):
+            return web.json_response([{'watermark': max((row[':updated_at'] for row in rows), default=None)}])
+        self.wheres.append(params.get('$where'))
+        offset = int(params.get('$offset', 0))
+        response = web.json_response(rows[offset:offset + int(params['$limit'])])
+        self.pages += 1
+        if self.on_page:
+            self.on_page(self.pages)
+        return response
+
+
+def fetch(soda, folder, refresh=False, **options):
+    async def run():
+        app = web.Application()
+        app.router.add_get('/resource/test.json', soda.handle)
+        async with TestServer(app) as server:
+            downloader = SODADownloader(page_size=3, backoff=0, **options)
+            results = await downloader.run({'test': str(server.make_url('/resource/test.json'))}, folder,
+                                           refresh=refresh)
+        return results['test']
+    stats = asyncio.run(run())
+    assert stats.error is None
+    return stats
+
+
+def local_rows(folder):
+    with open(os.path.join(folder, 'test.ndjson'), 'r') as file:
+        return [json.loads(line) for line in file]
+
+
+@pytest.mark.parametrize('keyset', [False, True])
+def test_download_writes_every_row_and_the_manifest(tmp_path, keyset):
+    soda = FakeSODA([record(i, updated_at=FEBRUARY if i == 4 else JANUARY) for i in range(10)])
+    stats = fetch(soda, str(tmp_path), keyset=keyset)
+
+    assert stats.rows == 10 and stats.total_rows == 10
+    assert [row['unique_key'] for row in local_rows(str(tmp_path))] == [str(i) for i in range(10)]
+    entry = DatasetManifest(str(tmp_path)).get('test')
+    assert entry['key'] == 'unique_key'
+    assert entry['watermark'] == FEBRUARY
+    assert entry['rows'] == 10
+    assert not os.path.exists(os.path.join(str(tmp_path), 'test.ndjson.tmp'))
+
+
+def test_refresh_upserts_changed_rows_in_place_and_appends_new_ones(tmp_path):
+    soda = FakeSODA([record(i) for i in range(7)])
+    fetch(soda, str(tmp_path))
+    soda.rows[2] = record(2, updated_at=FEBRUARY, borough='QUEENS')
+    soda.rows.append(record(7, updated_at=FEBRUARY))
+
+    stats = fetch(soda, str(tmp_path), refresh=True)
+
+    assert stats.mode == 'refresh'
+    rows = local_rows(str(tmp_path))
+    assert [row['unique_key'] for row in rows] == [str(i) for i in range(8)]
+    assert rows[2]['borough'] == 'QUEENS'
+    entry = DatasetManifest(str(tmp_path)).get('test')
+    assert entry['rows'] == 8
+    assert entry['watermark'] == FEBRUARY
+
+
+def test_refresh_fetches_rows_stamped_at_the_watermark(tmp_path):
+    soda = FakeSODA([record(i) for i in range(5)])
+    fetch(soda, str(tmp_path))
+    # Committed with the same timestamp, but not visible during the download
+    soda.rows.append(record(5, updated_at=JANUARY))
+
+    fetch(soda, str(tmp_path), refresh=True)
+
+    assert soda.wheres[-1] == f"(:updated_at >= '{JANUARY}')"
+    assert [row['unique_key'] for row in local_rows(str(tmp_path))] == [str(i) for i in range(6)]
+
+
+def test_rows_updated_during_a_download_are_caught_by_the_next_refresh(tmp_path):
+    soda = FakeSODA([record(i) for i in range(9)])
+
+    def update(pages):
+        # After the first page: a row on that page changes, then one on a page still to come
+        if pages == 1:
+            soda.rows[0] = record(0, updated_at=FEBRUARY, borough='BRONX')
+            soda.rows[8] = record(8, updated_at=MARCH)
+    soda.on_page = update
+    fetch(soda, str(tmp_path))
+    soda.on_page = None
+
+    assert local_rows(str(tmp_path))[0]['borough'] == 'BROOKLYN'
+    assert DatasetManifest(str(tmp_path)).get('test')['watermark'] == JANUARY
+
+    fetch(soda, str(tmp_path), refresh=True)
+
+    rows = local_rows(str(tmp_path))
+    assert len(rows) == 9
+    assert rows[0]['borough'] == 'BRONX'
+    assert DatasetManifest(str(tmp_path)).get('test')['watermark'] == MARCH
+
+
+def test_refresh_without_changes_leaves_the_file_as_it_was(tmp_path):
+    soda = FakeSODA([record(i) for i in range(4)])
+    fetch(soda, str(tmp_path))
+    with open(os.path.join(str(tmp_path), 'test.ndjson'), 'rb') as file:
+        before = file.read()
+
+    fetch(soda, str(tmp_path), refresh=True)
+
+    with open(os.path.join(str(tmp_path), 'test.ndjson'), 'rb') as file:
+        assert file.read() == before
+    assert DatasetManifest(str(tmp_path)).get('test')['rows'] == 4
@@ -0,0 +1,95 @@
+import asyncio
+
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from source_extract_async import NYCEndpointFetcher, NYCPublicDataFetcher
+
+BROWSE_PAGE = '''<html><body><div class="browse2-content">
+<div class="browse2-result" data-view-id="erm2-nwe9">
+  <a class="browse2-result-name-link" href="{base}/dataset/erm2-nwe9">311 Service Requests</a>
+</div>
+<div class="browse2-result" data-view-id="h9gi-nx95">
+  <a class="browse2-result-name-link" href="{base}/dataset/h9gi-nx95">Motor Vehicle Collisions</a>
+</div>
+<div class="browse2-result"><a class="browse2-result-name-link" href="{base}/dataset/no-id">No view id</a></div>
+</div></body></html>'''
+
+DATASET_PAGE = '''<html><body>
+<a href="https://data.cityofnewyork.us/resource/{view_id}.json">API endpoint</a>
+<a href="https://data.cityofnewyork.us/resource/{view_id}.json">API endpoint again</a>
+<a href="https://data.cityofnewyork.us/api/views/{view_id}/rows.csv">CSV</a>
+</body></html>'''
+
+
+class FakePortal:
+    # A browse page and one page per dataset. failures[view_id] is how many 503s that dataset
+    # answers with before it serves its page.
+
+    def __init__(self, failures=None):
+        self.failures = dict(failures or {})
+        self.hits = {}
+
+    async def browse(self, request):
+        base = str(request.url.origin())
+        return web.Response(text=BROWSE_PAGE.format(base=base), content_type='text/html')
+
+    async def dataset(self, request):
+        view_id = request.match_info['view_id']
+        self.hits[view_id] = self.hits.get(view_id, 0) + 1
+        if self.failures.get(view_id, 0) >= self.hits[view_id]:
+            return web.Response(status=503)
+        if view_id == 'missing':
+            return web.Response(status=404)
+        return web.Response(text=DATASET_PAGE.format(view_id=view_id), content_type='text/html')
+
+
+def serve(portal, run):
+    async def main():
+        app = web.Application()
+        app.router.add_get('/browse', portal.browse)
+        app.router.add_get('/dataset/{view_id}', portal.dataset)
+        async with TestServer(app) as server:
+            return await run(server)
+    return asyncio.run(main())
+
+
+def test_browse_and_endpoints_retry_a_503():
+    portal = FakePortal(failures={'erm2-nwe9': 1})
+
+    async def run(server):
+        data = await NYCPublicDataFetcher(str(server.make_url('/browse'))).run()
+        endpoints = await NYCEndpointFetcher(backoff=0).run(data)
+        return data, endpoints
+
+    data, endpoints = serve(portal, run)
+    assert sorted(data) == ['erm2-nwe9', 'h9gi-nx95']
+    assert endpoints == {
+        'erm2-nwe9': 'https://data.cityofnewyork.us/resource/erm2-nwe9.json',
+        'h9gi-nx95': 'https://data.cityofnewyork.us/resource/h9gi-nx95.json',
+    }
+    assert portal.hits == {'erm2-nwe9': 2, 'h9gi-nx95': 1}
+
+
+def test_fetch_content_without_run():
+    portal = FakePortal(failures={'erm2-nwe9': 1})
+
+    async def run(server):
+        async with aiohttp.ClientSession() as session:
+            fetcher = NYCEndpointFetcher(backoff=0, session=session)
+            return await fetcher.fetch_content(str(server.make_url('/dataset/erm2-nwe9')))
+
+    assert serve(portal, run) == 'https://data.cityofnewyork.us/resource/erm2-nwe9.json'
+
+
+def test_gives_up_after_retries_and_skips_client_errors():
+    portal = FakePortal(failures={'h9gi-nx95': 10})
+
+    async def run(server):
+        data = {view_id: str(server.make_url(f'/dataset/{view_id}')) for view_id in ('h9gi-nx95', 'missing')}
+        return await NYCEndpointFetcher(retries=2, backoff=0).run(data)
+
+    assert serve(portal, run) == {}
+    # A 503 is retried until the attempts run out; a 404 is not retried at all
+    assert portal.hits == {'h9gi-nx95': 3, 'missing': 1}
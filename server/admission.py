@@ -0,0 +1,219 @@
+import asyncio
+import collections
+import math
+import os
+import re
+import time
+
+from telemetry import REGISTRY, Gauge
+
+COALESCED = REGISTRY.counter("nyc_coalesced_total", "Callers served by another caller's in-flight call", ["stage"])
+SHED = REGISTRY.counter("nyc_shed_total", "Upstream calls refused by admission control", ["upstream", "reason"])
+
+# concurrency, queue, calls per second (0 = no quota), burst
+UPSTREAM_DEFAULTS = {
+    "completion": (16, 64, 0.0, 0),
+    "retrieval": (8, 64, 0.0, 0),
+    "translation": (32, 128, 0.0, 0),
+    "tts": (4, 32, 0.0, 0),
+}
+# Longest a call may wait for a slot or for quota before it is shed instead
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", "5"))
+
+
+class Overloaded(Exception):
+    # Raised instead of queueing work the upstream cannot take; status is 429 when a quota
+    # is exhausted and 503 when the queue is full, retry_after is in seconds
+    def __init__(self, upstream, reason, retry_after, status):
+        super().__init__(f"{upstream} is overloaded ({reason})")
+        self.upstream = upstream
+        self.reason = reason
+        self.retry_after = retry_after
+        self.status = status
+
+    def headers(self):
+        return {"Retry-After": str(max(1, math.ceil(self.retry_after)))}
+
+
+class TokenBucket:
+    # rate tokens per second up to burst. A caller reserves a token and sleeps until it is due,
+    # so waiters are served in arrival order and the upstream never sees more than rate/s.
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+
+    def reserve(self):
+        # Takes one token (possibly on credit) and returns the seconds until it is available
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def refund(self):
+        self.tokens += 1
+
+
+class UpstreamLimiter:
+    # At most `concurrency` calls in flight to one upstream, at most `queue_size` waiting, and
+    # optionally a token bucket for its quota. Waiters are plain futures rather than an
+    # asyncio.Semaphore, so one module-level limiter works under any event loop.
+
+    def __init__(self, name, concurrency, queue_size, rate=0.0, burst=0, max_wait=ADMISSION_MAX_WAIT):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.max_wait = max_wait
+        self.active = 0
+        self.waiters = collections.deque()
+        # Moving average of how long a call holds its slot, for Retry-After estimates
+        self.service_seconds = 0.1
+        self.admitted = 0
+        self.shed = 0
+
+    def refuse(self, reason, retry_after, status):
+        self.shed += 1
+        SHED.inc(self.name, reason)
+        return Overloaded(self.name, reason, retry_after, status)
+
+    def queue_wait(self):
+        return (len(self.waiters) + 1) * self.service_seconds / self.concurrency
+
+    async def acquire(self):
+        if self.active >= self.concurrency and len(self.waiters) >= self.queue_size:
+            raise self.refuse("queue_full", self.queue_wait(), 503)
+        if self.bucket is not None:
+            delay = self.bucket.reserve()
+            if delay > self.max_wait:
+                self.bucket.refund()
+                raise self.refuse("rate_limited", delay, 429)
+            if delay:
+                await asyncio.sleep(delay)
+        if self.active < self.concurrency and not self.waiters:
+            self.active += 1
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            self.waiters.append(waiter)
+            try:
+                # release() hands its slot over by resolving the future, so active is not decremented
+                await asyncio.wait_for(waiter, self.max_wait)
+            except BaseException as e:
+                # A slot handed over just as the wait ended is passed on, not leaked
+                if waiter.done() and not waiter.cancelled():
+                    self.release()
+                if isinstance(e, asyncio.TimeoutError):
+                    raise self.refuse("queue_timeout", self.queue_wait(), 503) from None
+                raise
+            finally:
+                if waiter in self.waiters:
+                    self.waiters.remove(waiter)
+        self.admitted += 1
+        return time.monotonic()
+
+    def release(self, started=None):
+        if started is not None:
+            self.service_seconds = 0.9 * self.service_seconds + 0.1 * (time.monotonic() - started)
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def slot(self):
+        return LimiterSlot(self)
+
+    def stats(self):
+        return {"active": self.active, "queued": len(self.waiters), "admitted": self.admitted, "shed": self.shed,
+                "service_seconds": round(self.service_seconds, 4)}
+
+
+class LimiterSlot:
+    # async with limiters["completion"].slot(): ...
+    __slots__ = ("limiter", "started")
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+
+    async def __aenter__(self):
+        self.started = await self.limiter.acquire()
+        return self
+
+    async def __aexit__(self, kind, error, traceback):
+        self.limiter.release(self.started)
+        return False
+
+
+def create_limiter(name):
+    # COMPLETION_CONCURRENCY, COMPLETION_QUEUE, COMPLETION_RATE (calls/s, e.g. RPM / 60), COMPLETION_BURST
+    concurrency, queue_size, rate, burst = UPSTREAM_DEFAULTS[name]
+    prefix = name.upper()
+    return UpstreamLimiter(name, int(os.getenv(f"{prefix}_CONCURRENCY", concurrency)),
+                           int(os.getenv(f"{prefix}_QUEUE", queue_size)),
+                           rate=float(os.getenv(f"{prefix}_RATE", rate)), burst=int(os.getenv(f"{prefix}_BURST", burst)))
+
+
+limiters = {name: create_limiter(name) for name in UPSTREAM_DEFAULTS}
+
+
+def upstream(name):
+    return limiters[name].slot()
+
+
+class SingleFlight:
+    # Concurrent callers with the same key share one execution: the first starts it as a task,
+    # the rest await that task. It is cancelled only when every caller has gone away, so one
+    # client timing out does not fail the others.
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.calls = {}
+        self.leaders = 0
+        self.followers = 0
+
+    async def run(self, key, function, *args, **kwargs):
+        call = self.calls.get(key)
+        if call is None:
+            task = asyncio.ensure_future(function(*args, **kwargs))
+            call = self.calls[key] = [task, 0]
+            task.add_done_callback(lambda _: self.calls.pop(key, None) if self.calls.get(key) is call else None)
+            self.leaders += 1
+        else:
+            self.followers += 1
+            COALESCED.inc(self.stage)
+        task = call[0]
+        call[1] += 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            call[1] -= 1
+            if call[1] == 0 and not task.done():
+                task.cancel()
+
+    def stats(self):
+        return {"leaders": self.leaders, "followers": self.followers, "in_flight": len(self.calls)}
+
+
+def normalize_question(question):
+    # Same words, same key: case, spacing and trailing punctuation do not change the answer
+    return re.sub(r"\s+", " ", question or "").strip().rstrip("?!. ").casefold()
+
+
+def stats():
+    return {name: limiter.stats() for name, limiter in limiters.items()}
+
+
+def limiter_metrics():
+    active = Gauge("nyc_upstream_active", "Calls in flight to each upstream", ["upstream"])
+    queued = Gauge("nyc_upstream_queued", "Calls waiting for an upstream slot", ["upstream"])
+    for name, limiter in limiters.items():
+        active.values[(name,)] = limiter.active
+        queued.values[(name,)] = len(limiter.waiters)
+    return [active, queued]
+
+
+REGISTRY.register_collector(limiter_metrics)
@@ -0,0 +1,101 @@
+import itertools
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+class CachedAnswer:
+    def __init__(self, vector, doc_ids, answer, sources, latency):
+        self.vector = vector
+        self.doc_ids = doc_ids
+        self.answer = answer
+        self.sources = sources
+        self.latency = latency
+        self.created = time.monotonic()
+
+
+class SemanticAnswerCache:
+    # Answers are bucketed by the exact set of retrieved documents, so a lookup only compares
+    # the question embedding against questions that were answered from the same context.
+
+    def __init__(self, threshold=0.95, ttl=3600, max_entries=1000):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.buckets = {}
+        self.ids = itertools.count()
+        self.lock = threading.Lock()
+        self.index_version = None
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    @staticmethod
+    def normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def check_version(self, version):
+        # A rebuilt index can return different documents for the same ids
+        with self.lock:
+            if version != self.index_version:
+                self.clear()
+                self.index_version = version
+
+    def clear(self):
+        self.entries.clear()
+        self.buckets.clear()
+
+    def evict(self, entry_id):
+        entry = self.entries.pop(entry_id)
+        bucket = self.buckets[entry.doc_ids]
+        bucket.remove(entry_id)
+        if not bucket:
+            del self.buckets[entry.doc_ids]
+
+    def lookup(self, vector, doc_ids):
+        doc_ids = frozenset(doc_ids)
+        query = self.normalize(vector)
+        now = time.monotonic()
+        with self.lock:
+            best_id, best_score = None, self.threshold
+            for entry_id in list(self.buckets.get(doc_ids, ())):
+                entry = self.entries[entry_id]
+                if now - entry.created > self.ttl:
+                    self.evict(entry_id)
+                    continue
+                score = float(entry.vector @ query)
+                if score >= best_score:
+                    best_id, best_score = entry_id, score
+            if best_id is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(best_id)
+            entry = self.entries[best_id]
+            self.hits += 1
+            self.saved_seconds += entry.latency
+            return entry
+
+    def store(self, vector, doc_ids, answer, sources, latency):
+        entry = CachedAnswer(self.normalize(vector), frozenset(doc_ids), answer, sources, latency)
+        with self.lock:
+            entry_id = next(self.ids)
+            self.entries[entry_id] = entry
+            self.buckets.setdefault(entry.doc_ids, []).append(entry_id)
+            while len(self.entries) > self.max_entries:
+                self.evict(next(iter(self.entries)))
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "saved_seconds": round(self.saved_seconds, 3),
+                "threshold": self.threshold,
+            }
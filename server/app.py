@@ -1,56 +1,373 @@
-import requests
-from flask import Flask, request
-from flask_cors import CORS
-import numpy as np
-from rag_generation import answer_nyc_question
-from text_to_voice import generate_audio
 import asyncio
+import base64
+import json
+import logging
+import os
+import re
 
-app = Flask(__name__)
-CORS(app)
+import aiohttp
+from quart import Blueprint, Quart, Response, current_app, has_app_context, request, stream_with_context
+from quart_cors import cors
+import rag_generation
+import text_to_voice
+import tokenizer
+from admission import Overloaded, SingleFlight, normalize_question
+from clients import WarmUp
+from rag_generation import answer_nyc_question_async, stream_nyc_answer, answer_cache
+from speech_to_text import STT_SAMPLE_RATE, AudioError, WavStreamDecoder, create_speech_to_text, stt_language, trim_silence
+from telemetry import REGISTRY, cache_metrics, configure_logging, finish_request, span, start_request
+from text_to_voice import generate_audio, synthesize_segment
+from translation import create_translation_client
 
+routes = Blueprint("routes", __name__)
+log = logging.getLogger(__name__)
 
-@app.route('/')
-def home():
+TRANSLATION_TIMEOUT = float(os.getenv("TRANSLATION_TIMEOUT", "10"))
+RETRIEVAL_TIMEOUT = float(os.getenv("RETRIEVAL_TIMEOUT", "10"))
+COMPLETION_TIMEOUT = float(os.getenv("COMPLETION_TIMEOUT", "30"))
+TTS_TIMEOUT = float(os.getenv("TTS_TIMEOUT", "30"))
+STT_TIMEOUT = float(os.getenv("STT_TIMEOUT", "60"))
+# Decoded audio is capped per request: 120s of 16 kHz float32 is under 8 MB
+MAX_AUDIO_SECONDS = float(os.getenv("MAX_AUDIO_SECONDS", "120"))
+GENERATE_AUDIO = os.getenv("GENERATE_AUDIO", "1") == "1"
+# Steps run by each worker after it starts listening; WARMUP= (empty) leaves every client to its first request
+WARMUP = os.getenv("WARMUP", "tokenizer,retriever,embeddings,llm,tts,speech_to_text")
+# With WARMUP_BEFORE_SERVING=1 a worker does not accept connections until warm-up is done
+WARMUP_BEFORE_SERVING = os.getenv("WARMUP_BEFORE_SERVING", "0") == "1"
+
+# Concurrent requests for the same work share one upstream call per stage. Keys are the
+# normalized question, or the text being translated or spoken, plus the language.
+flights = {stage: SingleFlight(stage) for stage in ("translate_question", "answer", "translate_answer", "audio")}
+
+# A sentence ends at terminal punctuation followed by whitespace, or at a line break
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+|\n+')
+
+
+def create_app():
+    # Building the app creates no clients and opens no connections: the retriever, embedder,
+    # LLM and TTS clients are process-wide and lazy, and the per-worker ones are made in
+    # before_serving. Serve with e.g. hypercorn "app:create_app()" --workers 4
+    app = cors(Quart(__name__))
+    configure_logging()
+    app.register_blueprint(routes)
+    app.before_serving(create_clients)
+    app.after_serving(close_clients)
+    return app
+
+
+def warm_up_tokenizer():
+    # The encoding's BPE file is downloaded on first use; a failure shows up in /readyz
+    if tokenizer.encoding() is None:
+        raise RuntimeError("tiktoken encoding unavailable, token counts are estimated")
+
+
+async def warm_up_tts():
+    await text_to_voice.tts.get().voice_for("en")
+
+
+def warm_up_steps(app):
+    steps = {
+        "tokenizer": warm_up_tokenizer,
+        "retriever": lambda: rag_generation.retriever.get().warm_up(),
+        "embeddings": rag_generation.embedding_service.get,
+        "llm": rag_generation.llm.get,
+        "tts": warm_up_tts,
+        # Looked up when the step runs, so a backend swapped in after startup is the one loaded
+        "speech_to_text": lambda: app.speech_to_text.load(),
+    }
+    names = [name.strip() for name in WARMUP.split(",") if name.strip()]
+    if not GENERATE_AUDIO and "tts" in names:
+        names.remove("tts")
+    for name in names:
+        if name not in steps:
+            log.warning(f"Unknown warm-up step {name!r}; expected one of {', '.join(steps)}")
+    return [(name, steps[name]) for name in names if name in steps]
+
+
+def client_caches(app):
+    # Clients not built yet are left out rather than created by a scrape
+    caches = {"answers": answer_cache, "translations": app.translator.cache}
+    if rag_generation.embedding_service.created:
+        caches["embeddings"] = rag_generation.embedding_service.get().cache
+    if text_to_voice.tts.created:
+        caches["tts"] = text_to_voice.tts.get()
+    return caches
+
+
+def client_cache_metrics():
+    # /metrics renders inside the serving app's context, whichever app the server built
+    if not has_app_context() or not hasattr(current_app, "translator"):
+        return []
+    return cache_metrics(client_caches(current_app))
+
+
+# Cache counters are read from the caches themselves when /metrics is scraped. Registered once
+# per process: before_serving runs again for every app and every restart of the same one.
+REGISTRY.register_collector(client_cache_metrics)
+
+
+async def create_clients():
+    app = current_app._get_current_object()
+    # Pooled, cached translation client shared by every request in this worker
+    app.translator = create_translation_client()
+    await app.translator.start()
+    app.speech_to_text = create_speech_to_text()
+    app.warm_up = WarmUp(warm_up_steps(app))
+    if WARMUP_BEFORE_SERVING:
+        await app.warm_up.run()
+    else:
+        app.add_background_task(app.warm_up.run)
+
+
+async def close_clients():
+    await current_app.translator.close()
+
+
+def is_english(language):
+    return not language or language.lower().split('-')[0] == 'en'
+
+
+@routes.route('/')
+async def home():
     return 'Server is running'
 
 
-@app.route('/about')
-def about():
+@routes.route('/about')
+async def about():
     return "This api is used to answer any questions one has about the essential services in NYC"
 
 
-@app.route('/get_answer', methods=['POST'])
-def get_answer():
-    translation_url = "http://burro.mlsp.cs.cmu.edu:5000/translate"
-    # print all request args
-    language = request.form.get('language')
-    question = request.form.get('question')
-    print('question: ', question)
-    print('lang:', language)
-    translated_response = requests.post(translation_url, data={
-                                        "q": question, "source": "auto", "target": "en", "format": "text"})
-    translated_question = translated_response.json()['translatedText']
-    answer, sources = answer_nyc_question(question)
-    payload = {
-        "q": answer,
-        "source": "en",
-        "target": language,
-        "format": "text"
-    }
-    translated_response = requests.post(translation_url, data=payload)
-    translated_answer = translated_response.json()['translatedText']
+@routes.route('/healthz')
+async def healthz():
+    # Liveness: the event loop is answering
+    return {"status": "ok"}
+
+
+@routes.route('/readyz')
+async def readyz():
+    # Readiness: warm-up has finished, so the first request does not pay for loading clients
+    status = current_app.warm_up.status()
+    return status, 200 if status["ready"] else 503
+
+
+@routes.route('/cache_stats')
+async def cache_stats():
+    return {"answers": answer_cache.stats(), "translations": current_app.translator.stats()}
+
 
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
+@routes.route('/metrics')
+async def metrics():
+    return REGISTRY.render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+
+@routes.route('/get_answer', methods=['POST'])
+async def get_answer():
+    trace = start_request('get_answer')
+    status = 500
+    try:
+        form = await request.form
+        result, status, headers = await answer_request(form.get('question'), form.get('language'))
+        return result, status, headers
+    finally:
+        finish_request(trace, status)
+
+
+@routes.route('/get_answer_audio', methods=['POST'])
+async def get_answer_audio():
+    # Body: a WAV recording, sent with Content-Length or chunked. It is decoded and resampled as
+    # it arrives, silence is trimmed, and the transcript is answered like a typed question.
+    trace = start_request('get_answer_audio')
+    status = 500
     try:
-        result = loop.run_until_complete(
-            generate_audio(translated_answer, language))
+        language = request.args.get('language')
+        decoder = WavStreamDecoder(STT_SAMPLE_RATE, max_seconds=MAX_AUDIO_SECONDS)
+        try:
+            with span('decode_audio'):
+                async for chunk in request.body:
+                    decoder.feed(chunk)
+                audio = decoder.audio()
+        except AudioError as e:
+            status = e.status
+            return {"error": str(e)}, status
+        with span('voice_activity'):
+            speech = trim_silence(audio, STT_SAMPLE_RATE)
+        if not len(speech):
+            status = 422
+            return {"error": "No speech detected"}, status
+        try:
+            with span('speech_to_text', seconds=round(len(speech) / STT_SAMPLE_RATE, 2)):
+                transcript = await asyncio.wait_for(asyncio.to_thread(
+                    current_app.speech_to_text.transcribe, speech, STT_SAMPLE_RATE, stt_language(language)), STT_TIMEOUT)
+        except asyncio.TimeoutError:
+            status = 504
+            return {"error": "Timed out during speech_to_text"}, status
+        if not transcript:
+            status = 422
+            return {"error": "No speech recognized"}, status
+        result, status, headers = await answer_request(transcript, language)
+        if status == 200:
+            result["transcript"] = transcript
+        return result, status, headers
     finally:
-        loop.close()
-    return result
+        finish_request(trace, status)
+
+
+async def answer_request(question, language):
+    # Returns (body, status, headers)
+    log.info(f"question: {question!r} language: {language!r}")
+    language_key = (language or 'en').lower()
+    translator = current_app.translator
+
+    stage = 'translation'
+    try:
+        if is_english(language):
+            translated_question = question
+        else:
+            with span('translate_question', language=language):
+                translated_question = await asyncio.wait_for(flights["translate_question"].run(
+                    (normalize_question(question), language_key), translator.translate, question, "auto", "en"),
+                    TRANSLATION_TIMEOUT)
+
+        stage = 'answer'
+        with span('answer'):
+            answer, sources = await flights["answer"].run(
+                normalize_question(translated_question), answer_nyc_question_async, translated_question,
+                retrieval_timeout=RETRIEVAL_TIMEOUT, completion_timeout=COMPLETION_TIMEOUT)
+
+        stage = 'translation'
+        if is_english(language):
+            translated_answer = answer
+        else:
+            with span('translate_answer', language=language):
+                translated_answer = await asyncio.wait_for(flights["translate_answer"].run(
+                    (answer, language_key), translator.translate_paragraphs, answer, "en", language),
+                    TRANSLATION_TIMEOUT)
+    except asyncio.TimeoutError:
+        return {"error": f"Timed out during {stage}"}, 504, {}
+    except aiohttp.ClientError as e:
+        return {"error": f"Upstream error during {stage}: {e}"}, 502, {}
+    except Overloaded as e:
+        # Shed quickly so clients back off instead of piling onto a saturated upstream
+        return {"error": f"{e}; retry later"}, e.status, e.headers()
+    except rag_generation.llm_errors() as e:
+        overloaded = rag_generation.rate_limited(e)
+        if overloaded is not None:
+            return {"error": f"{overloaded}; retry later"}, overloaded.status, overloaded.headers()
+        return {"error": f"Upstream error during {stage}: {e}"}, 502, {}
+
+    audio = None
+    if GENERATE_AUDIO:
+        # As on the stream path, failed speech costs the audio, not the answer
+        try:
+            with span('audio'):
+                audio = await asyncio.wait_for(flights["audio"].run(
+                    (translated_answer, language_key), generate_audio, translated_answer, language or 'en'),
+                    TTS_TIMEOUT)
+        except Exception as e:
+            log.warning(f"Failed to synthesize the answer: {e}")
+
+    result = {"answer": answer, "translatedAnswer": translated_answer + '\n\n' + sources}
+    if audio is not None:
+        result["audio"] = base64.b64encode(audio).decode('ascii')
+    return result, 200, {}
+
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def split_sentences(buffer):
+    # Returns the finished sentences and the unfinished remainder
+    parts = SENTENCE_BOUNDARY.split(buffer)
+    return [part.strip() for part in parts[:-1] if part.strip()], parts[-1]
+
+
+async def speak_sentence(index, sentence, language):
+    translated = sentence if is_english(language) else await asyncio.wait_for(
+        current_app.translator.translate(sentence, "en", language), TRANSLATION_TIMEOUT)
+    audio = None
+    if GENERATE_AUDIO:
+        # A failed segment costs that sentence's audio, not the whole stream
+        try:
+            audio = await asyncio.wait_for(synthesize_segment(translated, language or 'en'), TTS_TIMEOUT)
+        except Exception as e:
+            log.warning(f"Failed to synthesize sentence {index}: {e}")
+    return index, translated, audio
+
+
+@routes.route('/get_answer_stream', methods=['POST'])
+async def get_answer_stream():
+    # Server-sent events: "token" for each completion chunk, then "sentence" and "audio" per
+    # sentence as soon as its translation and speech are ready, then "sources" and "done".
+    form = await request.form
+    language = form.get('language')
+    question = form.get('question')
+
+    # Copies the request (and app) context into the generator, which runs after this handler returns
+    @stream_with_context
+    async def events():
+        trace = start_request('get_answer_stream')
+        tasks = []
+        emitted = 0
+
+        def sentence_events(index, translated, audio):
+            yield sse('sentence', {"index": index, "text": translated})
+            if audio is not None:
+                yield sse('audio', {"index": index, "mp3": base64.b64encode(audio).decode('ascii')})
+
+        def ready_events():
+            # Sentences are delivered in order, so only the finished prefix of the task list is drained
+            nonlocal emitted
+            while emitted < len(tasks) and tasks[emitted].done():
+                yield from sentence_events(*tasks[emitted].result())
+                emitted += 1
+
+        try:
+            if is_english(language):
+                translated_question = question
+            else:
+                with span('translate_question', language=language):
+                    translated_question = await asyncio.wait_for(flights["translate_question"].run(
+                        (normalize_question(question), (language or 'en').lower()),
+                        current_app.translator.translate, question, "auto", "en"), TRANSLATION_TIMEOUT)
+
+            buffer = ''
+            async for kind, text in stream_nyc_answer(translated_question, retrieval_timeout=RETRIEVAL_TIMEOUT):
+                if kind == 'sources':
+                    sentences = [buffer.strip()] if buffer.strip() else []
+                    buffer = ''
+                else:
+                    yield sse('token', {"text": text})
+                    buffer += text
+                    sentences, buffer = split_sentences(buffer)
+                for sentence in sentences:
+                    tasks.append(asyncio.create_task(speak_sentence(len(tasks), sentence, language)))
+                for event in ready_events():
+                    yield event
+                if kind == 'sources':
+                    sources = text
+
+            for task in tasks[emitted:]:
+                for event in sentence_events(*(await task)):
+                    yield event
+            yield sse('sources', {"text": sources})
+            yield sse('done', {})
+        except (asyncio.TimeoutError, aiohttp.ClientError, Overloaded, rag_generation.llm_errors()) as e:
+            for task in tasks:
+                task.cancel()
+            trace.status = type(e).__name__
+            e = rag_generation.rate_limited(e) or e
+            error = {"error": f"{type(e).__name__}: {e}"}
+            if isinstance(e, Overloaded):
+                error["retryAfter"] = e.headers()["Retry-After"]
+            yield sse('error', error)
+        finally:
+            finish_request(trace)
+
+    return Response(events(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
 
-    return {"answer": answer, "translatedAnswer": translated_answer + '\n\n' + sources}
+app = create_app()
 
 
 if __name__ == '__main__':
@@ -59,3 +376,5 @@ if __name__ == '__main__':
 
 # to run the server, run the following command in the terminal:
 # python app.py
+# or, with several workers:
+# hypercorn "app:create_app()" --workers 4 --bind 0.0.0.0:5000
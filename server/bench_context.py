@@ -0,0 +1,80 @@
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from embeddings import HashEmbedder
+from ingest import dataset_documents
+from retriever import LocalRetriever
+from tokenizer import count_tokens
+
+QUESTIONS = [
+    "How do I report illegal dumping to DSNY?",
+    "Where are the LinkNYC kiosks in Brooklyn?",
+    "Which farmers markets accept SNAP?",
+    "How long do 311 interpreter calls wait?",
+    "Where can homeless youth find shelter?",
+    "How do I find a firehouse near me?",
+    "What mental health services are available in the Bronx?",
+    "How many NYPD calls for service were there this year?",
+    "Where can I drop off food scraps for composting?",
+    "How do I apply for emergency food assistance?",
+]
+
+
+def build_page_index(datasets, path, rows_per_dataset):
+    # One whole page per dataset, like the hosted index that stores a full page_text per id
+    documents = list(dataset_documents(datasets, rows_per_dataset))
+    embedder = HashEmbedder()
+    vectors = embedder.embed_batch([text for _, text in documents])
+    LocalRetriever.build(path, [source for source, _ in documents], vectors,
+                         [{"page_text": text} for _, text in documents])
+
+
+def summarize(name, tokens, seconds, ms_per_token, fixed_ms):
+    tokens = np.array(tokens)
+    assembly = np.array(seconds) * 1000
+    # The completion is simulated: prefill cost grows with prompt tokens
+    end_to_end = assembly + fixed_ms + tokens * ms_per_token
+    print(f"{name:<8} prompt tokens mean={tokens.mean():.0f} p95={np.percentile(tokens, 95):.0f} max={tokens.max()}  "
+          f"assembly p50={np.percentile(assembly, 50):.1f}ms  "
+          f"end-to-end p50={np.percentile(end_to_end, 50):.0f}ms p95={np.percentile(end_to_end, 95):.0f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prompt size and latency before/after token-budgeted context assembly")
+    parser.add_argument("--datasets", default=os.path.join("..", "datasets"))
+    parser.add_argument("--rows-per-dataset", type=int, default=200)
+    parser.add_argument("--ms-per-token", type=float, default=0.2, help="simulated completion cost per prompt token")
+    parser.add_argument("--fixed-ms", type=float, default=800, help="simulated completion cost per request")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as path:
+        build_page_index(args.datasets, path, args.rows_per_dataset)
+        os.environ.update({"RETRIEVER_BACKEND": "local", "LOCAL_INDEX_PATH": path,
+                           "EMBEDDER_BACKEND": "hash", "EMBEDDING_CACHE_PATH": ""})
+        import rag_generation
+
+        before_tokens, before_seconds, after_tokens, after_seconds = [], [], [], []
+        for question in QUESTIONS:
+            start = time.perf_counter()
+            query = rag_generation.get_openai_embedding(question)
+            matches = rag_generation.retriever.get().query(query, top_k=3)
+            prompt = rag_generation.build_prompt(question, [match["metadata"]["page_text"] for match in matches])
+            before_seconds.append(time.perf_counter() - start)
+            before_tokens.append(count_tokens(prompt))
+
+            start = time.perf_counter()
+            _, _, _, page_texts = rag_generation.retrieve_context(question)
+            prompt = rag_generation.build_prompt(question, page_texts)
+            after_seconds.append(time.perf_counter() - start)
+            after_tokens.append(count_tokens(prompt))
+
+        summarize("before", before_tokens, before_seconds, args.ms_per_token, args.fixed_ms)
+        summarize("after", after_tokens, after_seconds, args.ms_per_token, args.fixed_ms)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from lexical_index import LexicalIndex
+from retriever import HybridRetriever, LocalRetriever
+
+TOPICS = ["housing", "transit", "health", "parks", "schools", "sanitation", "permits", "taxes"]
+VOCABULARY = ("apply application eligible residents borough office online form support services program "
+              "family income benefit rent building street permit inspection complaint appointment "
+              "schedule hours location phone website information request public city agency").split()
+
+
+def synthetic_corpus(n, dim, seed=0):
+    # Each page belongs to a topic and embeds close to that topic's centre; one page in ten
+    # names a program (e.g. "prog0042") that a vector model cannot tell apart from its neighbours
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((len(TOPICS), dim)).astype(np.float32)
+    ids, texts, vectors, programs = [], [], [], {}
+    for i in range(n):
+        topic = int(rng.integers(len(TOPICS)))
+        words = [TOPICS[topic]] * 3 + list(rng.choice(VOCABULARY, size=120))
+        if i % 10 == 0:
+            name = f"prog{i:05d}"
+            words += [name, name]
+            programs[name] = (f"doc-{i}", topic)
+        rng.shuffle(words)
+        ids.append(f"doc-{i}")
+        texts.append(" ".join(words))
+        vectors.append(centers[topic] + 0.5 * rng.standard_normal(dim).astype(np.float32))
+    return ids, texts, np.vstack(vectors), programs, centers
+
+
+def percentile_ms(latencies, q):
+    return float(np.percentile(latencies, q) * 1000)
+
+
+def report(name, hits, latencies, total):
+    print(f"{name:<10} recall={hits / total:.3f}  p50={percentile_ms(latencies, 50):.2f}ms  "
+          f"p99={percentile_ms(latencies, 99):.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall and latency of vector, BM25 and hybrid retrieval "
+                                                 "on exact-name questions")
+    parser.add_argument("--n", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=300)
+    args = parser.parse_args()
+
+    ids, texts, vectors, programs, centers = synthetic_corpus(args.n, args.dim)
+    rng = np.random.default_rng(1)
+    names = list(programs)
+    questions = [names[i] for i in rng.choice(len(names), size=min(args.queries, len(names)), replace=False)]
+
+    with tempfile.TemporaryDirectory() as path:
+        vector_index = LocalRetriever.build(os.path.join(path, "vectors"), ids, vectors,
+                                            [{"page_text": text} for text in texts])
+        lexical = LexicalIndex(os.path.join(path, "lexical"))
+        start = time.perf_counter()
+        lexical.update((doc_id, text, {"page_text": text}) for doc_id, text in zip(ids, texts))
+        build_seconds = time.perf_counter() - start
+        postings_bytes = sum(os.path.getsize(os.path.join(segment.path, "postings.bin")) for segment in lexical.segments)
+        raw_bytes = sum(len(text.encode("utf-8")) for text in texts)
+        print(f"lexical build: {build_seconds:.2f}s for {args.n} docs, postings {postings_bytes / 1e6:.2f}MB "
+              f"({raw_bytes / 1e6:.2f}MB of text)")
+
+        # Re-adding the corpus with 1% of pages changed only writes those pages
+        changed = set(range(0, args.n, 100))
+        start = time.perf_counter()
+        added = lexical.update((doc_id, text + (" updated" if i in changed else ""), {"page_text": text})
+                               for i, (doc_id, text) in enumerate(zip(ids, texts)))
+        print(f"incremental update: {added} changed docs in {time.perf_counter() - start:.2f}s")
+
+        start = time.perf_counter()
+        reopened = LexicalIndex(lexical.path)
+        print(f"reopen (mmap): {(time.perf_counter() - start) * 1000:.1f}ms")
+
+        def embed_for(question):
+            # Stands in for the embedding model: the program's topic, not its name
+            def embed(text):
+                topic = programs[question][1]
+                return centers[topic] + 0.5 * rng.standard_normal(args.dim).astype(np.float32)
+            return embed
+
+        runs = {"vector": [], "lexical": [], "hybrid": []}
+        hybrid = HybridRetriever(vector_index, reopened)
+        for question in questions:
+            truth = programs[question][0]
+            text = f"What is the {question} program?"
+
+            start = time.perf_counter()
+            matches = vector_index.query(embed_for(question)(text), args.k)
+            runs["vector"].append((truth in [m["id"] for m in matches], time.perf_counter() - start))
+
+            start = time.perf_counter()
+            matches = reopened.search(text, args.k)
+            runs["lexical"].append((truth in [m["id"] for m in matches], time.perf_counter() - start))
+
+            start = time.perf_counter()
+            _, matches = hybrid.search_text(text, embed_for(question), args.k)
+            runs["hybrid"].append((truth in [m["id"] for m in matches], time.perf_counter() - start))
+
+        for name, results in runs.items():
+            report(name, sum(hit for hit, _ in results), [seconds for _, seconds in results], len(questions))
+        print(f"hybrid fast path: {hybrid.fast_path_hits}/{len(questions)} questions answered without an "
+              f"embedding call")
+
+        # Topical questions without a distinctive name should still go through vector search
+        hybrid.fast_path_hits = 0
+        for topic in TOPICS:
+            hybrid.search_text(f"How do I apply for {topic} services in my borough?",
+                               lambda text: centers[0], args.k)
+        print(f"topical questions on the fast path: {hybrid.fast_path_hits}/{len(TOPICS)}")
+
+
+if __name__ == "__main__":
+    main()
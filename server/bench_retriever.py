@@ -0,0 +1,71 @@
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+from retriever import LocalRetriever
+
+
+def synthetic_corpus(n, dim, clusters, seed=0):
+    # Clustered vectors resemble real embeddings better than uniform noise
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, size=n)
+    vectors = centers[labels] + 0.6 * rng.standard_normal((n, dim)).astype(np.float32)
+    queries = centers[rng.integers(0, clusters, size=200)] + 0.6 * rng.standard_normal((200, dim)).astype(np.float32)
+    return vectors, queries
+
+
+def percentile_ms(latencies, q):
+    return float(np.percentile(latencies, q) * 1000)
+
+
+def run_queries(retriever, queries, k):
+    latencies = []
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        rows, _ = retriever.search(query, k)
+        latencies.append(time.perf_counter() - start)
+        results.append(set(int(row) for row in rows))
+    return results, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recall and latency of the local IVF index against exact search')
+    parser.add_argument('--n', type=int, default=50000)
+    parser.add_argument('--dim', type=int, default=1536)
+    parser.add_argument('--clusters', type=int, default=100)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 4, 8, 16])
+    args = parser.parse_args()
+
+    vectors, queries = synthetic_corpus(args.n, args.dim, args.clusters)
+    ids = [f'doc-{i}' for i in range(args.n)]
+    metadata = [{'page_text': ''} for _ in range(args.n)]
+
+    with tempfile.TemporaryDirectory() as path:
+        start = time.perf_counter()
+        LocalRetriever.build(path, ids, vectors, metadata)
+        print(f'build: {time.perf_counter() - start:.2f}s for {args.n} x {args.dim}')
+
+        exact = LocalRetriever(path, exact=True)
+        truth, latencies = run_queries(exact, queries, args.k)
+        truth_ids = [{exact.ids[row] for row in rows} for rows in truth]
+        print(f'exact      recall@{args.k}=1.000  p50={percentile_ms(latencies, 50):.2f}ms  '
+              f'p99={percentile_ms(latencies, 99):.2f}ms')
+
+        for nprobe in args.nprobe:
+            ivf = LocalRetriever(path, nprobe=nprobe)
+            found, latencies = run_queries(ivf, queries, args.k)
+            recall = np.mean([
+                len({ivf.ids[row] for row in rows} & expected) / args.k
+                for rows, expected in zip(found, truth_ids)
+            ])
+            print(f'nprobe={nprobe:<4} recall@{args.k}={recall:.3f}  p50={percentile_ms(latencies, 50):.2f}ms  '
+                  f'p99={percentile_ms(latencies, 99):.2f}ms')
+
+
+if __name__ == '__main__':
+    main()
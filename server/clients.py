@@ -0,0 +1,84 @@
+import asyncio
+import inspect
+import logging
+import threading
+import time
+
+from telemetry import span
+
+log = logging.getLogger(__name__)
+
+
+class LazyClient:
+    # A process-wide client built on first use, so importing the module that declares it costs
+    # nothing and needs no network. The first get() builds it under a lock; requests in worker
+    # threads that race warm-up wait for the same instance instead of building their own.
+
+    def __init__(self, name, factory):
+        self.name = name
+        self.factory = factory
+        self.client = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        client = self.client
+        if client is None:
+            with self.lock:
+                if self.client is None:
+                    started = time.perf_counter()
+                    self.client = self.factory()
+                    log.info(f"Created {self.name} client in {time.perf_counter() - started:.3f}s")
+                client = self.client
+        return client
+
+    def set(self, client):
+        # Benchmarks and tests install stand-ins before the first request
+        self.client = client
+
+    @property
+    def created(self):
+        return self.client is not None
+
+
+class WarmUp:
+    # Named steps run once per worker, in order, after it starts listening. Blocking steps run
+    # in a worker thread so /healthz keeps answering; /readyz reports ready once every step has
+    # finished. A failed step is logged and left to the lazy client to retry on first use.
+
+    def __init__(self, steps):
+        self.steps = steps
+        self.states = {name: "pending" for name, _ in steps}
+        self.seconds = {}
+        self.errors = {}
+        self.started = None
+        self.finished = None
+
+    async def run(self):
+        self.started = time.perf_counter()
+        for name, step in self.steps:
+            self.states[name] = "running"
+            began = time.perf_counter()
+            try:
+                with span(f"warm_up_{name}"):
+                    if inspect.iscoroutinefunction(step):
+                        await step()
+                    else:
+                        await asyncio.to_thread(step)
+                self.states[name] = "ready"
+            except Exception as e:
+                log.warning(f"Warm-up step {name} failed: {e}")
+                self.states[name] = "failed"
+                self.errors[name] = f"{type(e).__name__}: {e}"
+            self.seconds[name] = round(time.perf_counter() - began, 3)
+        self.finished = time.perf_counter()
+        log.info(f"Warm-up finished in {self.finished - self.started:.3f}s: {self.states}")
+
+    @property
+    def ready(self):
+        return self.finished is not None
+
+    def status(self):
+        steps = {name: {"state": state, "seconds": self.seconds.get(name)} for name, state in self.states.items()}
+        for name, error in self.errors.items():
+            steps[name]["error"] = error
+        return {"ready": self.ready, "steps": steps}
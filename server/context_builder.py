@@ -0,0 +1,115 @@
+import math
+import re
+from collections import Counter
+
+from tokenizer import count_tokens, split_tokens
+
+TERM = re.compile(r"\w+")
+STOPWORDS = frozenset(
+    "a an and are as at be by can do for from how i in is it me my of on or the to what where which who why "
+    "with you your".split()
+)
+
+
+def terms(text):
+    return [term for term in TERM.findall(text.lower()) if term not in STOPWORDS]
+
+
+class Reranker:
+    # Scores Passage objects for a question; higher is more relevant
+    def score(self, question, passages):
+        raise NotImplementedError
+
+
+class BM25Reranker(Reranker):
+    # BM25 with statistics taken from the candidate passages themselves
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+
+    def score(self, question, passages):
+        documents = [Counter(passage.term_list) for passage in passages]
+        if not documents:
+            return []
+        average_length = sum(sum(document.values()) for document in documents) / len(documents) or 1.0
+        frequencies = Counter(term for document in documents for term in document)
+        query = set(terms(question))
+        scores = []
+        for document in documents:
+            length = sum(document.values())
+            score = 0.0
+            for term in query:
+                tf = document.get(term, 0)
+                if not tf:
+                    continue
+                idf = math.log(1 + (len(documents) - frequencies[term] + 0.5) / (frequencies[term] + 0.5))
+                score += idf * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * length / average_length))
+            scores.append(score)
+        return scores
+
+
+class Passage:
+    def __init__(self, doc_id, source, text, rank):
+        self.doc_id = doc_id
+        self.source = source
+        self.text = text
+        self.rank = rank
+        self.term_list = terms(text)
+        self.terms = set(self.term_list)
+        self._tokens = None
+
+    @property
+    def tokens(self):
+        # Only passages that reach the budget check are run through the tokenizer
+        if self._tokens is None:
+            self._tokens = count_tokens(self.text)
+        return self._tokens
+
+
+class ContextBuilder:
+    def __init__(self, reranker=None, token_budget=1500, passage_words=150, max_overlap=0.6, min_tokens=40):
+        self.reranker = reranker or BM25Reranker()
+        self.token_budget = token_budget
+        self.passage_words = passage_words
+        self.max_overlap = max_overlap
+        self.min_tokens = min_tokens
+
+    def passages(self, matches):
+        # Whole pages (as in the hosted index) are split into word windows so only their
+        # relevant parts are kept; exact token counts are taken later, for selected passages
+        passages = []
+        for rank, match in enumerate(matches):
+            words = match['metadata']['page_text'].split()
+            source = match['metadata'].get('source', match['id'])
+            for position, start in enumerate(range(0, len(words), self.passage_words)):
+                text = " ".join(words[start:start + self.passage_words])
+                passages.append(Passage(f"{match['id']}#{position}", source, text, rank))
+        return passages
+
+    def overlaps(self, passage, selected):
+        for other in selected:
+            smaller = min(len(passage.terms), len(other.terms)) or 1
+            if len(passage.terms & other.terms) / smaller > self.max_overlap:
+                return True
+        return False
+
+    def build(self, question, matches):
+        passages = self.passages(matches)
+        scores = self.reranker.score(question, passages)
+        # Ties (e.g. no lexical overlap at all) fall back to the vector search order
+        order = sorted(range(len(passages)), key=lambda i: (-scores[i], passages[i].rank))
+
+        selected = []
+        remaining = self.token_budget
+        for i in order:
+            passage = passages[i]
+            if remaining < self.min_tokens:
+                break
+            if self.overlaps(passage, selected):
+                continue
+            if passage.tokens > remaining:
+                passage = Passage(passage.doc_id, passage.source,
+                                  next(split_tokens(passage.text, remaining)), passage.rank)
+            selected.append(passage)
+            remaining -= passage.tokens
+        return selected
@@ -0,0 +1,206 @@
+import hashlib
+import os
+import queue
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+import requests
+
+EMBEDDING_MODEL = "text-embedding-ada-002"
+
+
+class EmbeddingError(Exception):
+    pass
+
+
+def content_key(text, model=EMBEDDING_MODEL):
+    return hashlib.sha256(f"{model}\x00{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    # In-memory LRU in front of a SQLite table of float32 blobs
+
+    def __init__(self, path=None, max_items=10000):
+        self.max_items = max_items
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)")
+            self.db.commit()
+
+    def remember(self, key, vector):
+        self.memory[key] = vector
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_items:
+            self.memory.popitem(last=False)
+
+    def get(self, key):
+        with self.lock:
+            vector = self.memory.get(key)
+            if vector is not None:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return vector
+            if self.db is not None:
+                row = self.db.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    vector = np.frombuffer(row[0], dtype=np.float32)
+                    self.remember(key, vector)
+                    self.hits += 1
+                    return vector
+            self.misses += 1
+            return None
+
+    def put(self, key, vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        with self.lock:
+            self.remember(key, vector)
+            if self.db is not None:
+                self.db.execute("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                                (key, vector.tobytes()))
+                self.db.commit()
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class OpenAIEmbedder:
+    def __init__(self, api_key=None, model=EMBEDDING_MODEL, retries=3, backoff=0.5, timeout=30,
+                 api_url=None):
+        self.api_url = api_url or os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1") + "/embeddings"
+        self.model = model
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        # One pooled session keeps TLS connections to the API alive between calls
+        self.session = requests.Session()
+        self.session.headers.update({
+            "Authorization": f"Bearer {api_key or os.getenv('OPENAI_API_KEY')}",
+            "Content-Type": "application/json",
+        })
+
+    def embed_batch(self, texts):
+        data = {"input": list(texts), "model": self.model, "encoding_format": "float"}
+        error = None
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.session.post(self.api_url, json=data, timeout=self.timeout)
+                if response.status_code == 200:
+                    items = sorted(response.json()["data"], key=lambda item: item["index"])
+                    return [np.asarray(item["embedding"], dtype=np.float32) for item in items]
+                error = f"{response.status_code}: {response.text}"
+                if response.status_code not in (429, 500, 502, 503, 504):
+                    break
+            except requests.RequestException as e:
+                error = str(e)
+            if attempt < self.retries:
+                time.sleep(self.backoff * (2 ** attempt) * (1 + random.random()))
+        raise EmbeddingError(f"Failed to get embeddings: {error}")
+
+
+class HashEmbedder:
+    # Deterministic stand-in for tests and offline benchmarks; same text, same unit vector
+    def __init__(self, dim=1536, model="hash-embedder"):
+        self.dim = dim
+        self.model = model
+        self.calls = 0
+
+    def embed_batch(self, texts):
+        self.calls += 1
+        vectors = []
+        for text in texts:
+            seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+            vector = np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+            vectors.append(vector / np.linalg.norm(vector))
+        return vectors
+
+
+class EmbeddingBatcher:
+    # Collects texts from concurrent callers and sends them as one multi-input request
+
+    def __init__(self, embedder, max_batch=64, max_wait=0.01):
+        self.embedder = embedder
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.pending = queue.Queue()
+        self.batches = 0
+        self.worker = threading.Thread(target=self.loop, daemon=True)
+        self.worker.start()
+
+    def submit(self, text):
+        future = Future()
+        self.pending.put((text, future))
+        return future
+
+    def loop(self):
+        while True:
+            batch = [self.pending.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self.flush(batch)
+
+    def flush(self, batch):
+        # Identical texts within a batch are embedded once
+        unique_texts = list(dict.fromkeys(text for text, _ in batch))
+        self.batches += 1
+        try:
+            result = list(self.embedder.embed_batch(unique_texts))
+            # A short reply would otherwise raise KeyError below and kill the worker thread
+            if len(result) != len(unique_texts):
+                raise ValueError(f"Embedder returned {len(result)} vectors for {len(unique_texts)} texts")
+            vectors = dict(zip(unique_texts, result))
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for text, future in batch:
+            future.set_result(vectors[text])
+
+
+class EmbeddingService:
+    def __init__(self, embedder, cache=None, batcher=None):
+        self.embedder = embedder
+        self.cache = cache or EmbeddingCache()
+        self.batcher = batcher or EmbeddingBatcher(embedder)
+        self.model = getattr(embedder, "model", EMBEDDING_MODEL)
+
+    def embed_many(self, texts, timeout=60):
+        keys = [content_key(text, self.model) for text in texts]
+        vectors = [self.cache.get(key) for key in keys]
+        futures = {i: self.batcher.submit(texts[i]) for i, vector in enumerate(vectors) if vector is None}
+        for i, future in futures.items():
+            vectors[i] = future.result(timeout=timeout)
+            self.cache.put(keys[i], vectors[i])
+        return vectors
+
+    def embed(self, text, timeout=60):
+        return self.embed_many([text], timeout=timeout)[0]
+
+
+def create_embedding_service():
+    if os.getenv("EMBEDDER_BACKEND") == "hash":
+        embedder = HashEmbedder()
+    else:
+        embedder = OpenAIEmbedder()
+    cache = EmbeddingCache(os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.sqlite"),
+                           max_items=int(os.getenv("EMBEDDING_CACHE_SIZE", "10000")))
+    return EmbeddingService(embedder, cache)
@@ -0,0 +1,295 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from bs4 import BeautifulSoup
+
+from embeddings import HashEmbedder, OpenAIEmbedder
+from lexical_index import LexicalIndex
+from retriever import LocalRetriever, CURRENT_VERSION_FILE
+from tokenizer import WORD, count_tokens, split_tokens
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def simhash(text, bits=64):
+    # 64-bit SimHash over word 3-shingles; near-identical chunks differ in only a few bits
+    words = [word.lower() for word in WORD.findall(text) if word.isalnum()]
+    shingles = [" ".join(words[i:i + 3]) for i in range(max(len(words) - 2, 1))]
+    weights = np.zeros(bits, dtype=np.int64)
+    for shingle in shingles:
+        value = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "little")
+        weights += np.where((value >> np.arange(bits, dtype=np.uint64)) & 1, 1, -1).astype(np.int64)
+    return int(sum(1 << i for i in range(bits) if weights[i] > 0))
+
+
+class NearDuplicateFilter:
+    # Four 16-bit bands: two hashes within 3 bits of each other always share at least one band
+    def __init__(self, max_distance=3):
+        self.max_distance = max_distance
+        self.bands = [{} for _ in range(4)]
+
+    def seen(self, fingerprint):
+        for band, table in enumerate(self.bands):
+            for other in table.get((fingerprint >> (16 * band)) & 0xFFFF, ()):
+                if bin(fingerprint ^ other).count("1") <= self.max_distance:
+                    return True
+        for band, table in enumerate(self.bands):
+            table.setdefault((fingerprint >> (16 * band)) & 0xFFFF, []).append(fingerprint)
+        return False
+
+
+# The Socrata dumps are JSON arrays; the downloader writes NDJSON
+DATASET_PATTERNS = ("*.json", "*.ndjson")
+# Records read per dataset to list its columns
+COLUMN_SAMPLE_ROWS = 1000
+
+
+def dataset_paths(folder):
+    return sorted(path for pattern in DATASET_PATTERNS for path in glob.glob(os.path.join(folder, "*_data", pattern)))
+
+
+def head_records(path, limit):
+    # The first `limit` records, or None when the file holds no list of records. NDJSON is read
+    # line by line, so only the head of a large download is parsed.
+    if path.endswith(".ndjson"):
+        records = []
+        with open(path, "r") as file:
+            for line in file:
+                if line.strip():
+                    records.append(json.loads(line))
+                    if len(records) >= limit:
+                        break
+        return records
+    with open(path, "r") as file:
+        records = json.load(file)
+    return records[:limit] if isinstance(records, list) else None
+
+
+def dataset_documents(folder, rows_per_dataset):
+    for path in dataset_paths(folder):
+        try:
+            records = head_records(path, max(COLUMN_SAMPLE_ROWS, rows_per_dataset))
+        except (OSError, ValueError) as e:
+            print(f"Skipping {path}: {e}")
+            continue
+        if records is None:
+            continue
+        name = os.path.splitext(os.path.basename(path))[0]
+        columns = sorted({key for record in records[:COLUMN_SAMPLE_ROWS] for key in record})
+        lines = [f"NYC Open Data dataset: {name.replace('-', ' ')}",
+                 f"Folder: {os.path.basename(os.path.dirname(path))}",
+                 f"Columns: {', '.join(columns)}"]
+        for record in records[:rows_per_dataset]:
+            lines.append("; ".join(f"{key}: {value}" for key, value in record.items() if not isinstance(value, dict)))
+        yield path, "\n".join(lines)
+
+
+def dataset_metadata_documents(folder):
+    # One short document per dataset (name, folder and column names) so exact dataset and
+    # column names are found by the lexical index even when no row chunk mentions them
+    for path in dataset_paths(folder):
+        try:
+            records = head_records(path, COLUMN_SAMPLE_ROWS)
+        except (OSError, ValueError):
+            continue
+        if records is None:
+            continue
+        name = os.path.splitext(os.path.basename(path))[0].replace("-", " ")
+        columns = sorted({key for record in records for key in record})
+        text = (f"NYC Open Data dataset {name}. Folder {os.path.basename(os.path.dirname(path))}. "
+                f"Columns: {', '.join(column.replace('_', ' ') for column in columns)}")
+        yield f"dataset:{path}", text, {"page_text": text, "source": path}
+
+
+def html_documents(folder):
+    for path in sorted(glob.glob(os.path.join(folder, "**", "*.htm*"), recursive=True)):
+        with open(path, "r", encoding="utf-8", errors="ignore") as file:
+            soup = BeautifulSoup(file.read(), "html.parser")
+        canonical = soup.find("link", rel="canonical") or soup.find("meta", property="og:url")
+        source = (canonical.get("href") or canonical.get("content")) if canonical else path
+        for tag in soup(["script", "style", "nav", "header", "footer", "noscript"]):
+            tag.decompose()
+        yield source, " ".join(soup.get_text(" ").split())
+
+
+class ChunkStore:
+    # Embedded chunks keyed by content hash, so reruns only embed new or changed text
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS chunks (hash TEXT PRIMARY KEY, source TEXT, position INTEGER, "
+                        "text TEXT, tokens INTEGER, vector BLOB)")
+        self.db.commit()
+
+    def known(self, hashes):
+        known = set()
+        hashes = list(hashes)
+        for start in range(0, len(hashes), 500):
+            batch = hashes[start:start + 500]
+            rows = self.db.execute(f"SELECT hash FROM chunks WHERE hash IN ({','.join('?' * len(batch))})", batch)
+            known.update(row[0] for row in rows)
+        return known
+
+    def add(self, chunks, vectors):
+        self.db.executemany("INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?, ?, ?)", [
+            (chunk["hash"], chunk["source"], chunk["position"], chunk["text"], chunk["tokens"],
+             np.asarray(vector, dtype=np.float32).tobytes())
+            for chunk, vector in zip(chunks, vectors)
+        ])
+        self.db.commit()
+
+    def rows(self, hashes):
+        hashes = list(hashes)
+        for start in range(0, len(hashes), 500):
+            batch = hashes[start:start + 500]
+            yield from self.db.execute(
+                f"SELECT hash, source, position, text, vector FROM chunks WHERE hash IN ({','.join('?' * len(batch))})",
+                batch)
+
+
+def chunk_documents(documents, max_tokens, overlap, dedupe):
+    chunks = {}
+    stats = {"docs": 0, "tokens": 0, "duplicates": 0}
+    for source, text in documents:
+        stats["docs"] += 1
+        stats["tokens"] += count_tokens(text)
+        for position, chunk in enumerate(split_tokens(text, max_tokens, overlap)):
+            if not chunk.strip():
+                continue
+            if dedupe.seen(simhash(chunk)):
+                stats["duplicates"] += 1
+                continue
+            chunk_hash = content_hash(chunk)
+            chunks.setdefault(chunk_hash, {"hash": chunk_hash, "source": source, "position": position,
+                                           "text": chunk, "tokens": count_tokens(chunk)})
+    return list(chunks.values()), stats
+
+
+def embed_chunks(store, embedder, chunks, batch_size, workers):
+    known = store.known(chunk["hash"] for chunk in chunks)
+    missing = [chunk for chunk in chunks if chunk["hash"] not in known]
+    batches = [missing[start:start + batch_size] for start in range(0, len(missing), batch_size)]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # Each finished batch is committed immediately, so an interrupted run resumes where it stopped
+        for batch, vectors in zip(batches, pool.map(lambda b: embedder.embed_batch([c["text"] for c in b]), batches)):
+            store.add(batch, vectors)
+    return missing
+
+
+def chunk_id(source, position, chunk_hash):
+    return f"{source}#{position}-{chunk_hash[:8]}"
+
+
+def write_lexical_index(chunks, output, datasets=None):
+    # The lexical index is updated in place: only new or changed documents are written
+    documents = [(chunk_id(chunk["source"], chunk["position"], chunk["hash"]), chunk["text"],
+                  {"page_text": chunk["text"], "source": chunk["source"]}) for chunk in chunks]
+    if datasets:
+        documents.extend(dataset_metadata_documents(datasets))
+    index = LexicalIndex(os.path.join(output, "lexical"))
+    added = index.update(documents, prune=True)
+    return index, added
+
+
+def version_name():
+    # Sortable by time, and unique across runs in the same second and concurrent processes
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{time.time_ns() % 1_000_000_000:09d}-{os.getpid()}"
+
+
+def prune_versions(output, keep):
+    # Keeps the newest `keep` versions, the current one always among them. A server still serving
+    # an older version keeps reading it: its arrays are memory-mapped or already loaded.
+    versions = os.path.join(output, "versions")
+    with open(os.path.join(output, CURRENT_VERSION_FILE)) as file:
+        current = file.read().strip()
+    names = sorted(name for name in os.listdir(versions) if name != current)
+    for name in names[:max(0, len(names) - (keep - 1))]:
+        shutil.rmtree(os.path.join(versions, name))
+
+
+def write_index(store, chunks, output, keep=3):
+    version = version_name()
+    path = os.path.join(output, "versions", version)
+    ids, vectors, metadata = [], [], []
+    for chunk_hash, source, position, text, vector in store.rows(chunk["hash"] for chunk in chunks):
+        ids.append(chunk_id(source, position, chunk_hash))
+        vectors.append(np.frombuffer(vector, dtype=np.float32))
+        metadata.append({"page_text": text, "source": source})
+    if not vectors:
+        raise ValueError("No embedded chunks to index; CURRENT left unchanged")
+    # A version folder is never written twice: a server may be serving it
+    os.makedirs(path)
+    LocalRetriever.build(path, ids, np.vstack(vectors), metadata)
+    with open(os.path.join(output, CURRENT_VERSION_FILE + ".tmp"), "w") as file:
+        file.write(version)
+    os.replace(os.path.join(output, CURRENT_VERSION_FILE + ".tmp"), os.path.join(output, CURRENT_VERSION_FILE))
+    prune_versions(output, keep)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the local RAG index from datasets and saved HTML pages")
+    parser.add_argument("--datasets", help="folder containing the *_data dataset folders")
+    parser.add_argument("--html", help="folder of saved HTML pages")
+    parser.add_argument("--output", default="index")
+    parser.add_argument("--embedder", choices=["openai", "hash"], default="openai")
+    parser.add_argument("--chunk-tokens", type=int, default=400)
+    parser.add_argument("--overlap", type=int, default=50)
+    parser.add_argument("--rows-per-dataset", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--keep-versions", type=int, default=3, help="index versions kept under <output>/versions")
+    parser.add_argument("--lexical", action="store_true",
+                        help="also update the BM25 index in <output>/lexical (serve with LEXICAL_INDEX_PATH)")
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    if not args.datasets and not args.html:
+        parser.error("pass --datasets and/or --html")
+    documents = []
+    if args.datasets:
+        documents.extend(dataset_documents(args.datasets, args.rows_per_dataset))
+    if args.html:
+        documents.extend(html_documents(args.html))
+
+    start = time.perf_counter()
+    chunks, stats = chunk_documents(documents, args.chunk_tokens, args.overlap, NearDuplicateFilter())
+    chunk_seconds = time.perf_counter() - start
+
+    embedder = HashEmbedder() if args.embedder == "hash" else OpenAIEmbedder()
+    # One chunk store per embedding model, so vectors from different models never mix
+    store = ChunkStore(os.path.join(args.output, f"chunks-{embedder.model}.sqlite"))
+    start = time.perf_counter()
+    embedded = embed_chunks(store, embedder, chunks, args.batch_size, args.workers)
+    embed_seconds = time.perf_counter() - start
+    embedded_tokens = sum(chunk["tokens"] for chunk in embedded)
+
+    if not chunks:
+        print("No text found; index not written")
+        return
+    path = write_index(store, chunks, args.output, max(1, args.keep_versions))
+    print(f"{stats['docs']} docs, {stats['tokens']} tokens, {len(chunks)} chunks "
+          f"({stats['duplicates']} near-duplicates dropped)")
+    print(f"chunking: {stats['docs'] / max(chunk_seconds, 1e-9):.1f} docs/s, "
+          f"{stats['tokens'] / max(chunk_seconds, 1e-9):.0f} tokens/s")
+    print(f"embedding: {len(embedded)} new chunks ({len(chunks) - len(embedded)} reused), "
+          f"{embedded_tokens / max(embed_seconds, 1e-9):.0f} tokens/s")
+    print(f"index written to {path}")
+    if args.lexical:
+        start = time.perf_counter()
+        lexical, added = write_lexical_index(chunks, args.output, args.datasets)
+        print(f"lexical index: {added} new or changed documents in {time.perf_counter() - start:.2f}s, "
+              f"{lexical.doc_count} live in {len(lexical.segments)} segments at {lexical.path}")
+
+
+if __name__ == "__main__":
+    main()
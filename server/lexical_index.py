@@ -0,0 +1,204 @@
+import hashlib
+import heapq
+import json
+import math
+import mmap
+import os
+import time
+from collections import Counter
+
+import numpy as np
+
+from context_builder import terms
+
+SEGMENTS_FILE = "segments.json"
+
+
+def encode_varint(value, out):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def decode_varints(data):
+    # Vectorised decode of a run of varints held in a uint8 array
+    ends = np.flatnonzero(data < 0x80)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    shifts = 7 * (np.arange(len(data)) - np.repeat(starts, ends - starts + 1))
+    return np.add.reduceat((data & 0x7F).astype(np.int64) << shifts, starts)
+
+
+class Segment:
+    # Immutable on disk: lexicon.json maps term -> [offset, end, df]; postings.bin holds, per term,
+    # delta-encoded doc numbers followed by term frequencies, all as varints
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "lexicon.json"), "r") as file:
+            self.lexicon = json.load(file)
+        with open(os.path.join(path, "docs.json"), "r") as file:
+            docs = json.load(file)
+        self.ids = docs["ids"]
+        self.hashes = docs["hashes"]
+        self.lengths = np.asarray(docs["lengths"], dtype=np.float64)
+        self.metadata = docs["metadata"]
+        self.file = open(os.path.join(path, "postings.bin"), "rb")
+        size = os.fstat(self.file.fileno()).st_size
+        self.postings_data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    @classmethod
+    def write(cls, path, documents):
+        os.makedirs(path, exist_ok=True)
+        inverted = {}
+        ids, hashes, lengths, metadata = [], [], [], []
+        for doc_number, (doc_id, text, doc_metadata) in enumerate(documents):
+            counts = Counter(terms(text))
+            for term, tf in counts.items():
+                inverted.setdefault(term, []).append((doc_number, tf))
+            ids.append(doc_id)
+            hashes.append(hashlib.sha1(text.encode("utf-8")).hexdigest())
+            lengths.append(sum(counts.values()))
+            metadata.append(doc_metadata)
+
+        lexicon = {}
+        out = bytearray()
+        for term in sorted(inverted):
+            postings = inverted[term]
+            offset = len(out)
+            previous = 0
+            for doc_number, _ in postings:
+                encode_varint(doc_number - previous, out)
+                previous = doc_number
+            for _, tf in postings:
+                encode_varint(tf, out)
+            lexicon[term] = [offset, len(out), len(postings)]
+        with open(os.path.join(path, "postings.bin"), "wb") as file:
+            file.write(out)
+        with open(os.path.join(path, "lexicon.json"), "w") as file:
+            json.dump(lexicon, file)
+        with open(os.path.join(path, "docs.json"), "w") as file:
+            json.dump({"ids": ids, "hashes": hashes, "lengths": lengths, "metadata": metadata}, file)
+        return cls(path)
+
+    def df(self, term):
+        entry = self.lexicon.get(term)
+        return entry[2] if entry else 0
+
+    def postings(self, term):
+        offset, end, df = self.lexicon[term]
+        values = decode_varints(np.frombuffer(self.postings_data, dtype=np.uint8, count=end - offset, offset=offset))
+        return np.cumsum(values[:df]), values[df:]
+
+
+class LexicalIndex:
+    # BM25 over append-only segments; re-adding a changed document tombstones its old copy
+    def __init__(self, path, k1=1.2, b=0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        os.makedirs(path, exist_ok=True)
+        self.segments = []
+        self.deleted = {}
+        manifest = os.path.join(path, SEGMENTS_FILE)
+        if os.path.exists(manifest):
+            with open(manifest, "r") as file:
+                state = json.load(file)
+            self.segments = [Segment(os.path.join(path, name)) for name in state["segments"]]
+            self.deleted = {name: set(numbers) for name, numbers in state["deleted"].items()}
+        self.refresh_stats()
+
+    def refresh_stats(self):
+        self.live = {}
+        self.masks = []
+        total_length = 0.0
+        for segment in self.segments:
+            deleted = self.deleted.get(os.path.basename(segment.path), set())
+            mask = np.ones(len(segment.ids), dtype=bool)
+            mask[list(deleted)] = False
+            self.masks.append(mask)
+            for doc_number in np.flatnonzero(mask):
+                self.live[segment.ids[doc_number]] = (segment, int(doc_number))
+            total_length += float(segment.lengths[mask].sum())
+        self.doc_count = len(self.live)
+        self.average_length = total_length / self.doc_count if self.doc_count else 1.0
+
+    def save_state(self):
+        state = {"segments": [os.path.basename(segment.path) for segment in self.segments],
+                 "deleted": {name: sorted(numbers) for name, numbers in self.deleted.items()}}
+        temp_path = os.path.join(self.path, SEGMENTS_FILE + ".tmp")
+        with open(temp_path, "w") as file:
+            json.dump(state, file)
+        os.replace(temp_path, os.path.join(self.path, SEGMENTS_FILE))
+
+    @property
+    def version(self):
+        return str(os.stat(os.path.join(self.path, SEGMENTS_FILE)).st_mtime_ns) if self.segments else "empty"
+
+    def update(self, documents, prune=False):
+        # documents: iterable of (id, text, metadata); unchanged documents are skipped, and with
+        # prune=True live documents missing from the iterable are removed
+        fresh = []
+        seen = set()
+        for doc_id, text, metadata in documents:
+            seen.add(doc_id)
+            text_hash = hashlib.sha1(text.encode("utf-8")).hexdigest()
+            current = self.live.get(doc_id)
+            if current is not None:
+                segment, doc_number = current
+                if segment.hashes[doc_number] == text_hash:
+                    continue
+                self.deleted.setdefault(os.path.basename(segment.path), set()).add(doc_number)
+            fresh.append((doc_id, text, metadata))
+        if prune:
+            for doc_id, (segment, doc_number) in self.live.items():
+                if doc_id not in seen:
+                    self.deleted.setdefault(os.path.basename(segment.path), set()).add(doc_number)
+        if fresh:
+            name = f"segment-{time.strftime('%Y%m%d%H%M%S')}-{len(self.segments):04d}"
+            self.segments.append(Segment.write(os.path.join(self.path, name), fresh))
+        self.save_state()
+        self.refresh_stats()
+        return len(fresh)
+
+    def search(self, question, top_k=10):
+        query_terms = set(terms(question))
+        # Document frequency counts live documents only, as doc_count does: tombstoned copies are
+        # never compacted away, so counting them would inflate df with every content update
+        postings = [{term: segment.postings(term) for term in query_terms if segment.df(term)}
+                    for segment in self.segments]
+        live_terms = dict.fromkeys(query_terms, 0)
+        for segment_postings, mask in zip(postings, self.masks):
+            for term, (doc_numbers, _) in segment_postings.items():
+                live_terms[term] += int(mask[doc_numbers].sum())
+        candidates = []
+        for segment, mask, segment_postings in zip(self.segments, self.masks, postings):
+            scores = np.zeros(len(segment.ids))
+            matched = np.zeros(len(segment.ids), dtype=np.int32)
+            norms = self.k1 * (1 - self.b + self.b * segment.lengths / self.average_length)
+            for term, (doc_numbers, tfs) in segment_postings.items():
+                df = live_terms[term]
+                idf = math.log(1 + (self.doc_count - df + 0.5) / (df + 0.5))
+                scores[doc_numbers] += idf * tfs * (self.k1 + 1) / (tfs + norms[doc_numbers])
+                matched[doc_numbers] += 1
+            scores[~mask] = 0.0
+            hits = np.flatnonzero(scores)
+            if len(hits) > top_k:
+                hits = hits[np.argpartition(-scores[hits], top_k - 1)[:top_k]]
+            candidates.extend((float(scores[i]), segment, int(i), int(matched[i])) for i in hits)
+        results = []
+        for score, segment, doc_number, matched in heapq.nlargest(top_k, candidates, key=lambda item: item[0]):
+            # "coverage" is the share of query terms the document contains
+            results.append({"id": segment.ids[doc_number], "score": score, "metadata": segment.metadata[doc_number],
+                            "coverage": matched / len(query_terms)})
+        return results
+
+
+def reciprocal_rank_fusion(result_lists, top_k, k=60):
+    scores = {}
+    matches = {}
+    for results in result_lists:
+        for rank, match in enumerate(results):
+            scores[match["id"]] = scores.get(match["id"], 0.0) + 1.0 / (k + rank + 1)
+            matches.setdefault(match["id"], match)
+    best = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+    return [{**matches[doc_id], "score": score} for doc_id, score in best]
@@ -0,0 +1,138 @@
+import argparse
+import asyncio
+import hashlib
+import os
+import tempfile
+import time
+
+import numpy as np
+from aiohttp import web
+
+STUB_PORT = 8790
+EMBEDDING_DIM = 1536
+
+
+def stub_vector(text):
+    seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+    vector = np.random.default_rng(seed).standard_normal(EMBEDDING_DIM).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def create_stub_app(latency):
+    # Local stand-ins for the translation service and the OpenAI embeddings/chat endpoints
+    async def translate(request):
+        body = await request.json() if request.content_type == 'application/json' else await request.post()
+        await asyncio.sleep(latency['translation'])
+        if isinstance(body['q'], list):
+            return web.json_response({'translatedText': [f'[{body["target"]}] {q}' for q in body['q']]})
+        return web.json_response({'translatedText': f'[{body["target"]}] {body["q"]}'})
+
+    async def embeddings(request):
+        body = await request.json()
+        await asyncio.sleep(latency['embedding'])
+        inputs = body['input'] if isinstance(body['input'], list) else [body['input']]
+        return web.json_response({'data': [
+            {'index': i, 'embedding': stub_vector(text).tolist()} for i, text in enumerate(inputs)
+        ]})
+
+    async def chat(request):
+        body = await request.json()
+        await asyncio.sleep(latency['completion'])
+        question = body['messages'][-1]['content'].rsplit('Question:', 1)[-1]
+        return web.json_response({
+            'id': 'stub', 'object': 'chat.completion', 'model': body['model'],
+            'choices': [{'index': 0, 'finish_reason': 'stop',
+                         'message': {'role': 'assistant', 'content': f'Stub answer to {question.strip()}'}}],
+            'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0},
+        })
+
+    stub = web.Application()
+    stub.router.add_post('/translate', translate)
+    stub.router.add_post('/v1/embeddings', embeddings)
+    stub.router.add_post('/v1/chat/completions', chat)
+    return stub
+
+
+def configure_environment(index_path):
+    from retriever import LocalRetriever
+
+    pages = [f'NYC service page {i} about food, housing, shelters and benefits.' for i in range(200)]
+    LocalRetriever.build(index_path, [f'https://www.nyc.gov/page-{i}' for i in range(len(pages))],
+                         [stub_vector(page) for page in pages], [{'page_text': page} for page in pages])
+    os.environ.update({
+        'RETRIEVER_BACKEND': 'local',
+        'LOCAL_INDEX_PATH': index_path,
+        'EMBEDDING_CACHE_PATH': '',
+        'TRANSLATION_CACHE_PATH': '',
+        'OPENAI_API_KEY': 'stub',
+        'OPENAI_API_BASE': f'http://127.0.0.1:{STUB_PORT}/v1',
+        'TRANSLATION_URL': f'http://127.0.0.1:{STUB_PORT}/translate',
+        'GENERATE_AUDIO': '0',
+    })
+
+
+async def run_load(args):
+    # Imported after the environment points every client at the stubs
+    from app import app
+
+    latencies = []
+    failures = 0
+
+    async def one_request(client, i):
+        nonlocal failures
+        question = f'How do I get help with food stamps? ({i % args.distinct})'
+        start = time.perf_counter()
+        response = await client.post('/get_answer', form={'question': question, 'language': args.language})
+        await response.get_data()
+        latencies.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            failures += 1
+
+    async with app.test_app() as test_app:
+        client = test_app.test_client()
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def bounded(i):
+            async with semaphore:
+                await one_request(client, i)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(bounded(i) for i in range(args.requests)))
+        elapsed = time.perf_counter() - start
+        stats = await (await client.get('/cache_stats')).get_json()
+
+    latencies = np.array(latencies) * 1000
+    print(f'{args.requests} requests, concurrency {args.concurrency}, language {args.language}')
+    print(f'throughput: {args.requests / elapsed:.1f} req/s, failures: {failures}')
+    print(f'latency p50={np.percentile(latencies, 50):.1f}ms p95={np.percentile(latencies, 95):.1f}ms '
+          f'p99={np.percentile(latencies, 99):.1f}ms')
+    for name, values in stats.items():
+        print(f'{name} cache: ' + ', '.join(f'{key}={value}' for key, value in values.items()))
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Load test /get_answer against local service stubs')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--distinct', type=int, default=50, help='number of distinct questions')
+    parser.add_argument('--language', default='es')
+    parser.add_argument('--translation-latency', type=float, default=0.05)
+    parser.add_argument('--embedding-latency', type=float, default=0.05)
+    parser.add_argument('--completion-latency', type=float, default=0.5)
+    args = parser.parse_args()
+
+    latency = {'translation': args.translation_latency, 'embedding': args.embedding_latency,
+               'completion': args.completion_latency}
+    runner = web.AppRunner(create_stub_app(latency), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', STUB_PORT).start()
+    try:
+        with tempfile.TemporaryDirectory() as index_path:
+            configure_environment(index_path)
+            await run_load(args)
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
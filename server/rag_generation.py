@@ -1,47 +1,98 @@
-import json
-import numpy as np
-import openai
-import requests
-from bs4 import BeautifulSoup
-import pinecone
+import asyncio
+import logging
 import os
+import threading
 from dotenv import load_dotenv
+from retriever import create_retriever
+from embeddings import create_embedding_service
+from answer_cache import SemanticAnswerCache
+from admission import Overloaded, limiters, upstream
+from clients import LazyClient
+from context_builder import ContextBuilder
+from telemetry import STAGE_SECONDS, record_tokens, span
+from tokenizer import count_tokens
+import time
 load_dotenv('.env')
-pinecone.init(api_key="39e7f82b-83bf-4797-9281-0b76cb1e5b56",
-              environment="us-west4-gcp-free")
-index = pinecone.Index("nychackathon")
-openai.api_key = os.getenv("OPENAI_API_KEY")
-open_ai_api_key = os.getenv("OPENAI_API_KEY")
-print('api key', open_ai_api_key)
+
+
+def create_llm():
+    # openai<1.0 is configured at module level, so the module is the client; importing it is
+    # deferred because it is one of the slowest imports in the server
+    import openai
+    openai.api_key = os.getenv("OPENAI_API_KEY")
+    return openai
+
+
+# Clients are built on first use or during warm-up, never at import.
+# RETRIEVER_BACKEND=local serves queries from an on-disk index instead of Pinecone
+retriever = LazyClient("retriever", create_retriever)
+# Cached, batched embeddings; repeated questions skip the OpenAI call
+embedding_service = LazyClient("embeddings", create_embedding_service)
+llm = LazyClient("llm", create_llm)
+# Near-identical questions answered from the same documents reuse the stored completion
+answer_cache = SemanticAnswerCache(threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95")),
+                                   ttl=float(os.getenv("ANSWER_CACHE_TTL", "3600")),
+                                   max_entries=int(os.getenv("ANSWER_CACHE_SIZE", "1000")))
+# How often a request checks whether the index was rebuilt
+INDEX_CHECK_SECONDS = float(os.getenv("INDEX_CHECK_SECONDS", "5"))
+index_checked = 0.0
+index_check_lock = threading.Lock()
+CONTEXT_CANDIDATES = int(os.getenv("CONTEXT_CANDIDATES", "20"))
+context_builder = ContextBuilder(token_budget=int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500")))
+log = logging.getLogger(__name__)
 
 
 def get_openai_embedding(text):
-    api_url = "https://api.openai.com/v1/embeddings"
-    headers = {
-        "Authorization": f"Bearer {open_ai_api_key}",
-        "Content-Type": "application/json"
-    }
-    data = {
-        "input": text,
-        "model": "text-embedding-ada-002",
-        "encoding_format": "float"
-    }
     try:
-        response = requests.post(api_url, headers=headers, json=data)
-        if response.status_code == 200:
-            embedding = json.loads(response.text)["data"][0]["embedding"]
-            return embedding
-        else:
-            print(f"Failed to get embedding: {response.text}")
-            return None
+        with span('embedding'):
+            return embedding_service.get().embed(text).tolist()
     except Exception as e:
-        print(f"An error occurred: {e}")
+        log.warning(f"Failed to get embedding: {e}")
+        return None
+
+
+def count_usage(prompt, response=None, answer=None):
+    # The API reports exact usage; streamed responses do not, so those are estimated
+    usage = response.get('usage') if response is not None else None
+    if usage and usage.get('total_tokens'):
+        record_tokens(usage['prompt_tokens'], usage['completion_tokens'])
+    else:
+        record_tokens(count_tokens(prompt), count_tokens(answer or ''))
+
+
+COMPLETION_MODEL = 'gpt-3.5-turbo'
+
+
+def llm_errors():
+    # openai<1.0 raises its own exceptions, not aiohttp's. Meant for an except clause, which is
+    # only evaluated once a call has failed, so openai is still not imported up front.
+    try:
+        import openai.error
+    except ImportError:
+        return ()
+    return openai.error.OpenAIError
+
+
+def rate_limited(e):
+    # The completion API's rate limit as an Overloaded, so clients back off exactly as they do
+    # when admission control sheds: 429 with the API's Retry-After
+    try:
+        import openai.error
+    except ImportError:
+        return None
+    if not isinstance(e, openai.error.RateLimitError):
         return None
+    headers = {key.lower(): value for key, value in (e.headers or {}).items()}
+    try:
+        retry_after = float(headers.get("retry-after", 1))
+    except ValueError:
+        retry_after = 1
+    return Overloaded("completion", "rate_limited", retry_after, 429)
 
 
 def complete(prompt):
-    response = openai.ChatCompletion.create(
-        model='gpt-3.5-turbo',
+    response = llm.get().ChatCompletion.create(
+        model=COMPLETION_MODEL,
         messages=[
             {'role': 'user', 'content': prompt}
         ],
@@ -49,36 +100,85 @@ def complete(prompt):
         max_tokens=550,
 
     )
-    return response['choices'][0]['message']['content']
+    answer = response['choices'][0]['message']['content']
+    count_usage(prompt, response, answer)
+    return answer
 
 
-def answer_nyc_question(question, k=3):
+async def complete_async(prompt):
+    response = await llm.get().ChatCompletion.acreate(
+        model=COMPLETION_MODEL,
+        messages=[
+            {'role': 'user', 'content': prompt}
+        ],
+        temperature=0,
+        max_tokens=550,
+    )
+    answer = response['choices'][0]['message']['content']
+    count_usage(prompt, response, answer)
+    return answer
+
+
+async def complete_stream(prompt):
+    response = await llm.get().ChatCompletion.acreate(
+        model=COMPLETION_MODEL,
+        messages=[
+            {'role': 'user', 'content': prompt}
+        ],
+        temperature=0,
+        max_tokens=550,
+        stream=True,
+    )
+    async for chunk in response:
+        token = chunk['choices'][0]['delta'].get('content')
+        if token:
+            yield token
 
-    query = get_openai_embedding(question)
-    results = index.query(queries=[query], top_k=k,
-                          include_metadata=True, include_values=False)
-    matched_articles = results['results'][0]['matches']
+
+def current_retriever():
+    # Picks up a rebuilt index (ingest swapping CURRENT, or new vectors upserted to Pinecone) at
+    # most every INDEX_CHECK_SECONDS. Requests already running keep the retriever they started with.
+    global index_checked
+    served = retriever.get()
+    now = time.monotonic()
+    if now - index_checked < INDEX_CHECK_SECONDS or not index_check_lock.acquire(blocking=False):
+        return served
+    try:
+        index_checked = now
+        if served.latest_version() != served.version:
+            reloaded = served.reload()
+            retriever.set(reloaded)
+            log.info(f"Serving index version {reloaded.version}")
+            return reloaded
+    except Exception as e:
+        log.warning(f"Could not check the index version: {e}")
+    finally:
+        index_check_lock.release()
+    return served
+
+
+def retrieve_context(question, k=3):
+    # Returns (query embedding, document ids, sources, page texts), or an apology string on failure.
+    # The embedding is None when a hybrid retriever answered from its lexical index alone.
     try:
-        page_texts = []
-        websites = []
-        for article in matched_articles:
-            website = article['id']
-            page_text = article['metadata']['page_text']
-            page_texts.append(page_text)
-            websites.append(website)
+        # Over-retrieve, then rerank and keep only what fits the prompt token budget
+        with span('retrieval'):
+            query, matched_articles = current_retriever().search_text(question, get_openai_embedding,
+                                                                      top_k=max(k, CONTEXT_CANDIDATES))
+        if query is None and not matched_articles:
+            return "Sorry, I couldn't process that question right now. Please try again."
+        with span('context'):
+            passages = context_builder.build(question, matched_articles)
+        doc_ids = [passage.doc_id for passage in passages]
+        page_texts = [passage.text for passage in passages]
+        websites = [passage.source for passage in passages]
     except Exception as e:
-        try:
-            page_texts = []
-            websites = []
-            for article in matched_articles[0]:
-                website = article['id']
-                page_text = article['metadata']['page_text']
-                page_texts.append(page_text)
-                websites.append(website)
-        except Exception as e:
-            print(f"An error occurred in getting matched articles: {e}")
-            return "Sorry, I don't know the answer to that."
+        log.warning(f"An error occurred in getting matched articles: {e}")
+        return "Sorry, I don't know the answer to that."
+    return query, doc_ids, websites, page_texts
+
 
+def build_prompt(question, page_texts):
     combined_contexts = "\n\n---\n\n".join(page_texts)
 
     # build our prompt with the retrieved contexts included
@@ -93,13 +193,121 @@ def answer_nyc_question(question, k=3):
     prompt = prompt_start + combined_contexts + prompt_end
     prompt = prompt.replace('\n', ' ')
     # replace multiple whitespace with single whitespace
-    prompt = ' '.join(prompt.split())
-    answer = complete(prompt)
+    return ' '.join(prompt.split())
 
+
+def format_sources(websites):
     # list the sources in a buletted list
     sources = []
-    for website in websites:
+    for website in dict.fromkeys(websites):
         sources.append(f"- {website}")
-    sources_help = "\n".join(sources)
+    return "\n".join(sources)
+
+
+def cached_answer(query, doc_ids):
+    # Lexical fast-path answers have no embedding to compare, so they bypass the cache
+    if query is None:
+        return None
+    answer_cache.check_version(retriever.get().version)
+    return answer_cache.lookup(query, doc_ids)
+
+
+def store_answer(query, doc_ids, answer, sources, completion_seconds):
+    if query is not None:
+        answer_cache.store(query, doc_ids, answer, sources, completion_seconds)
+
+
+def answer_nyc_question(question, k=3):
+    context = retrieve_context(question, k)
+    if isinstance(context, str):
+        return context, ""
+    query, doc_ids, websites, page_texts = context
+
+    cached = cached_answer(query, doc_ids)
+    if cached is not None:
+        return cached.answer, cached.sources
 
+    prompt = build_prompt(question, page_texts)
+    started = time.perf_counter()
+    with span('completion'):
+        answer = complete(prompt)
+    completion_seconds = time.perf_counter() - started
+
+    sources_help = format_sources(websites)
+    store_answer(query, doc_ids, answer, sources_help, completion_seconds)
+    return answer, sources_help
+
+
+async def retrieve_context_async(question, k=3, timeout=None):
+    # Embedding and retrieval are blocking (pooled HTTP session, mmap'd index), so they run in a
+    # worker thread. A timeout or a cancelled request cannot stop that thread, so the retrieval slot
+    # is released when the thread finishes rather than when the caller stops waiting; the limiter
+    # then bounds the threads actually running and with them concurrent embedding calls.
+    limiter = limiters['retrieval']
+    started = await limiter.acquire()
+    work = asyncio.ensure_future(asyncio.to_thread(retrieve_context, question, k))
+
+    def finished(task):
+        limiter.release(started)
+        # Retrieve the error so an abandoned thread's failure is not logged as never retrieved
+        if not task.cancelled():
+            task.exception()
+
+    work.add_done_callback(finished)
+    return await asyncio.wait_for(asyncio.shield(work), timeout)
+
+
+async def answer_nyc_question_async(question, k=3, retrieval_timeout=None, completion_timeout=None):
+    context = await retrieve_context_async(question, k, retrieval_timeout)
+    if isinstance(context, str):
+        return context, ""
+    query, doc_ids, websites, page_texts = context
+
+    cached = cached_answer(query, doc_ids)
+    if cached is not None:
+        return cached.answer, cached.sources
+
+    prompt = build_prompt(question, page_texts)
+    # Queueing for a completion slot is bounded separately and not charged to the completion timeout
+    async with upstream('completion'):
+        started = time.perf_counter()
+        with span('completion'):
+            answer = await asyncio.wait_for(complete_async(prompt), completion_timeout)
+    completion_seconds = time.perf_counter() - started
+
+    sources_help = format_sources(websites)
+    store_answer(query, doc_ids, answer, sources_help, completion_seconds)
     return answer, sources_help
+
+
+async def stream_nyc_answer(question, k=3, retrieval_timeout=None):
+    # Yields ('token', text) while the completion streams, then ('sources', bulleted list)
+    context = await retrieve_context_async(question, k, retrieval_timeout)
+    if isinstance(context, str):
+        yield 'token', context
+        yield 'sources', ""
+        return
+    query, doc_ids, websites, page_texts = context
+
+    cached = cached_answer(query, doc_ids)
+    if cached is not None:
+        yield 'token', cached.answer
+        yield 'sources', cached.sources
+        return
+
+    started = time.perf_counter()
+    tokens = []
+    prompt = build_prompt(question, page_texts)
+    # The completion slot is held while tokens stream back
+    async with upstream('completion'):
+        async for token in complete_stream(prompt):
+            tokens.append(token)
+            yield 'token', token
+    completion_seconds = time.perf_counter() - started
+    # A span cannot be held open across yields to the caller, so the stage is timed by hand
+    STAGE_SECONDS.observe(completion_seconds, 'completion_stream')
+    count_usage(prompt, answer=''.join(tokens))
+
+    sources_help = format_sources(websites)
+    store_answer(query, doc_ids, ''.join(tokens), sources_help, completion_seconds)
+    yield 'sources', sources_help
@@ -0,0 +1,284 @@
+import json
+import os
+
+import numpy as np
+
+# Written by ingest.py next to the versions/ folder; names the version to serve
+CURRENT_VERSION_FILE = "CURRENT"
+
+
+def resolve_index_path(path):
+    current = os.path.join(path, CURRENT_VERSION_FILE)
+    if os.path.exists(current):
+        with open(current, "r") as file:
+            return os.path.join(path, "versions", file.read().strip())
+    return path
+
+
+class Retriever:
+    # Every backend returns matches shaped like Pinecone's: {'id', 'score', 'metadata': {'page_text'}}
+    def query(self, vector, top_k=3):
+        raise NotImplementedError
+
+    def search_text(self, question, embed, top_k=3):
+        # Returns (query vector, matches); embed(question) gives a vector, or None on failure
+        vector = embed(question)
+        if vector is None:
+            return None, []
+        return vector, self.query(vector, top_k)
+
+    @property
+    def version(self):
+        # The index this retriever serves; the answer cache is cleared when it changes
+        return os.getenv("INDEX_VERSION")
+
+    def latest_version(self):
+        # The index as published now, which differs from version once it has been rebuilt
+        return self.version
+
+    def reload(self):
+        # A retriever serving latest_version(); remote indexes are always current
+        return self
+
+    def warm_up(self):
+        # Called once per worker before it reports ready; loads whatever the first query would
+        pass
+
+
+class PineconeRetriever(Retriever):
+    def __init__(self, index_name="nychackathon", api_key=None, environment=None):
+        self.index_name = index_name
+        self.api_key = api_key or os.getenv("PINECONE_API_KEY")
+        self.environment = environment or os.getenv("PINECONE_ENVIRONMENT", "us-west4-gcp-free")
+        self.index = None
+        self.observed_version = None
+
+    def connect(self):
+        import pinecone
+        pinecone.init(api_key=self.api_key, environment=self.environment)
+        self.index = pinecone.Index(self.index_name)
+
+    def warm_up(self):
+        self.connect()
+
+    @property
+    def version(self):
+        return os.getenv("INDEX_VERSION") or self.observed_version
+
+    def latest_version(self):
+        # Upserting a re-ingest changes the index's vector count; INDEX_VERSION overrides it
+        if os.getenv("INDEX_VERSION"):
+            return os.getenv("INDEX_VERSION")
+        if self.index is None:
+            self.connect()
+        self.observed_version = str(self.index.describe_index_stats()["total_vector_count"])
+        return self.observed_version
+
+    def query(self, vector, top_k=3):
+        if self.index is None:
+            self.connect()
+        results = self.index.query(queries=[vector], top_k=top_k,
+                                   include_metadata=True, include_values=False)
+        matches = results['results'][0]['matches']
+        # Older clients nest the matches one level deeper
+        if matches and isinstance(matches[0], list):
+            matches = matches[0]
+        return matches
+
+
+class LocalRetriever(Retriever):
+    # IVF-flat over unit-normalised float32 vectors; vectors are stored grouped by inverted list
+    # so each probed list is one contiguous slice of the memory-mapped matrix.
+
+    def __init__(self, path, nprobe=8, exact=False):
+        # root holds CURRENT; path is the version resolved from it when this retriever was opened
+        self.root = path
+        self.path = resolve_index_path(path)
+        self.nprobe = nprobe
+        self.exact_requested = exact
+        path = self.path
+        self.served_version = self.version_of(path)
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        with open(os.path.join(path, "ids.json"), "r") as file:
+            self.ids = json.load(file)
+        with open(os.path.join(path, "metadata.json"), "r") as file:
+            self.metadata = json.load(file)
+        centroids_path = os.path.join(path, "centroids.npy")
+        self.exact = exact or not os.path.exists(centroids_path)
+        if not self.exact:
+            self.centroids = np.load(centroids_path)
+            self.list_offsets = np.load(os.path.join(path, "list_offsets.npy"))
+
+    @staticmethod
+    def normalize(vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    @staticmethod
+    def kmeans(vectors, nlist, iterations=10, seed=0):
+        rng = np.random.default_rng(seed)
+        sample = vectors[rng.choice(len(vectors), size=min(len(vectors), nlist * 64), replace=False)]
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignments = np.argmax(sample @ centroids.T, axis=1)
+            for list_id in range(nlist):
+                members = sample[assignments == list_id]
+                if len(members):
+                    centroids[list_id] = members.mean(axis=0)
+            centroids = LocalRetriever.normalize(centroids)
+        return centroids
+
+    @classmethod
+    def build(cls, path, ids, vectors, metadata, nlist=None, exact_threshold=5000):
+        os.makedirs(path, exist_ok=True)
+        vectors = cls.normalize(vectors)
+        ids = list(ids)
+        metadata = list(metadata)
+
+        centroids_path = os.path.join(path, "centroids.npy")
+        if len(vectors) > exact_threshold:
+            nlist = nlist or int(np.sqrt(len(vectors)))
+            centroids = cls.kmeans(vectors, nlist)
+            assignments = np.concatenate([
+                np.argmax(vectors[start:start + 65536] @ centroids.T, axis=1)
+                for start in range(0, len(vectors), 65536)
+            ])
+            order = np.argsort(assignments, kind="stable")
+            counts = np.bincount(assignments, minlength=nlist)
+            vectors = vectors[order]
+            ids = [ids[i] for i in order]
+            metadata = [metadata[i] for i in order]
+            np.save(centroids_path, centroids)
+            np.save(os.path.join(path, "list_offsets.npy"), np.concatenate([[0], np.cumsum(counts)]))
+        elif os.path.exists(centroids_path):
+            os.remove(centroids_path)
+
+        np.save(os.path.join(path, "vectors.npy"), vectors)
+        with open(os.path.join(path, "ids.json"), "w") as file:
+            json.dump(ids, file)
+        with open(os.path.join(path, "metadata.json"), "w") as file:
+            json.dump(metadata, file)
+        return cls(path)
+
+    @staticmethod
+    def version_of(path):
+        # The version folder ingest swapped CURRENT to; the mtime covers indexes rebuilt in place
+        return f"{os.path.basename(path)}:{os.stat(os.path.join(path, 'vectors.npy')).st_mtime_ns}"
+
+    @property
+    def version(self):
+        return self.served_version
+
+    def latest_version(self):
+        return self.version_of(resolve_index_path(self.root))
+
+    def reload(self):
+        # A new retriever, so queries already running finish on the arrays they started with
+        if self.latest_version() == self.version:
+            return self
+        return LocalRetriever(self.root, nprobe=self.nprobe, exact=self.exact_requested)
+
+    def candidates(self, query):
+        if self.exact:
+            return np.arange(len(self.vectors)), self.vectors
+        probes = np.argsort(-(self.centroids @ query))[:self.nprobe]
+        rows = np.concatenate([
+            np.arange(self.list_offsets[list_id], self.list_offsets[list_id + 1]) for list_id in probes
+        ])
+        rows.sort()
+        return rows, self.vectors[rows]
+
+    def search(self, vector, top_k=3):
+        query = self.normalize(vector)
+        rows, vectors = self.candidates(query)
+        scores = np.asarray(vectors @ query)
+        top_k = min(top_k, len(scores))
+        if top_k == 0:
+            return [], []
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.argsort(-scores[best])]
+        return rows[best], scores[best]
+
+    def warm_up(self):
+        # Touch one float per 4 KB page so the memory-mapped vectors are in the page cache
+        # before the first request, then run one query through the same code path
+        if len(self.vectors):
+            float(np.asarray(self.vectors.reshape(-1)[::1024]).sum())
+            self.query(np.asarray(self.vectors[0]), top_k=1)
+
+    def query(self, vector, top_k=3):
+        rows, scores = self.search(vector, top_k)
+        return [
+            {"id": self.ids[row], "score": float(score), "metadata": self.metadata[row]}
+            for row, score in zip(rows, scores)
+        ]
+
+
+class HybridRetriever(Retriever):
+    # BM25 over page texts and dataset names fused with vector search by reciprocal rank.
+    # A query whose best lexical match contains every query term and clearly beats the
+    # runner-up is answered from the lexical index alone, without an embedding call.
+
+    def __init__(self, vector_retriever, lexical_index, fast_path_margin=2.0, lexical_k=None):
+        self.vector_retriever = vector_retriever
+        self.lexical_index = lexical_index
+        self.fast_path_margin = fast_path_margin
+        self.lexical_k = lexical_k
+        self.fast_path_hits = 0
+        self.fused = 0
+
+    def query(self, vector, top_k=3):
+        return self.vector_retriever.query(vector, top_k)
+
+    def warm_up(self):
+        self.vector_retriever.warm_up()
+        self.lexical_index.search("nyc services", 1)
+
+    def confident(self, matches):
+        if not matches or matches[0]["coverage"] < 1.0:
+            return False
+        return len(matches) == 1 or matches[0]["score"] >= self.fast_path_margin * matches[1]["score"]
+
+    def search_text(self, question, embed, top_k=3):
+        from lexical_index import reciprocal_rank_fusion
+
+        lexical = self.lexical_index.search(question, self.lexical_k or top_k)
+        if self.fast_path_margin and self.confident(lexical):
+            self.fast_path_hits += 1
+            return None, lexical[:top_k]
+        vector = embed(question)
+        if vector is None:
+            # Embedding service down: lexical matches are still better than nothing
+            return None, lexical[:top_k]
+        self.fused += 1
+        return vector, reciprocal_rank_fusion([self.vector_retriever.query(vector, top_k), lexical], top_k)
+
+    @property
+    def version(self):
+        return f"{self.vector_retriever.version}:{self.lexical_index.version}"
+
+    def latest_version(self):
+        return f"{self.vector_retriever.latest_version()}:{self.lexical_index.version}"
+
+    def reload(self):
+        vector_retriever = self.vector_retriever.reload()
+        if vector_retriever is self.vector_retriever:
+            return self
+        return HybridRetriever(vector_retriever, self.lexical_index, self.fast_path_margin, self.lexical_k)
+
+
+def create_retriever(backend=None):
+    backend = backend or os.getenv("RETRIEVER_BACKEND", "pinecone")
+    if backend == "local":
+        retriever = LocalRetriever(os.getenv("LOCAL_INDEX_PATH", "index"),
+                                   nprobe=int(os.getenv("LOCAL_INDEX_NPROBE", "8")))
+    else:
+        retriever = PineconeRetriever()
+    # LEXICAL_INDEX_PATH (written by ingest.py --lexical) turns on hybrid retrieval
+    lexical_path = os.getenv("LEXICAL_INDEX_PATH")
+    if lexical_path:
+        from lexical_index import LexicalIndex
+        retriever = HybridRetriever(retriever, LexicalIndex(lexical_path),
+                                    fast_path_margin=float(os.getenv("LEXICAL_FAST_PATH_MARGIN", "2.0")))
+    return retriever
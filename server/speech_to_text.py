@@ -0,0 +1,249 @@
+import os
+import struct
+
+import numpy as np
+
+STT_SAMPLE_RATE = 16000
+
+# WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT, WAVE_FORMAT_EXTENSIBLE
+PCM, IEEE_FLOAT, EXTENSIBLE = 1, 3, 0xFFFE
+MAX_HEADER_BYTES = 64 * 1024
+
+
+class AudioError(Exception):
+    # status is the HTTP status the endpoint answers with
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class StreamingResampler:
+    # Linear interpolation that carries its phase and last sample across chunks, so feeding a
+    # signal in pieces gives the same output as feeding it whole. Speech models are trained on
+    # 16 kHz audio and tolerate the small aliasing this leaves when downsampling from 44.1/48 kHz.
+
+    def __init__(self, source_rate, target_rate):
+        self.step = source_rate / target_rate
+        self.position = 0.0
+        self.last = None
+
+    def process(self, samples):
+        if self.step == 1.0 or not len(samples):
+            return samples
+        data = samples if self.last is None else np.concatenate(([self.last], samples))
+        end = len(data) - 1
+        if self.position > end:
+            self.position -= len(samples)
+            self.last = data[-1]
+            return samples[:0]
+        times = np.arange(self.position, end + 1e-9, self.step)
+        output = np.interp(times, np.arange(len(data)), data).astype(np.float32)
+        # The next chunk starts at this chunk's last sample, which becomes index 0
+        self.position = times[-1] + self.step - end
+        self.last = data[-1]
+        return output
+
+
+class WavStreamDecoder:
+    # Decodes a RIFF/WAVE upload as it arrives: only the header and at most one partial frame
+    # are held as bytes; samples are converted chunk by chunk to mono float32 at target_rate
+    # and appended to a buffer capped at max_seconds.
+
+    def __init__(self, target_rate=STT_SAMPLE_RATE, max_seconds=120):
+        self.target_rate = target_rate
+        self.max_samples = int(max_seconds * target_rate)
+        self.header = bytearray()
+        self.header_done = False
+        self.pending = b""
+        self.format = None
+        self.remaining = None
+        self.resampler = None
+        self.buffer = np.empty(min(self.max_samples, 10 * target_rate), dtype=np.float32)
+        self.length = 0
+        self.source_rate = None
+
+    def parse_header(self):
+        # Returns the offset of the first data byte, or None until the header is complete.
+        # Sizes of 0 or 0xFFFFFFFF (written by encoders piping to stdout) mean "until the end".
+        header = self.header
+        if len(header) < 12:
+            return None
+        if header[:4] != b"RIFF" or header[8:12] != b"WAVE":
+            raise AudioError("Expected a RIFF/WAVE upload", status=415)
+        offset = 12
+        while len(header) >= offset + 8:
+            chunk_id = bytes(header[offset:offset + 4])
+            size, = struct.unpack_from("<I", header, offset + 4)
+            if chunk_id == b"data":
+                if self.format is None:
+                    raise AudioError("WAVE data chunk before its fmt chunk")
+                self.remaining = None if size in (0, 0xFFFFFFFF) else size
+                return offset + 8
+            if len(header) < offset + 8 + size:
+                return None
+            if chunk_id == b"fmt ":
+                self.read_format(header, offset + 8, size)
+            offset += 8 + size + (size & 1)
+        return None
+
+    def read_format(self, header, offset, size):
+        audio_format, channels, rate, _, block_align, bits = struct.unpack_from("<HHIIHH", header, offset)
+        if audio_format == EXTENSIBLE and size >= 26:
+            audio_format, = struct.unpack_from("<H", header, offset + 24)
+        if audio_format == PCM and bits in (8, 16, 24, 32):
+            dtype = {8: np.uint8, 16: np.dtype("<i2"), 24: np.uint8, 32: np.dtype("<i4")}[bits]
+        elif audio_format == IEEE_FLOAT and bits in (32, 64):
+            dtype = np.dtype("<f4") if bits == 32 else np.dtype("<f8")
+        else:
+            raise AudioError(f"Unsupported WAVE encoding (format {audio_format}, {bits} bits)", status=415)
+        if not channels or not rate:
+            raise AudioError("Invalid WAVE format chunk")
+        self.format = (audio_format, channels, bits, dtype, block_align or channels * bits // 8)
+        self.source_rate = rate
+        self.resampler = StreamingResampler(rate, self.target_rate)
+
+    def samples(self, data):
+        # bytes of whole frames -> mono float32 in [-1, 1]; np.frombuffer views the chunk without copying
+        audio_format, channels, bits, dtype, _ = self.format
+        raw = np.frombuffer(data, dtype=dtype)
+        if bits == 8 and audio_format == PCM:
+            values = (raw.astype(np.float32) - 128.0) / 128.0
+        elif bits == 24:
+            triples = raw.reshape(-1, 3).astype(np.int32)
+            values = ((triples[:, 0] | (triples[:, 1] << 8) | (triples[:, 2] << 16)) << 8 >> 8) / float(1 << 23)
+        elif audio_format == PCM:
+            values = raw / float(1 << (bits - 1))
+        else:
+            values = raw
+        values = values.astype(np.float32, copy=False)
+        if channels > 1:
+            values = values.reshape(-1, channels).mean(axis=1)
+        return values
+
+    def append(self, samples):
+        needed = self.length + len(samples)
+        if needed > self.max_samples:
+            raise AudioError(f"Audio longer than {self.max_samples / self.target_rate:.0f}s", status=413)
+        if needed > len(self.buffer):
+            grown = np.empty(min(max(needed, 2 * len(self.buffer)), self.max_samples), dtype=np.float32)
+            grown[:self.length] = self.buffer[:self.length]
+            self.buffer = grown
+        self.buffer[self.length:needed] = samples
+        self.length = needed
+
+    def feed(self, chunk):
+        if not self.header_done:
+            self.header += chunk
+            start = self.parse_header()
+            if start is None:
+                if len(self.header) > MAX_HEADER_BYTES:
+                    raise AudioError("WAVE header too large")
+                return
+            chunk = bytes(self.header[start:])
+            self.header = bytearray()
+            self.header_done = True
+        if self.remaining is not None:
+            chunk = chunk[:self.remaining]
+            self.remaining -= len(chunk)
+        data = self.pending + chunk if self.pending else chunk
+        frame = self.format[4]
+        usable = len(data) - len(data) % frame
+        self.pending = bytes(data[usable:])
+        if usable:
+            self.append(self.resampler.process(self.samples(memoryview(data)[:usable])))
+
+    def audio(self):
+        if not self.header_done:
+            raise AudioError("Incomplete WAVE upload")
+        return self.buffer[:self.length]
+
+
+def voiced_segments(audio, rate, frame_ms=30, margin_db=15.0, floor_db=-45.0, padding_ms=200):
+    # Energy-based voice activity: a frame is speech when it is margin_db above the noise floor
+    # (the 10th percentile frame) and louder than floor_db. Speech is padded so word onsets and
+    # trailing consonants are kept. Returns [(start, end)] sample ranges.
+    frame = max(int(rate * frame_ms / 1000), 1)
+    frames = len(audio) // frame
+    if not frames:
+        return [(0, len(audio))] if len(audio) else []
+    energy = np.square(audio[:frames * frame].reshape(frames, frame), dtype=np.float32).mean(axis=1)
+    levels = 10 * np.log10(energy + 1e-12)
+    noise, peak = np.percentile(levels, 10), levels.max()
+    # A recording that is speech throughout has no quiet frames to estimate the floor from
+    threshold = max(floor_db, min(noise + margin_db, peak - 6.0))
+    voiced = levels > threshold
+    if not voiced.any():
+        return []
+    padding = int(padding_ms / frame_ms)
+    if padding:
+        kernel = np.ones(2 * padding + 1, dtype=bool)
+        voiced = np.convolve(voiced, kernel, mode="same") > 0
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], voiced.astype(np.int8), [0]))))
+    return [(int(start) * frame, min(int(end) * frame, len(audio))) for start, end in zip(edges[::2], edges[1::2])]
+
+
+def trim_silence(audio, rate, **options):
+    segments = voiced_segments(audio, rate, **options)
+    if len(segments) == 1:
+        start, end = segments[0]
+        return audio[start:end]
+    return np.concatenate([audio[start:end] for start, end in segments]) if segments else audio[:0]
+
+
+class SpeechToText:
+    # transcribe() gets mono float32 samples at STT_SAMPLE_RATE and returns the transcript;
+    # load() brings the model into memory and is called during warm-up
+    def load(self):
+        return None
+
+    def transcribe(self, audio, rate, language=None):
+        raise NotImplementedError
+
+
+class FasterWhisperSpeechToText(SpeechToText):
+    # Local CTranslate2 Whisper; the model is loaded on first use
+    def __init__(self, model="base", device="cpu", compute_type="int8", beam_size=1):
+        self.model_name = model
+        self.device = device
+        self.compute_type = compute_type
+        self.beam_size = beam_size
+        self.model = None
+
+    def load(self):
+        if self.model is None:
+            from faster_whisper import WhisperModel
+            self.model = WhisperModel(self.model_name, device=self.device, compute_type=self.compute_type)
+        return self.model
+
+    def transcribe(self, audio, rate, language=None):
+        segments, _ = self.load().transcribe(audio, language=language, beam_size=self.beam_size)
+        return " ".join(segment.text.strip() for segment in segments).strip()
+
+
+class WhisperSpeechToText(SpeechToText):
+    # The reference openai-whisper package (PyTorch)
+    def __init__(self, model="base"):
+        self.model_name = model
+        self.model = None
+
+    def load(self):
+        if self.model is None:
+            import whisper
+            self.model = whisper.load_model(self.model_name)
+        return self.model
+
+    def transcribe(self, audio, rate, language=None):
+        return self.load().transcribe(audio, language=language, fp16=False)["text"].strip()
+
+
+def stt_language(language):
+    # "es", "zh-CN" -> Whisper's two-letter codes; None lets the model detect it
+    return language.split("-")[0].lower() if language else None
+
+
+def create_speech_to_text(backend=None):
+    backend = backend or os.getenv("STT_BACKEND", "faster-whisper")
+    model = os.getenv("STT_MODEL", "base")
+    if backend == "whisper":
+        return WhisperSpeechToText(model)
+    return FasterWhisperSpeechToText(model, device=os.getenv("STT_DEVICE", "cpu"))
@@ -0,0 +1,332 @@
+import bisect
+import collections
+import contextvars
+import itertools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+# Seconds; covers cache hits (sub-millisecond) through slow completions
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# TELEMETRY_JSON_LOGS=1 logs every span and request as one JSON line; metrics are always kept
+# and served at /metrics
+JSON_LOGS = os.getenv("TELEMETRY_JSON_LOGS", "0") == "1"
+
+log = logging.getLogger("telemetry")
+current_trace = contextvars.ContextVar("trace", default=None)
+trace_ids = itertools.count(1)
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def label_text(names, values, extra=""):
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    # Label values are positional, in the order of labelnames, e.g. counter.inc("answers", "hit")
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        with self.lock:
+            items = sorted(self.values.items())
+        return self.header() + [f"{self.name}{label_text(self.labelnames, labels)} {value}" for labels, value in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=STAGE_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        # Per-bucket (not cumulative) counts, so an observation touches one slot; render() accumulates
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(labels)
+            if state is None:
+                state = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self):
+        lines = self.header()
+        with self.lock:
+            items = sorted((labels, [list(state[0]), state[1], state[2]]) for labels, state in self.values.items())
+        for labels, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{label_text(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{label_text(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{label_text(self.labelnames, labels)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.add(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.add(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=STAGE_BUCKETS):
+        return self.add(Histogram(name, documentation, labelnames, buckets))
+
+    def register_collector(self, collect):
+        # collect() returns Metric objects built at scrape time, e.g. from a cache's stats(),
+        # so values that are already counted elsewhere cost nothing on the request path
+        self.collectors.append(collect)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for collect in self.collectors:
+            try:
+                for metric in collect():
+                    lines.extend(metric.render())
+            except Exception as e:
+                log.warning(f"Metrics collector failed: {e}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.histogram("nyc_stage_seconds", "Time spent in each stage of answering a question",
+                                   ["stage"])
+STAGE_ERRORS = REGISTRY.counter("nyc_stage_errors_total", "Stages that raised", ["stage", "error"])
+REQUEST_SECONDS = REGISTRY.histogram("nyc_request_seconds", "End-to-end request latency", ["route"])
+REQUESTS = REGISTRY.counter("nyc_requests_total", "Finished requests", ["route", "status"])
+IN_FLIGHT = REGISTRY.gauge("nyc_requests_in_flight", "Requests being served", ["route"])
+TOKENS = REGISTRY.counter("nyc_completion_tokens_total", "Prompt and completion tokens sent to the chat model",
+                          ["kind"])
+
+
+class Trace:
+    def __init__(self, route):
+        self.id = f"{os.getpid():x}-{next(trace_ids):x}"
+        self.route = route
+        self.started = time.perf_counter()
+        self.status = "ok"
+        # Open span names; only kept while the profiler samples this trace
+        self.stack = None
+        self.samples = None
+
+
+class span:
+    # with span("completion"): ...  Records the stage duration; logs it when JSON logs are on.
+    # A plain class rather than @contextmanager keeps the cost to two perf_counter calls and
+    # one histogram update.
+    __slots__ = ("name", "attributes", "start", "trace")
+
+    def __init__(self, name, **attributes):
+        self.name = name
+        self.attributes = attributes
+        self.trace = None
+
+    def __enter__(self):
+        trace = current_trace.get()
+        if trace is not None and trace.stack is not None:
+            trace.stack.append(self.name)
+            self.trace = trace
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, kind, error, traceback):
+        duration = time.perf_counter() - self.start
+        STAGE_SECONDS.observe(duration, self.name)
+        if kind is not None:
+            STAGE_ERRORS.inc(self.name, kind.__name__)
+        if self.trace is not None:
+            stack = self.trace.stack
+            # Concurrent sub-tasks of one request share the stack, so remove this span by name
+            for i in range(len(stack) - 1, -1, -1):
+                if stack[i] == self.name:
+                    del stack[i]
+                    break
+        if JSON_LOGS:
+            trace = current_trace.get()
+            log.info("span", extra={"fields": {
+                "event": "span", "span": self.name, "trace_id": trace.id if trace else None,
+                "duration_ms": round(duration * 1000, 3), "error": kind.__name__ if kind else None,
+                **self.attributes}})
+        return False
+
+
+def start_request(route):
+    # Each Quart request (and each streamed response) runs in its own task, so the trace set
+    # here is visible to every span in the request, including those in asyncio.to_thread workers
+    trace = Trace(route)
+    current_trace.set(trace)
+    IN_FLIGHT.inc(route)
+    if profiler is not None:
+        profiler.watch(trace)
+    return trace
+
+
+def finish_request(trace, status=None):
+    duration = time.perf_counter() - trace.started
+    status = status or trace.status
+    IN_FLIGHT.dec(trace.route)
+    REQUEST_SECONDS.observe(duration, trace.route)
+    REQUESTS.inc(trace.route, str(status))
+    if profiler is not None:
+        profiler.finish(trace, duration)
+    if JSON_LOGS:
+        log.info("request", extra={"fields": {"event": "request", "route": trace.route, "trace_id": trace.id,
+                                              "status": status, "duration_ms": round(duration * 1000, 3)}})
+
+
+def record_tokens(prompt_tokens, completion_tokens):
+    TOKENS.inc("prompt", amount=prompt_tokens)
+    TOKENS.inc("completion", amount=completion_tokens)
+
+
+def cache_metrics(caches):
+    # caches: {name: object with hits and misses}; read at scrape time
+    hits = Counter("nyc_cache_hits_total", "Cache hits", ["cache"])
+    misses = Counter("nyc_cache_misses_total", "Cache misses", ["cache"])
+    for name, cache in caches.items():
+        hits.values[(name,)] = cache.hits
+        misses.values[(name,)] = cache.misses
+    return [hits, misses]
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {"time": round(record.created, 6), "level": record.levelname, "logger": record.name,
+                 "message": record.getMessage()}
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging():
+    handler = logging.StreamHandler()
+    if JSON_LOGS:
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(name)s - %(message)s"))
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO"))
+
+
+class SamplingProfiler:
+    # Opt-in (PROFILE_SLOW_SECONDS). While any request is in flight, a thread samples every
+    # thread's stack; each sample is credited to every in-flight request, prefixed with that
+    # request's open spans. Requests slower than the threshold have their stacks written as
+    # folded lines ("frame;frame;frame count") that flamegraph.pl and speedscope read directly.
+
+    def __init__(self, threshold, interval=0.005, directory="profiles", max_depth=64):
+        self.threshold = threshold
+        self.interval = interval
+        self.directory = directory
+        self.max_depth = max_depth
+        self.active = set()
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread = threading.Thread(target=self.loop, daemon=True, name="sampling-profiler")
+        self.thread.start()
+
+    def watch(self, trace):
+        trace.stack = []
+        trace.samples = collections.Counter()
+        with self.lock:
+            self.active.add(trace)
+        self.wake.set()
+
+    def finish(self, trace, duration):
+        with self.lock:
+            self.active.discard(trace)
+        if duration >= self.threshold and trace.samples:
+            self.dump(trace, duration)
+
+    def folded(self, frame):
+        frames = []
+        while frame is not None and len(frames) < self.max_depth:
+            code = frame.f_code
+            frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+            frame = frame.f_back
+        return ";".join(reversed(frames))
+
+    def loop(self):
+        own = threading.get_ident()
+        while True:
+            self.wake.wait()
+            with self.lock:
+                active = list(self.active)
+                if not active:
+                    self.wake.clear()
+                    continue
+            stacks = [self.folded(frame) for ident, frame in sys._current_frames().items() if ident != own]
+            for trace in active:
+                prefix = ";".join([trace.route] + [f"span:{name}" for name in trace.stack])
+                for stack in stacks:
+                    trace.samples[f"{prefix};{stack}"] += 1
+            time.sleep(self.interval)
+
+    def dump(self, trace, duration):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{trace.route}-{trace.id}-{int(duration * 1000)}ms.folded")
+        with open(path, "w") as file:
+            for stack, count in trace.samples.most_common():
+                file.write(f"{stack} {count}\n")
+        log.warning(f"Slow request {trace.id} on {trace.route} ({duration:.2f}s); stacks written to {path}")
+
+
+def create_profiler():
+    threshold = os.getenv("PROFILE_SLOW_SECONDS")
+    if not threshold:
+        return None
+    return SamplingProfiler(float(threshold), interval=float(os.getenv("PROFILE_INTERVAL", "0.005")),
+                            directory=os.getenv("PROFILE_DIR", "profiles"))
+
+
+profiler = create_profiler()
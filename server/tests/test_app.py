@@ -0,0 +1,129 @@
+import asyncio
+import io
+import json
+import wave
+
+import numpy as np
+import openai.error
+import pytest
+
+import app as server
+from telemetry import REGISTRY, REQUESTS
+
+
+@pytest.fixture(autouse=True)
+def quiet_startup(monkeypatch, tmp_path):
+    # No warm-up, and the translation cache is written under tmp_path, not into the tree
+    monkeypatch.setattr(server, "WARMUP", "")
+    monkeypatch.setenv("TRANSLATION_CACHE_PATH", str(tmp_path / "translations.sqlite"))
+
+
+def test_cache_metrics_are_collected_once_across_restarts():
+    collectors = len(REGISTRY.collectors)
+
+    async def scrape():
+        async with server.create_app().test_app() as app:
+            response = await app.test_client().get("/metrics")
+            return (await response.get_data()).decode()
+
+    for _ in range(3):
+        body = asyncio.run(scrape())
+    assert len(REGISTRY.collectors) == collectors
+    assert body.count('nyc_cache_hits_total{cache="answers"}') == 1
+
+
+def ask(monkeypatch, error):
+
+    async def failing_answer(question, **timeouts):
+        raise error
+
+    monkeypatch.setattr(server, "answer_nyc_question_async", failing_answer)
+
+    async def post():
+        async with server.create_app().test_app() as app:
+            response = await app.test_client().post("/get_answer", form={"question": "q", "language": "en"})
+            return response.status_code, response.headers
+
+    return asyncio.run(post())
+
+
+def test_completion_rate_limit_is_answered_like_shedding(monkeypatch):
+    status, headers = ask(monkeypatch, openai.error.RateLimitError("Rate limit reached", headers={"Retry-After": "7"}))
+    assert status == 429
+    assert headers["Retry-After"] == "7"
+
+
+@pytest.mark.parametrize("error", [openai.error.APIError("bad gateway"), openai.error.ServiceUnavailableError("down"),
+                                   openai.error.APIConnectionError("reset")])
+def test_other_completion_errors_are_upstream_errors(monkeypatch, error):
+    status, _ = ask(monkeypatch, error)
+    assert status == 502
+
+
+@pytest.mark.parametrize("error, retry_after", [
+    (openai.error.RateLimitError("Rate limit reached", headers={"Retry-After": "3"}), "3"),
+    (openai.error.APIError("bad gateway"), None),
+])
+def test_completion_errors_end_the_stream_with_an_error_event(monkeypatch, error, retry_after):
+
+    async def failing_stream(question, **timeouts):
+        yield "token", "The first sentence is done. "
+        raise error
+
+    monkeypatch.setattr(server, "stream_nyc_answer", failing_stream)
+
+    async def post():
+        async with server.create_app().test_app() as app:
+            response = await app.test_client().post("/get_answer_stream", form={"question": "q", "language": "en"})
+            return (await response.get_data()).decode()
+
+    before = REQUESTS.values.get(("get_answer_stream", type(error).__name__), 0)
+    events = [block.split("\n") for block in asyncio.run(post()).strip().split("\n\n")]
+    assert [lines[0] for lines in events] == ["event: token", "event: error"]
+    error_event = json.loads(events[-1][1][len("data: "):])
+    assert error_event.get("retryAfter") == retry_after
+    assert REQUESTS.values[("get_answer_stream", type(error).__name__)] == before + 1
+
+
+class FakeSpeechToText:
+    def __init__(self):
+        self.calls = 0
+
+    def load(self):
+        return None
+
+    def transcribe(self, audio, rate, language=None):
+        self.calls += 1
+        return "How many complaints were filed in Brooklyn?"
+
+
+def post_audio(body):
+    quart_app = server.create_app()
+    speech_to_text = FakeSpeechToText()
+
+    async def post():
+        async with quart_app.test_app() as app:
+            quart_app.speech_to_text = speech_to_text
+            response = await app.test_client().post("/get_answer_audio?language=en", data=body)
+            return response.status_code
+
+    return asyncio.run(post()), speech_to_text.calls
+
+
+def test_audio_that_is_not_wav_is_unsupported_media():
+    status, transcribed = post_audio(b"ID3\x04\x00\x00\x00\x00\x00\x00" + b"\x00" * 1000)
+    assert (status, transcribed) == (415, 0)
+
+
+def test_audio_longer_than_the_cap_is_too_large(monkeypatch):
+    monkeypatch.setattr(server, "MAX_AUDIO_SECONDS", 1.0)
+    # A 2 s, 16 kHz, 16-bit mono WAV of a tone
+    samples = (0.5 * np.sin(2 * np.pi * 440 * np.arange(32000) / 16000) * 32767).astype("<i2")
+    body = io.BytesIO()
+    with wave.open(body, "wb") as out:
+        out.setnchannels(1)
+        out.setsampwidth(2)
+        out.setframerate(16000)
+        out.writeframes(samples.tobytes())
+    status, transcribed = post_audio(body.getvalue())
+    assert (status, transcribed) == (413, 0)
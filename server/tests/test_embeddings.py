@@ -0,0 +1,31 @@
+import pytest
+
+from embeddings import EmbeddingBatcher, HashEmbedder
+
+
+class ShortEmbedder(HashEmbedder):
+    # Drops the last vector of every batch, as a truncated provider response would
+    def embed_batch(self, texts):
+        return super().embed_batch(texts)[:-1]
+
+
+def test_batcher_fails_the_batch_on_a_short_reply_and_keeps_serving():
+    embedder = ShortEmbedder(dim=8)
+    batcher = EmbeddingBatcher(embedder, max_batch=2, max_wait=0.05)
+    futures = [batcher.submit("a"), batcher.submit("b")]
+    for future in futures:
+        with pytest.raises(ValueError):
+            future.result(timeout=5)
+    assert batcher.worker.is_alive()
+
+    batcher.embedder = HashEmbedder(dim=8)
+    assert len(batcher.submit("c").result(timeout=5)) == 8
+
+
+def test_batcher_embeds_identical_texts_once():
+    embedder = HashEmbedder(dim=8)
+    batcher = EmbeddingBatcher(embedder, max_batch=3, max_wait=0.05)
+    futures = [batcher.submit(text) for text in ("a", "b", "a")]
+    vectors = [future.result(timeout=5) for future in futures]
+    assert (vectors[0] == vectors[2]).all()
+    assert embedder.calls == 1
@@ -0,0 +1,160 @@
+import json
+import os
+
+import pytest
+
+import ingest
+from embeddings import HashEmbedder
+from ingest import (ChunkStore, NearDuplicateFilter, chunk_documents, dataset_documents, dataset_metadata_documents,
+                    embed_chunks, write_index)
+from retriever import CURRENT_VERSION_FILE, LocalRetriever
+
+DIM = 32
+
+
+def record(i):
+    return {"unique_key": str(i), "borough": "BROOKLYN", "complaint_type": f"complaint {i}"}
+
+
+def documents(count):
+    # Distinct enough that none is a near-duplicate of another
+    return [(f"page-{i}", f"Page {i} covers {' '.join(f'topic{i}x{j}' for j in range(12))}") for i in range(count)]
+
+
+def chunks_for(docs):
+    chunks, _ = chunk_documents(docs, max_tokens=400, overlap=0, dedupe=NearDuplicateFilter())
+    return chunks
+
+
+class FailingEmbedder(HashEmbedder):
+    # Dies on the given call, like a run killed part-way through
+    def __init__(self, fail_on):
+        super().__init__(dim=DIM)
+        self.fail_on = fail_on
+
+    def embed_batch(self, texts):
+        if self.calls + 1 == self.fail_on:
+            raise RuntimeError("interrupted")
+        return super().embed_batch(texts)
+
+
+@pytest.fixture
+def datasets(tmp_path):
+    folder = tmp_path / "311_data"
+    folder.mkdir()
+    (folder / "old-dump.json").write_text(json.dumps([record(i) for i in range(3)]))
+    with open(folder / "downloaded.ndjson", "w") as file:
+        for i in range(5):
+            file.write(json.dumps(record(i)) + "\n")
+        file.write("\n")
+    # A download in progress is not a dataset yet
+    (folder / "partial.ndjson.tmp").write_text(json.dumps(record(0)) + "\n")
+    return str(tmp_path)
+
+
+def test_dataset_documents_read_json_and_ndjson(datasets):
+    docs = dict(dataset_documents(datasets, rows_per_dataset=2))
+    assert sorted(os.path.basename(path) for path in docs) == ["downloaded.ndjson", "old-dump.json"]
+    for text in docs.values():
+        assert "Columns: borough, complaint_type, unique_key" in text
+        assert "complaint 1" in text and "complaint 2" not in text
+
+
+def test_dataset_metadata_documents_read_json_and_ndjson(datasets):
+    docs = list(dataset_metadata_documents(datasets))
+    assert sorted(os.path.basename(metadata["source"]) for _, _, metadata in docs) == ["downloaded.ndjson",
+                                                                                        "old-dump.json"]
+    assert all("complaint type" in text for _, text, _ in docs)
+
+
+def test_head_records_stops_reading_ndjson_at_the_limit(tmp_path):
+    path = tmp_path / "big.ndjson"
+    path.write_text("".join(json.dumps(record(i)) + "\n" for i in range(3)) + "not json\n")
+    assert [row["unique_key"] for row in ingest.head_records(str(path), 3)] == ["0", "1", "2"]
+
+
+def test_chunk_documents_drops_near_duplicates():
+    text = "Noise complaints in Brooklyn are handled by NYPD " + " ".join(f"detail{j}" for j in range(40))
+    docs = documents(3) + [("copy", text), ("copy-with-typo", text.replace("detail39", "detail39."))]
+    chunks, stats = chunk_documents(docs, max_tokens=400, overlap=0, dedupe=NearDuplicateFilter())
+    assert stats["docs"] == 5
+    assert stats["duplicates"] == 1
+    assert [chunk["source"] for chunk in chunks] == ["page-0", "page-1", "page-2", "copy"]
+
+
+def test_embed_chunks_resumes_after_an_interrupted_run(tmp_path):
+    store = ChunkStore(str(tmp_path / "chunks.sqlite"))
+    chunks = chunks_for(documents(6))
+
+    with pytest.raises(RuntimeError):
+        embed_chunks(store, FailingEmbedder(fail_on=2), chunks, batch_size=2, workers=1)
+    assert len(store.known(chunk["hash"] for chunk in chunks)) == 2
+
+    embedder = HashEmbedder(dim=DIM)
+    assert len(embed_chunks(store, embedder, chunks, batch_size=2, workers=1)) == 4
+    assert embedder.calls == 2
+    assert embed_chunks(store, embedder, chunks, batch_size=2, workers=1) == []
+    assert embedder.calls == 2
+
+
+def test_write_index_swaps_current_to_the_new_version(tmp_path, monkeypatch):
+    store = ChunkStore(str(tmp_path / "chunks.sqlite"))
+    output = str(tmp_path / "index")
+    embedder = HashEmbedder(dim=DIM)
+    first, second = chunks_for(documents(2)), chunks_for(documents(4))
+    embed_chunks(store, embedder, second, batch_size=8, workers=1)
+
+    monkeypatch.setattr(ingest, "version_name", lambda: "v1")
+    old_path = write_index(store, first, output)
+    monkeypatch.setattr(ingest, "version_name", lambda: "v2")
+    new_path = write_index(store, second, output)
+
+    with open(os.path.join(output, CURRENT_VERSION_FILE)) as file:
+        assert file.read() == "v2"
+    assert not os.path.exists(os.path.join(output, CURRENT_VERSION_FILE + ".tmp"))
+    assert new_path.endswith(os.path.join("versions", "v2"))
+    # Readers still holding the old version keep a complete index
+    assert len(LocalRetriever(old_path).ids) == 2
+    retriever = LocalRetriever(output)
+    assert len(retriever.ids) == 4
+    vector = embedder.embed_batch([second[3]["text"]])[0]
+    assert retriever.query(vector, top_k=1)[0]["metadata"]["source"] == "page-3"
+
+
+def test_write_index_never_rewrites_a_version(tmp_path, monkeypatch):
+    store = ChunkStore(str(tmp_path / "chunks.sqlite"))
+    output = str(tmp_path / "index")
+    chunks = chunks_for(documents(3))
+    embed_chunks(store, HashEmbedder(dim=DIM), chunks, batch_size=8, workers=1)
+
+    # Back to back, within the same second
+    first, second = write_index(store, chunks[:1], output), write_index(store, chunks, output)
+    assert first != second
+    assert len(LocalRetriever(first).ids) == 1
+
+    monkeypatch.setattr(ingest, "version_name", lambda: os.path.basename(second))
+    with pytest.raises(FileExistsError):
+        write_index(store, chunks[:1], output)
+    assert len(LocalRetriever(output).ids) == 3
+
+
+def test_write_index_without_chunks_keeps_current(tmp_path):
+    store = ChunkStore(str(tmp_path / "chunks.sqlite"))
+    output = str(tmp_path / "index")
+    chunks = chunks_for(documents(2))
+    embed_chunks(store, HashEmbedder(dim=DIM), chunks, batch_size=8, workers=1)
+    path = write_index(store, chunks, output)
+    with pytest.raises(ValueError):
+        write_index(store, [], output)
+    assert LocalRetriever(output).path == path
+
+
+def test_write_index_prunes_old_versions(tmp_path, monkeypatch):
+    store = ChunkStore(str(tmp_path / "chunks.sqlite"))
+    output = str(tmp_path / "index")
+    chunks = chunks_for(documents(2))
+    embed_chunks(store, HashEmbedder(dim=DIM), chunks, batch_size=8, workers=1)
+    for version in ("v1", "v2", "v3", "v4"):
+        monkeypatch.setattr(ingest, "version_name", lambda: version)
+        write_index(store, chunks, output, keep=2)
+    assert sorted(os.listdir(os.path.join(output, "versions"))) == ["v3", "v4"]
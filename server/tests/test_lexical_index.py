@@ -0,0 +1,33 @@
+import pytest
+
+from lexical_index import LexicalIndex
+
+
+def docs(texts):
+    return [(f"doc-{i}", text, {"page_text": text}) for i, text in enumerate(texts)]
+
+
+TEXTS = ["rat sightings in brooklyn", "noise complaint queens", "heat complaint bronx", "parking ticket appeal"]
+
+
+def test_scores_ignore_tombstoned_copies(tmp_path):
+    updated = LexicalIndex(str(tmp_path / "updated"))
+    updated.update(docs(TEXTS))
+    # Every document rewritten twice, still mentioning "complaint"
+    for revision in range(2):
+        updated.update(docs([f"{text} complaint revision {revision}" for text in TEXTS]))
+    fresh = LexicalIndex(str(tmp_path / "fresh"))
+    fresh.update(docs([f"{text} complaint revision 1" for text in TEXTS]))
+
+    assert updated.doc_count == fresh.doc_count == 4
+    expected = fresh.search("complaint heat", 4)
+    results = updated.search("complaint heat", 4)
+    assert [match["id"] for match in results] == [match["id"] for match in expected]
+    assert [match["score"] for match in results] == pytest.approx([match["score"] for match in expected])
+
+
+def test_removed_documents_are_not_returned(tmp_path):
+    index = LexicalIndex(str(tmp_path))
+    index.update(docs(TEXTS))
+    index.update(docs(TEXTS)[1:2], prune=True)
+    assert [match["id"] for match in index.search("complaint", 4)] == ["doc-1"]
@@ -0,0 +1,35 @@
+import asyncio
+import threading
+
+import pytest
+
+import rag_generation
+from admission import limiters
+
+
+def test_retrieval_slot_is_held_until_the_thread_finishes(monkeypatch):
+    unblock = threading.Event()
+
+    def slow_retrieval(question, k):
+        unblock.wait(5)
+        return "no context"
+
+    monkeypatch.setattr(rag_generation, "retrieve_context", slow_retrieval)
+    limiter = limiters["retrieval"]
+
+    async def scenario():
+        active = limiter.active
+        with pytest.raises(asyncio.TimeoutError):
+            await rag_generation.retrieve_context_async("question", timeout=0.01)
+        # The caller gave up, but the worker thread is still running
+        assert limiter.active == active + 1
+        unblock.set()
+        for _ in range(500):
+            if limiter.active == active:
+                break
+            await asyncio.sleep(0.01)
+        assert limiter.active == active
+        assert await rag_generation.retrieve_context_async("question") == "no context"
+        assert limiter.active == active
+
+    asyncio.run(scenario())
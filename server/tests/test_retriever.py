@@ -0,0 +1,46 @@
+import numpy as np
+
+import ingest
+import rag_generation
+from embeddings import HashEmbedder
+from ingest import ChunkStore, NearDuplicateFilter, chunk_documents, embed_chunks, write_index
+from retriever import LocalRetriever
+
+DIM = 32
+
+
+def publish(tmp_path, monkeypatch, version, texts):
+    store = ChunkStore(str(tmp_path / "chunks.sqlite"))
+    chunks, _ = chunk_documents([(f"page-{i}", text) for i, text in enumerate(texts)], max_tokens=400, overlap=0,
+                                dedupe=NearDuplicateFilter())
+    embed_chunks(store, HashEmbedder(dim=DIM), chunks, batch_size=8, workers=1)
+    monkeypatch.setattr(ingest, "version_name", lambda: version)
+    write_index(store, chunks, str(tmp_path / "index"))
+    return str(tmp_path / "index")
+
+
+def test_local_retriever_reloads_when_current_moves(tmp_path, monkeypatch):
+    output = publish(tmp_path, monkeypatch, "v1", ["first page about parking tickets"])
+    retriever = LocalRetriever(output)
+    assert retriever.reload() is retriever
+
+    publish(tmp_path, monkeypatch, "v2", ["first page about parking tickets", "second page about noise"])
+    assert retriever.latest_version() != retriever.version
+    reloaded = retriever.reload()
+    assert reloaded.version == reloaded.latest_version()
+    assert len(reloaded.ids) == 2 and len(retriever.ids) == 1
+
+
+def test_rebuilt_index_clears_the_answer_cache(tmp_path, monkeypatch):
+    output = publish(tmp_path, monkeypatch, "v1", ["first page about parking tickets"])
+    monkeypatch.setattr(rag_generation, "INDEX_CHECK_SECONDS", 0)
+    monkeypatch.setattr(rag_generation.retriever, "client", LocalRetriever(output))
+    vector = np.ones(DIM, dtype=np.float32)
+    assert rag_generation.cached_answer(vector, ["doc"]) is None
+    rag_generation.store_answer(vector, ["doc"], "answer", "sources", 1.0)
+    assert rag_generation.cached_answer(vector, ["doc"]).answer == "answer"
+
+    publish(tmp_path, monkeypatch, "v2", ["second page about noise"])
+    served = rag_generation.current_retriever()
+    assert served.path.endswith("v2") and rag_generation.retriever.get() is served
+    assert rag_generation.cached_answer(vector, ["doc"]) is None
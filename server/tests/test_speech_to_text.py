@@ -0,0 +1,81 @@
+import io
+import wave
+
+import numpy as np
+import pytest
+
+from speech_to_text import AudioError, StreamingResampler, WavStreamDecoder, trim_silence
+
+RATE = 44100
+
+
+def tone(seconds, rate=RATE, frequency=440, amplitude=0.5):
+    t = np.arange(int(seconds * rate)) / rate
+    return (amplitude * np.sin(2 * np.pi * frequency * t)).astype(np.float32)
+
+
+def wav_bytes(samples, rate=RATE, channels=1):
+    # 16-bit PCM; samples are interleaved when channels > 1
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as out:
+        out.setnchannels(channels)
+        out.setsampwidth(2)
+        out.setframerate(rate)
+        out.writeframes((samples * 32767).astype("<i2").tobytes())
+    return buffer.getvalue()
+
+
+def decode(body, chunk_size=None, **options):
+    decoder = WavStreamDecoder(**options)
+    chunk_size = chunk_size or len(body)
+    for start in range(0, len(body), chunk_size):
+        decoder.feed(body[start:start + chunk_size])
+    return decoder.audio()
+
+
+def test_decoder_fed_byte_at_a_time_matches_a_single_feed():
+    body = wav_bytes(np.repeat(tone(1.0), 2), channels=2)
+    whole = decode(body)
+    assert len(whole) == 16000
+    assert np.abs(decode(body, chunk_size=1) - whole).max() < 1e-12
+    assert np.abs(decode(body, chunk_size=7) - whole).max() < 1e-12
+
+
+def test_decoder_rejects_non_wav_and_overlong_audio():
+    with pytest.raises(AudioError) as error:
+        decode(b"ID3\x04\x00\x00\x00\x00\x00\x00" + b"\x00" * 100)
+    assert error.value.status == 415
+    with pytest.raises(AudioError) as error:
+        decode(wav_bytes(tone(2.0)), max_seconds=1)
+    assert error.value.status == 413
+
+
+def test_resampler_is_chunking_invariant_and_tracks_the_signal():
+    signal = tone(1.0)
+    whole = StreamingResampler(RATE, 16000).process(signal)
+    assert len(whole) == 16000
+    resampler = StreamingResampler(RATE, 16000)
+    pieces = np.concatenate([resampler.process(piece) for piece in np.array_split(signal, 37)])
+    assert np.abs(pieces - whole).max() < 1e-6
+    resampler = StreamingResampler(RATE, 16000)
+    samples = np.concatenate([resampler.process(signal[i:i + 1]) for i in range(len(signal))])
+    assert np.abs(samples - whole).max() < 1e-6
+    # Linear interpolation of a 440 Hz tone stays within a fraction of a percent of the tone itself
+    assert np.abs(whole - tone(1.0, rate=16000)).max() < 1e-3
+
+
+def test_resampler_passes_through_at_the_target_rate():
+    signal = tone(0.1, rate=16000)
+    assert StreamingResampler(16000, 16000).process(signal) is signal
+
+
+def test_trim_silence_keeps_speech_and_drops_silence():
+    rate = 16000
+    assert len(trim_silence(np.zeros(rate, dtype=np.float32), rate)) == 0
+    noise = np.random.default_rng(0).normal(0, 1e-4, 3 * rate).astype(np.float32)
+    assert len(trim_silence(noise, rate)) == 0
+    speech = noise.copy()
+    speech[rate:2 * rate] += tone(1.0, rate=rate)
+    trimmed = trim_silence(speech, rate)
+    # One second of tone plus up to 200 ms of padding on each side
+    assert rate <= len(trimmed) <= 1.5 * rate
@@ -0,0 +1,32 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import app as server
+import tokenizer
+
+SERVER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_importing_the_server_does_not_build_the_encoding():
+    # A fresh interpreter: tests that already counted tokens have built it in this one
+    script = "import app, tokenizer; assert tokenizer.encoding.cache_info().currsize == 0"
+    subprocess.run([sys.executable, "-c", script], cwd=SERVER, check=True,
+                   env=dict(os.environ, WARMUP=""))
+
+
+def test_fallback_over_counts_and_splits_within_budget(monkeypatch):
+    monkeypatch.setattr(tokenizer, "encoding", lambda: None)
+    text = "Heat complaints in Brooklyn rose 12% in 2023."
+    assert tokenizer.count_tokens(text) > len(text.split())
+    chunks = list(tokenizer.split_tokens(text, max_tokens=5, overlap=1))
+    assert all(tokenizer.count_tokens(chunk) <= 5 for chunk in chunks)
+    assert chunks[0].startswith("Heat") and chunks[-1].endswith(".")
+
+
+def test_warm_up_reports_a_missing_encoding(monkeypatch):
+    monkeypatch.setattr(tokenizer, "encoding", lambda: None)
+    with pytest.raises(RuntimeError):
+        server.warm_up_tokenizer()
@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from translation import TranslationCache, TranslationClient, TranslationError
+
+
+class StubTranslator:
+    # LibreTranslate-shaped: a list "q" is answered with a list, and "auto" detects Spanish
+    def __init__(self):
+        self.requests = []
+        self.reply = None
+
+    async def handle(self, request):
+        body = await request.json()
+        self.requests.append(body)
+        if self.reply is not None:
+            return web.json_response(self.reply(body))
+        response = {"translatedText": [f"[{body['target']}] {text}" for text in body["q"]]}
+        if body["source"] == "auto":
+            response["detectedLanguage"] = [{"language": "es", "confidence": 90.0} for _ in body["q"]]
+        return web.json_response(response)
+
+
+def run(stub, scenario, cache=None):
+    async def main():
+        app = web.Application()
+        app.router.add_post("/translate", stub.handle)
+        async with TestServer(app) as server:
+            client = TranslationClient(url=str(server.make_url("/translate")), cache=cache)
+            await client.start()
+            try:
+                return await scenario(client)
+            finally:
+                await client.close()
+
+    return asyncio.run(main())
+
+
+def test_repeated_and_blank_segments_are_served_without_a_request():
+    stub = StubTranslator()
+
+    async def scenario(client):
+        first = await client.translate_many(["hello", "", "world", "hello"], "en", "es")
+        second = await client.translate_paragraphs("world\n\nhello", "en", "es")
+        return first, second
+
+    first, second = run(stub, scenario)
+    assert first == ["[es] hello", "", "[es] world", "[es] hello"]
+    assert second == "[es] world\n\n[es] hello"
+    assert [request["q"] for request in stub.requests] == [["hello", "world"]]
+
+
+def test_detected_language_is_reused():
+    stub = StubTranslator()
+
+    async def scenario(client):
+        await client.translate("hola", "auto", "en")
+        # Known to be Spanish now, so neither call goes back to the server
+        return await client.translate("hola", "auto", "en"), await client.translate("hola", "es", "en")
+
+    assert run(stub, scenario) == ("[en] hola", "[en] hola")
+    assert len(stub.requests) == 1
+
+
+@pytest.mark.parametrize("reply", [
+    lambda body: {"translatedText": "one string"},
+    lambda body: {"translatedText": body["q"][:-1]},
+])
+def test_mismatched_reply_fails_and_caches_nothing(tmp_path, reply):
+    stub = StubTranslator()
+    stub.reply = reply
+    path = str(tmp_path / "translations.sqlite")
+
+    async def scenario(client):
+        with pytest.raises(TranslationError):
+            await client.translate_paragraphs("first\n\nsecond", "en", "es")
+
+    run(stub, scenario, cache=TranslationCache(path))
+    cache = TranslationCache(path)
+    assert cache.get("first", "en", "es") is None and cache.get("second", "en", "es") is None
@@ -1,25 +1,146 @@
 import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict
 from msspeech import MSSpeech
+from admission import upstream
+from clients import LazyClient
+from telemetry import span
+
+# Locale used for a bare language code; other languages fall back to "xx-XX" and then to any
+# voice of that language
+DEFAULT_LOCALES = {
+    "en": "en-US", "zh": "zh-CN", "ja": "ja-JP", "ko": "ko-KR", "ar": "ar-SA", "hi": "hi-IN", "bn": "bn-IN",
+    "es": "es-ES", "pt": "pt-BR", "ur": "ur-PK", "uk": "uk-UA", "he": "he-IL", "el": "el-GR", "sv": "sv-SE",
+    "da": "da-DK", "cs": "cs-CZ", "fa": "fa-IR", "vi": "vi-VN", "sw": "sw-KE",
+}
+FALLBACK_LANGUAGE = "en"
+
+
+class AudioBuffer:
+    # MSSpeech awaits write() on buffers, so a plain BytesIO cannot be used
+    def __init__(self):
+        self.chunks = []
+
+    async def write(self, data):
+        self.chunks.append(data)
+        return len(data)
+
+    def getvalue(self):
+        return b"".join(self.chunks)
+
+
+class VoiceCatalog:
+    def __init__(self, ttl=24 * 3600, speech=MSSpeech):
+        self.ttl = ttl
+        self.speech = speech
+        self.voices = {}
+        self.loaded_at = None
+        self.lock = asyncio.Lock()
+
+    async def refresh(self):
+        voices = await self.speech().get_voices_list()
+        # Later entries win, matching the old loop that called set_voice on every match
+        self.voices = {voice["Locale"].lower(): voice["Name"] for voice in voices}
+        self.loaded_at = time.monotonic()
+
+    async def voice_for(self, language):
+        # "en", "zh-CN" or "en-US" -> a voice name, or None when the language has no voice
+        if self.loaded_at is None or time.monotonic() - self.loaded_at > self.ttl:
+            async with self.lock:
+                if self.loaded_at is None or time.monotonic() - self.loaded_at > self.ttl:
+                    await self.refresh()
+        language = language.lower()
+        prefix = language.split("-")[0]
+        for locale in (language, DEFAULT_LOCALES.get(prefix, ""), f"{prefix}-{prefix}"):
+            if locale in self.voices:
+                return self.voices[locale]
+        return next((name for locale, name in self.voices.items() if locale.startswith(prefix + "-")), None)
+
+
+class TextToSpeech:
+    def __init__(self, catalog=None, pool_size=4, rate=10, pitch=0, volume=1.0, cache_bytes=64 * 1024 * 1024,
+                 speech=MSSpeech):
+        # speech: the synthesizer class; benchmarks pass a local stand-in with the same interface
+        self.speech = speech
+        self.catalog = catalog or VoiceCatalog(speech=speech)
+        self.rate = rate
+        self.pitch = pitch
+        self.volume = volume
+        # MSSpeech opens its own websocket per synthesis, so the pool bounds concurrent
+        # connections and reuses configured synthesizer objects rather than sockets
+        self.slots = asyncio.Semaphore(pool_size)
+        self.idle = []
+        self.cache = OrderedDict()
+        self.cache_bytes = cache_bytes
+        self.cached_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    async def checkout(self, voice):
+        if self.idle:
+            mss = self.idle.pop()
+        else:
+            mss = self.speech()
+            await mss.set_rate(self.rate)
+            await mss.set_pitch(self.pitch)
+            await mss.set_volume(self.volume)
+        # Set on every checkout, so a pooled synthesizer never keeps the previous request's voice.
+        # Assigned directly: set_voice() re-scans the full voice list on every call.
+        mss.voiceName = voice
+        return mss
+
+    async def voice_for(self, language):
+        voice = await self.catalog.voice_for(language) or await self.catalog.voice_for(FALLBACK_LANGUAGE)
+        if voice is None:
+            raise LookupError(f"No voice for {language!r} or {FALLBACK_LANGUAGE!r}")
+        return voice
+
+    def remember(self, key, audio):
+        self.cache[key] = audio
+        self.cached_bytes += len(audio)
+        while self.cached_bytes > self.cache_bytes and self.cache:
+            _, evicted = self.cache.popitem(last=False)
+            self.cached_bytes -= len(evicted)
+
+    async def synthesize(self, text, language):
+        text = text.strip()
+        voice = await self.voice_for(language)
+        key = (hashlib.sha256(text.encode("utf-8")).hexdigest(), voice, self.rate)
+        audio = self.cache.get(key)
+        if audio is not None:
+            self.cache.move_to_end(key)
+            self.hits += 1
+            return audio
+
+        self.misses += 1
+        # The limiter bounds the queue and applies TTS_RATE; the pool slots bound open sockets
+        async with upstream("tts"), self.slots:
+            mss = await self.checkout(voice)
+            try:
+                buffer = AudioBuffer()
+                with span("tts", characters=len(text)):
+                    await mss.synthesize(text, buffer)
+            finally:
+                self.idle.append(mss)
+        audio = buffer.getvalue()
+        self.remember(key, audio)
+        return audio
+
+
+def create_tts():
+    return TextToSpeech(pool_size=int(os.getenv("TTS_POOL_SIZE", "4")),
+                        cache_bytes=int(os.getenv("TTS_CACHE_BYTES", str(64 * 1024 * 1024))))
+
+
+tts = LazyClient("tts", create_tts)
 
 
 async def generate_audio(translated_text, language):
-    language = language.lower() + "-" + language.upper()
-    mss = MSSpeech()
-    print("Geting voices...")
-    voices = await mss.get_voices_list()
-    print("searching Russian voice...")
-    for voice in voices:
-        if voice["Locale"] == language:
-            await mss.set_voice(voice["Name"])
-
-    print("*" * 10)
-    filename = "audio.mp3"
-    print("waiting...")
-    await mss.set_rate(10)
-    await mss.set_pitch(0)
-    await mss.set_volume(1.0)
-    await mss.synthesize(translated_text.strip(), filename)
-    print("*"*10)
-    print("SUCCESS! OK!")
-    print("*"*10)
-    print("playing...")
+    # Returns the MP3 bytes for this request; nothing is written to a shared file
+    return await tts.get().synthesize(translated_text, language)
+
+
+async def synthesize_segment(text, language):
+    return await tts.get().synthesize(text, language)
@@ -0,0 +1,50 @@
+import functools
+import logging
+import re
+
+log = logging.getLogger(__name__)
+
+WORD = re.compile(r"\w+|[^\w\s]")
+PIECE = re.compile(r"[A-Za-z0-9_]{1,3}|[^\sA-Za-z0-9_]")
+
+
+@functools.cache
+def encoding():
+    # tiktoken gives exact counts for the OpenAI models. It downloads its BPE file the first time,
+    # so the encoding is built on first use (the server does it during warm-up), never at import.
+    # Without it, every run of up to three ASCII letters or digits and every other non-space
+    # character counts as a token: BPE tokens of English average about four characters, so this
+    # over-counts and budgets err on the safe side.
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        log.warning(f"tiktoken encoding unavailable, token counts are estimated: {e}")
+        return None
+
+
+def tokenize(text):
+    exact = encoding()
+    if exact is not None:
+        return exact.encode(text)
+    return PIECE.findall(text)
+
+
+def count_tokens(text):
+    return len(tokenize(text))
+
+
+def split_tokens(text, max_tokens, overlap=0):
+    # Yields chunks of at most max_tokens tokens; consecutive chunks share `overlap` tokens
+    step = max(max_tokens - overlap, 1)
+    exact = encoding()
+    if exact is not None:
+        tokens = exact.encode(text)
+        for start in range(0, max(len(tokens) - overlap, 1), step):
+            yield exact.decode(tokens[start:start + max_tokens])
+        return
+    spans = [match.span() for match in PIECE.finditer(text)]
+    for start in range(0, max(len(spans) - overlap, 1), step):
+        window = spans[start:start + max_tokens]
+        if window:
+            yield text[window[0][0]:window[-1][1]]
@@ -0,0 +1,177 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import aiohttp
+
+from admission import upstream
+
+
+def text_key(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class TranslationCache:
+    # In-memory LRU in front of a SQLite table keyed by (text hash, source, target)
+
+    def __init__(self, path=None, max_items=20000):
+        self.max_items = max_items
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("CREATE TABLE IF NOT EXISTS translations "
+                            "(key TEXT, source TEXT, target TEXT, text TEXT, PRIMARY KEY (key, source, target))")
+            self.db.commit()
+
+    def remember(self, key, text):
+        self.memory[key] = text
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_items:
+            self.memory.popitem(last=False)
+
+    def get(self, text, source, target):
+        key = (text_key(text), source, target)
+        with self.lock:
+            cached = self.memory.get(key)
+            if cached is None and self.db is not None:
+                row = self.db.execute("SELECT text FROM translations WHERE key = ? AND source = ? AND target = ?",
+                                      key).fetchone()
+                if row is not None:
+                    cached = row[0]
+                    self.remember(key, cached)
+            if cached is None:
+                self.misses += 1
+                return None
+            self.memory.move_to_end(key)
+            self.hits += 1
+            return cached
+
+    def put_many(self, items, source, target):
+        rows = [(text_key(text), source, target, translated) for text, translated in items]
+        with self.lock:
+            for key, _, _, translated in rows:
+                self.remember((key, source, target), translated)
+            if self.db is not None:
+                self.db.executemany("INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?)", rows)
+                self.db.commit()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+class TranslationError(aiohttp.ClientError):
+    # A reply that does not match the request; reported as an upstream failure like any other
+    pass
+
+
+class TranslationClient:
+    # LibreTranslate-compatible client; "q" may be a list, which translates many segments in one call
+
+    def __init__(self, url=None, cache=None, timeout=10, session=None):
+        self.url = url or os.getenv("TRANSLATION_URL", "http://burro.mlsp.cs.cmu.edu:5000/translate")
+        self.cache = cache or TranslationCache()
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.session = session
+        self.owns_session = session is None
+        # Languages detected for "auto" requests, so the same text is never detected twice
+        self.detected = OrderedDict()
+        self.requests = 0
+
+    async def start(self):
+        if self.session is None:
+            self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=50), timeout=self.timeout)
+
+    async def close(self):
+        if self.owns_session and self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def remember_detection(self, text, language):
+        self.detected[text_key(text)] = language
+        while len(self.detected) > 10000:
+            self.detected.popitem(last=False)
+
+    def detected_language(self, text):
+        return self.detected.get(text_key(text))
+
+    async def post(self, texts, source, target):
+        payload = {"q": texts, "source": source, "target": target, "format": "text"}
+        self.requests += 1
+        async with upstream("translation"), self.session.post(self.url, json=payload) as response:
+            response.raise_for_status()
+            body = await response.json()
+        translated = body.get("translatedText")
+        # Checked before anything is cached: a string or a short list would pair texts with the wrong
+        # translations, and the SQLite cache would keep serving them after a restart
+        if not isinstance(translated, list) or len(translated) != len(texts):
+            count = len(translated) if isinstance(translated, list) else type(translated).__name__
+            raise TranslationError(f"Translation server returned {count} translations for {len(texts)} texts")
+        detected = body.get("detectedLanguage")
+        if source == "auto" and detected:
+            detected = detected if isinstance(detected, list) else [detected]
+            for text, language in zip(texts, detected):
+                self.remember_detection(text, language.get("language"))
+        return translated
+
+    async def translate_many(self, texts, source, target):
+        if source == "auto":
+            # A text whose language is already known is served from the concrete-language cache
+            source_for = [self.detected_language(text) or "auto" for text in texts]
+        else:
+            source_for = [source] * len(texts)
+
+        results = [None] * len(texts)
+        missing = {}
+        for i, text in enumerate(texts):
+            if not text.strip() or source_for[i] == target:
+                results[i] = text
+                continue
+            cached = self.cache.get(text, source_for[i], target)
+            if cached is not None:
+                results[i] = cached
+            else:
+                missing.setdefault((source_for[i], text), []).append(i)
+
+        by_source = {}
+        for (text_source, text), positions in missing.items():
+            by_source.setdefault(text_source, []).append((text, positions))
+        for text_source, entries in by_source.items():
+            unique_texts = [text for text, _ in entries]
+            translated = await self.post(unique_texts, text_source, target)
+            self.cache.put_many(zip(unique_texts, translated), text_source, target)
+            for (text, positions), value in zip(entries, translated):
+                for i in positions:
+                    results[i] = value
+                language = self.detected_language(text) if text_source == "auto" else None
+                if language:
+                    self.cache.put_many([(text, value)], language, target)
+        return results
+
+    async def translate(self, text, source, target):
+        return (await self.translate_many([text], source, target))[0]
+
+    async def translate_paragraphs(self, text, source, target):
+        # Paragraph-level segments let unchanged boilerplate hit the cache
+        paragraphs = text.split("\n\n")
+        return "\n\n".join(await self.translate_many(paragraphs, source, target))
+
+    def stats(self):
+        return {**self.cache.stats(), "requests": self.requests}
+
+
+# Next to this module by default, wherever the server was started from
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "translation_cache.sqlite")
+
+
+def create_translation_client():
+    cache = TranslationCache(os.getenv("TRANSLATION_CACHE_PATH", DEFAULT_CACHE_PATH),
+                             max_items=int(os.getenv("TRANSLATION_CACHE_SIZE", "20000")))
+    return TranslationClient(cache=cache, timeout=float(os.getenv("TRANSLATION_TIMEOUT", "10")))